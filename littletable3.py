@@ -108,9 +108,10 @@ __version__ = "0.6"
 __versionTime__ = "13 Dec 2011 06:45"
 __author__ = "Paul McGuire <ptmcg@users.sourceforge.net>"
 
-import sys, re, csv, hashlib, json, copy
-from collections import defaultdict
-from itertools import groupby,ifilter,islice,starmap,repeat
+import sys, re, csv, hashlib, json, copy, array, bisect, operator, heapq, types, binascii, math
+from collections import defaultdict, OrderedDict
+from functools import wraps
+from itertools import groupby,ifilter,imap,islice,starmap,repeat,izip,count
 
 # import funcs for Table.groupby/addsummaryrow(rollupfields)
 from reporting_funcs import *    # pylint:disable=W0401
@@ -125,6 +126,13 @@ try:
 except ImportError:
     pass
 
+# process pool for parallel joins - concurrent.futures if available, else multiprocessing
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+    import multiprocessing
+
 try:
     from itertools import product
 except ImportError:
@@ -138,7 +146,8 @@ try:
 except NameError:
     basestring = str  # pylint:disable=W0622
 
-__all__ = ["DataObject", "Table", "JoinTerm", "PivotTable"]
+__all__ = ["DataObject", "Table", "TableView", "Query", "JoinTerm", "PivotTable", "record_class",
+           "ResultCache", "col", "lit"]
 
 def _object_attrnames(obj):
     if hasattr(obj, "__dict__"):
@@ -152,6 +161,12 @@ def _object_attrnames(obj):
     else:
         raise ValueError("object with unknown attributes")
 
+def _object_asdict(obj):
+    if hasattr(obj, "__dict__"):
+        return obj.__dict__
+    return dict((name, getattr(obj, name)) for name in _object_attrnames(obj)
+                if hasattr(obj, name))
+
 class DataObject(object):
     """A generic semi-mutable object for storing data values in a table. Attributes
        can be set by passing in named arguments in the constructor, or by setting them
@@ -172,15 +187,317 @@ class DataObject(object):
         else:
             raise KeyError("object has no such attribute " + k)
 
+class _SlottedRecord(object):
+    """Base class for the compact record classes created by L{record_class}.  Attribute
+       values are kept in C{__slots__} instead of a per-instance C{__dict__}, and can be
+       assigned and updated directly."""
+    __slots__ = ()
+    def __init__(self, **kwargs):
+        for attr, val in kwargs.items():
+            setattr(self, attr, val)
+    def _asdict(self):
+        return dict((attr, getattr(self, attr)) for attr in self.__slots__ if hasattr(self, attr))
+    def __repr__(self):
+        return repr(self._asdict())
+    def __getitem__(self, k):
+        if hasattr(self,k):
+            return getattr(self,k)
+        else:
+            raise KeyError("object has no such attribute " + k)
+    def __getstate__(self):
+        return self._asdict()
+    def __setstate__(self, state):
+        for attr, val in state.items():
+            setattr(self, attr, val)
+
+_RECORD_CLASSES = {}
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def record_class(fieldnames):
+    """Return a C{__slots__}-based record class for the given attribute names.  Classes are
+       cached, so that all tables with the same schema share one record class.
+       @param fieldnames: attribute names, as a list or a space/comma-delimited string
+       """
+    fields = []
+    for fld in parse_colnames(fieldnames):
+        if not _IDENTIFIER_RE.match(fld):
+            raise ValueError("record fields must be valid identifiers: %r" % fld)
+        if fld not in fields:
+            fields.append(fld)
+    fields = tuple(fields)
+    if fields not in _RECORD_CLASSES:
+        _RECORD_CLASSES[fields] = type("Record", (_SlottedRecord,), {"__slots__": fields})
+    return _RECORD_CLASSES[fields]
+
+def _record_type(fieldnames, slotted):
+    """record class to use for newly built rows: a slotted record class if requested and
+       possible, otherwise DataObject."""
+    if slotted and all(_IDENTIFIER_RE.match(fld) for fld in fieldnames):
+        return record_class(fieldnames)
+    return DataObject
+
+class _ColumnStore(object):
+    """Column-oriented storage used in place of the row list by Tables created with
+       C{columnar=True}.  Each attribute is kept as its own contiguous column: an
+       C{array.array} while every value in it is an int (or every value a float), and a
+       plain list otherwise.  Rows are only built, as new DataObjects, when the store is
+       indexed or iterated - so they are snapshots, and changes to column values must go
+       through L{Table.addfield}.  Attributes missing from a record are stored as None."""
+    _typecodes = {int: 'l', float: 'd'}
+    _pytypes = {'l': int, 'd': float}
+
+    def __init__(self, rows=None):
+        self._cols = {}
+        self.fields = []
+        self._len = 0
+        if rows:
+            self.extend(rows)
+
+    def __len__(self):
+        return self._len
+
+    def _row(self, i):
+        cols = self._cols
+        return DataObject(**dict((f, cols[f][i]) for f in self.fields))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(j) for j in xrange(*i.indices(self._len))]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("column store index out of range")
+        return self._row(i)
+
+    def __iter__(self):
+        fields = self.fields
+        for vals in izip(*[self._cols[f] for f in fields]):
+            yield DataObject(**dict(izip(fields, vals)))
+
+    def __delitem__(self, i):
+        numdeleted = len(xrange(*i.indices(self._len))) if isinstance(i, slice) else 1
+        for col in self._cols.values():
+            del col[i]
+        self._len -= numdeleted
+
+    def __iadd__(self, rows):
+        self.extend(rows)
+        return self
+
+    def _append_value(self, attr, val):
+        col = self._cols[attr]
+        if isinstance(col, array.array):
+            if type(val) is self._pytypes[col.typecode]:
+                try:
+                    col.append(val)
+                    return
+                except OverflowError:
+                    pass
+            col = self._cols[attr] = col.tolist()
+        elif not col and type(val) in self._typecodes:
+            col = self._cols[attr] = array.array(self._typecodes[type(val)])
+        col.append(val)
+
+    def append(self, obj):
+        row = _object_asdict(obj)
+        for attr in row:
+            if attr not in self._cols:
+                self.fields.append(attr)
+                self._cols[attr] = [None] * self._len
+        for attr in self.fields:
+            self._append_value(attr, row.get(attr))
+        self._len += 1
+
+    def extend(self, rows):
+        for obj in rows:
+            self.append(obj)
+
+    def column(self, attr):
+        """Return the underlying column (array or list) for an attribute."""
+        try:
+            return self._cols[attr]
+        except KeyError:
+            raise AttributeError("no such column '%s'" % attr)
+
+    def set_column(self, attr, vals):
+        """Replace (or add) a column from a sequence of values, one per row."""
+        if attr not in self._cols:
+            self.fields.append(attr)
+        self._cols[attr] = []
+        for val in vals:
+            self._append_value(attr, val)
+
+    def rows_where(self, attr, val):
+        """Build the rows whose C{attr} column equals C{val}."""
+        col = self._cols.get(attr)
+        if col is None:
+            return []
+        return [self._row(i) for i, colval in enumerate(col) if colval == val]
+
+    def rows_masked(self, mask):
+        """Build the rows whose entry in C{mask} is true."""
+        return [self._row(i) for i, keep in enumerate(mask) if keep]
+
+    def remove(self, obj):
+        row = _object_asdict(obj)
+        cols = [(self._cols[f], row.get(f)) for f in self.fields]
+        for i in xrange(self._len):
+            if all(col[i] == val for col, val in cols):
+                del self[i]
+                return
+        raise ValueError("_ColumnStore.remove(x): x not in store")
+
+    def compress(self, mask):
+        """Keep only the rows whose entry in C{mask} is true, in one pass per column."""
+        for attr, col in self._cols.items():
+            kept = [val for val, keep in izip(col, mask) if keep]
+            self._cols[attr] = array.array(col.typecode, kept) if isinstance(col, array.array) else kept
+        self._len = sum(1 for keep in mask if keep)
+
+    def sort(self, key=None, reverse=False):
+        keys = [key(row) for row in self] if key else list(self)
+        order = sorted(xrange(self._len), key=keys.__getitem__, reverse=reverse)
+        for attr, col in self._cols.items():
+            if isinstance(col, array.array):
+                self._cols[attr] = array.array(col.typecode, (col[i] for i in order))
+            else:
+                self._cols[attr] = [col[i] for i in order]
+
+def _key_getter(attr):
+    """function returning an object's index key: the attribute value, or for a composite
+       index (attr given as a tuple of names) the tuple of attribute values."""
+    if isinstance(attr, tuple):
+        return operator.attrgetter(*attr)
+    return operator.attrgetter(attr)
+
+def _index_keys(ind, obs):
+    """index keys for a list of objects, using None for objects missing an indexed attribute."""
+    keyof = ind.keyof
+    keys = []
+    for ob in obs:
+        try:
+            keys.append(keyof(ob))
+        except AttributeError:
+            keys.append(None)
+    return keys
+
+def _attr_label(attr):
+    return ",".join(attr) if isinstance(attr, tuple) else attr
+
+class _IndexStats(object):
+    """Statistics of the keys in an index, for estimating how many records match a
+       criterion: the number of records, of records with a None key, and of distinct
+       non-None keys, the most frequent keys, and an equi-depth histogram of the
+       non-None keys (the largest key and the cumulative record count of each bucket)."""
+    TOP_N = 10
+    NUM_BUCKETS = 20
+
+    def __init__(self, ind):
+        self.mods = ind._mods
+        counts = ind.key_counts()
+        self.nulls = sum(n for k, n in counts if k is None)
+        counts = [(k, n) for k, n in counts if k is not None]
+        self.count = self.nulls + sum(n for k, n in counts)
+        self.distinct = len(counts)
+        self.top = heapq.nlargest(self.TOP_N, counts, key=operator.itemgetter(1))
+        self.bounds = []
+        self.cumulative = []
+        depth = max(1, (self.count - self.nulls) // self.NUM_BUCKETS)
+        running = filled = 0
+        counts.sort()
+        for k, n in counts:
+            running += n
+            filled += n
+            if filled >= depth:
+                self.bounds.append(k)
+                self.cumulative.append(running)
+                filled = 0
+        if filled:
+            self.bounds.append(counts[-1][0])
+            self.cumulative.append(running)
+
+    def average(self):
+        """average number of records per distinct non-None key."""
+        return float(self.count - self.nulls) / self.distinct if self.distinct else 0.0
+
+    def _rows_below(self, key):
+        i = bisect.bisect_left(self.bounds, key)
+        if i == len(self.bounds):
+            return self.count - self.nulls
+        below = self.cumulative[i-1] if i else 0
+        # assume half of the records in the bucket containing key lie below it
+        return below + (self.cumulative[i] - below) // 2
+
+    def range_count(self, lo=None, hi=None):
+        """estimated number of records with keys between lo and hi (None = unbounded)."""
+        upper = self.count - self.nulls if hi is None else self._rows_below(hi)
+        lower = 0 if lo is None else self._rows_below(lo)
+        return max(upper - lower, 0)
+
+    def asdict(self):
+        return dict(count=self.count, distinct=self.distinct, nulls=self.nulls, top=self.top,
+                    histogram=zip(self.bounds, self.cumulative))
+
 class _ObjIndex(object):
+    # number of changes to the index, for deciding when its statistics are out of date
+    _mods = 0
+    _stats = None
+    # number of lookups answered by the index, for Table.index_report
+    uses = 0
+    is_bitmap = False
+    is_tokens = False
+    is_prefix = False
+
     def __init__(self, attr):
         self.attr = attr
+        self.keyof = _key_getter(attr)
         self.obs = defaultdict(list)
         self.is_unique = False
+        self.is_ordered = False
     def __setitem__(self, k, v):
         self.obs[k].append(v)
+        self._mods += 1
     def __getitem__(self, k):
         return self.obs.get(k,[])
+    def count(self, k):
+        """number of objects with key k, without building a list of them"""
+        return len(self.obs.get(k, ()))
+    def key_counts(self):
+        return [(k, len(bucket)) for k, bucket in self.obs.iteritems()]
+    def stats(self):
+        """statistics of the index keys (see L{_IndexStats}), recomputed once the index
+           has changed by more than about 10%"""
+        st = self._stats
+        if st is None or self._mods - st.mods > max(100, st.count // 10):
+            st = self._stats = _IndexStats(self)
+        return st
+    def eq_count(self, k):
+        """number of objects matching a where() equality criterion on this index;
+           indexes built by Table.create_index file all false keys under None"""
+        n = self.count(k)
+        if not k and k is not None and not (self.is_ordered or self.is_unique):
+            n += self.count(None)
+        return n
+    def estimate(self, op, val):
+        """estimated number of objects matching the where() criterion C{attr__op=val},
+           or None if it cannot be estimated from the index"""
+        if op == "eq":
+            return self.eq_count(val)
+        if op == "in":
+            return sum(self.eq_count(v) for v in _value_set(val))
+        st = self.stats()
+        if op == "ne":
+            return st.count - self.eq_count(val)
+        if op == "isnull":
+            return st.nulls if val else st.count - st.nulls
+        if op in ("gt", "ge", "lt", "le", "between"):
+            return st.range_count(*_range_bounds(op, val)[:2])
+        if op == "startswith" and isinstance(val, basestring) and val:
+            return st.range_count(val, _prefix_upper_bound(val))
+        if op == "like" and isinstance(val, basestring) and _like_pattern(val)[0]:
+            prefix = _like_pattern(val)[0]
+            return st.range_count(prefix, _prefix_upper_bound(prefix))
+        return None
     def __len__(self):
         return len(self.obs)
     def __iter__(self):
@@ -191,20 +508,64 @@ class _ObjIndex(object):
         return self.obs.items()
     def remove(self, obj):
         try:
-            k = getattr(obj, self.attr)
-            self.obs[k].remove(obj)
-        except (ValueError,AttributeError,KeyError):
-            pass
+            k = self.keyof(obj)
+        except AttributeError:
+            k = None
+        # Table.create_index files false keys and missing attributes under None
+        for k in ((k, None) if k is not None and not k else (k,)):
+            bucket = self.obs.get(k)
+            if bucket:
+                for i, ob in enumerate(bucket):
+                    if ob is obj:
+                        del bucket[i]
+                        self._mods += 1
+                        if not bucket:
+                            del self.obs[k]
+                        return
+    def remove_many(self, objs):
+        """Removes a batch of objects, filtering each affected key's list once;
+           returns the keys that no longer have any objects."""
+        idsbykey = defaultdict(set)
+        for obj in objs:
+            try:
+                k = self.keyof(obj)
+            except AttributeError:
+                k = None
+            idsbykey[k].add(id(obj))
+        self._mods += sum(len(ids) for ids in idsbykey.itervalues())
+        # Table.create_index files false keys and missing attributes under None
+        for k in [k for k in idsbykey if k is not None and not k]:
+            idsbykey[None].update(idsbykey[k])
+        emptied = []
+        for k, ids in idsbykey.items():
+            bucket = self.obs.get(k)
+            if bucket:
+                bucket[:] = [ob for ob in bucket if id(ob) not in ids]
+                if not bucket:
+                    del self.obs[k]
+                    emptied.append(k)
+        return emptied
+    def extend(self, keys, objs):
+        """Adds a batch of objects, given with their precomputed keys."""
+        obs = self.obs
+        for k, obj in izip(keys, objs):
+            obs[k].append(obj)
+        self._mods += len(keys)
     def __contains__(self, key):
         return key in self.obs
+    def bind(self, rows):
+        """attach the index to its table's list of objects (only used by bitmap indexes)"""
+        return self
     def copy_template(self):
         return self.__class__(self.attr)
         
 class _UniqueObjIndex(_ObjIndex):
     def __init__(self, attr, accept_none=False):
         self.attr = attr
+        self.keyof = _key_getter(attr)
         self.obs = {}
         self.is_unique = True
+        self.is_ordered = False
         self.accept_none = accept_none
         self.none_values = set()
     def __setitem__(self, k, v):
@@ -215,6 +576,7 @@ class _UniqueObjIndex(_ObjIndex):
                 raise KeyError("duplicate key value %s" % k)
         else:
             self.none_values.add(v)
+        self._mods += 1
     def __getitem__(self, k):
         if k:
             return [self.obs.get(k)] if k in self.obs else []
@@ -225,17 +587,956 @@ class _UniqueObjIndex(_ObjIndex):
             return k in self.obs
         else:
             return self.accept_none and self.none_values
+    def count(self, k):
+        if k:
+            return 1 if k in self.obs else 0
+        return len(self.none_values)
+    def key_counts(self):
+        counts = [(k, 1) for k in self.obs]
+        if self.none_values:
+            counts.append((None, len(self.none_values)))
+        return counts
     def keys(self):
         return sorted(self.obs.keys()) + ([None,] if self.none_values else [])
     def items(self):
         return [(k,[v]) for k,v in self.obs.items()]
     def remove(self, obj):
-        k = getattr(obj, self.attr)
+        k = self.keyof(obj)
+        self._mods += 1
         if k:
-            if k in self.obs:
+            if self.obs.get(k) is obj:
                 del self.obs[k]
         else:
             self.none_values.discard(obj)
+    def remove_many(self, objs):
+        for obj in objs:
+            try:
+                k = self.keyof(obj)
+            except AttributeError:
+                continue
+            self._mods += 1
+            if k:
+                if self.obs.get(k) is obj:
+                    del self.obs[k]
+            else:
+                self.none_values.discard(obj)
+        return []
+    def check_new_keys(self, keys):
+        """Raise C{KeyError} if adding objects with these keys would violate uniqueness,
+           checking the whole batch with set operations."""
+        label = _attr_label(self.attr)
+        if not self.accept_none and any(k is None for k in keys):
+            raise KeyError("unique key cannot be None or blank for index %s" % label)
+        present = [k for k in keys if k]
+        newkeys = set(present)
+        if len(newkeys) < len(present):
+            seen = set()
+            for k in present:
+                if k in seen:
+                    raise KeyError("duplicate unique key value '%s' for index %s" % (k, label))
+                seen.add(k)
+        existing = newkeys.intersection(self.obs)
+        if existing:
+            raise KeyError("duplicate unique key value '%s' for index %s" % (existing.pop(), label))
+        numblank = len(keys) - len(present)
+        if self.accept_none and numblank and (self.none_values or numblank > 1):
+            raise KeyError("duplicate unique key value '%s' for index %s" % (None, label))
+    def extend(self, keys, objs):
+        obs = self.obs
+        for k, obj in izip(keys, objs):
+            if k:
+                obs[k] = obj
+            else:
+                self.none_values.add(obj)
+        self._mods += len(keys)
+    def copy_template(self):
+        return self.__class__(self.attr, self.accept_none)
+
+class _SortedObjIndex(_ObjIndex):
+    """Non-unique index that also keeps its distinct key values in sorted order, so that
+       range queries, min/max and ordered scans can be answered by bisecting the key list
+       instead of visiting every record.  None values are indexed, but are not part of any
+       range."""
+    def __init__(self, attr):
+        super(_SortedObjIndex,self).__init__(attr)
+        self.is_ordered = True
+        self.sortedkeys = []
+    def __setitem__(self, k, v):
+        if k is not None and k not in self.obs:
+            bisect.insort(self.sortedkeys, k)
+        self.obs[k].append(v)
+        self._mods += 1
+    def keys(self):
+        return ([None,] if self.obs.get(None) else []) + self.sortedkeys
+    def remove(self, obj):
+        try:
+            k = self.keyof(obj)
+        except AttributeError:
+            k = None
+        bucket = self.obs.get(k)
+        pos = next((i for i, ob in enumerate(bucket or ()) if ob is obj), None)
+        if pos is None:
+            return
+        del bucket[pos]
+        self._mods += 1
+        if not bucket:
+            del self.obs[k]
+            if k is not None:
+                del self.sortedkeys[bisect.bisect_left(self.sortedkeys, k)]
+    def remove_many(self, objs):
+        emptied = set(k for k in super(_SortedObjIndex,self).remove_many(objs) if k is not None)
+        if emptied:
+            self.sortedkeys = [k for k in self.sortedkeys if k not in emptied]
+        return list(emptied)
+    def extend(self, keys, objs):
+        newkeys = set(k for k in keys if k is not None and k not in self.obs)
+        super(_SortedObjIndex,self).extend(keys, objs)
+        if newkeys:
+            if len(newkeys) < 8:
+                for k in newkeys:
+                    bisect.insort(self.sortedkeys, k)
+            else:
+                # sort merges the already-sorted run with the new keys in O(n)
+                self.sortedkeys.extend(newkeys)
+                self.sortedkeys.sort()
+    def keyrange(self, lo=None, hi=None, include_lo=True, include_hi=True):
+        """Return the sorted key values between C{lo} and C{hi} (None = unbounded)."""
+        keys = self.sortedkeys
+        start = 0 if lo is None else (bisect.bisect_left if include_lo else bisect.bisect_right)(keys, lo)
+        end = len(keys) if hi is None else (bisect.bisect_right if include_hi else bisect.bisect_left)(keys, hi)
+        return keys[start:end]
+    def range(self, lo=None, hi=None, include_lo=True, include_hi=True):
+        """Return the objects with key values between C{lo} and C{hi}, in key order."""
+        obs = self.obs
+        return [ob for k in self.keyrange(lo, hi, include_lo, include_hi) for ob in obs[k]]
+    def prefixkeys(self, prefix):
+        """Return the sorted string key values starting with C{prefix}."""
+        keys = self.sortedkeys
+        start = bisect.bisect_left(keys, prefix)
+        if not prefix:
+            return [k for k in keys[start:] if isinstance(k, basestring)]
+        upper = _prefix_upper_bound(prefix)
+        end = len(keys) if upper is None else bisect.bisect_left(keys, upper, start)
+        return [k for k in keys[start:end] if isinstance(k, basestring) and k.startswith(prefix)]
+    def likekeys(self, pattern):
+        """Return the sorted string key values matching a C{like} pattern."""
+        prefix, rx = _like_pattern(pattern)
+        return [k for k in self.prefixkeys(prefix) if rx.match(k)]
+    def min(self):
+        return self.sortedkeys[0]
+    def max(self):
+        return self.sortedkeys[-1]
+
+def _prefix_key(val):
+    """key of a value in a prefix index - the value if it is a string, else None
+       (C{startswith} and C{like} never match non-string values)."""
+    return val if isinstance(val, basestring) else None
+
+class _PrefixObjIndex(_SortedObjIndex):
+    """Index on the string values of an attribute, kept in sorted order so that the
+       keys starting with a given prefix are a contiguous run found by bisection;
+       answers C{startswith} and C{like} criteria only."""
+    is_prefix = True
+
+    def __init__(self, attr):
+        super(_PrefixObjIndex,self).__init__(attr)
+        self.is_ordered = False
+        valueof = self.keyof
+        self.keyof = lambda ob: _prefix_key(valueof(ob))
+    def matching(self, op, val):
+        """keys matching a C{startswith} or C{like} criterion."""
+        return self.prefixkeys(val) if op == "startswith" else self.likekeys(val)
+    def estimate(self, op, val):
+        if op in ("startswith", "like") and isinstance(val, basestring):
+            obs = self.obs
+            return sum(len(obs[k]) for k in self.matching(op, val))
+        return None
+
+def _popcount(bits):
+    return bin(bits).count("1")
+
+def _bit_positions(bits):
+    """generator of the positions of the set bits in an int, lowest first."""
+    s = bin(bits)[:1:-1]
+    find = s.find
+    i = find("1")
+    while i >= 0:
+        yield i
+        i = find("1", i+1)
+
+def _bits_from_positions(positions, nbits):
+    """int with the bits at the given positions (all less than nbits) set."""
+    buf = bytearray((nbits >> 3) + 1)
+    for p in positions:
+        buf[p >> 3] |= 1 << (p & 7)
+    buf.reverse()
+    return int(binascii.hexlify(buf), 16)
+
+class _BitmapIndex(_ObjIndex):
+    """Non-unique index keeping, for each key value, an int whose set bits are the
+       positions of the matching objects in the table's list of objects (the index is
+       bound to that list).  Meant for attributes with few distinct values: criteria on
+       bitmap-indexed attributes - including C{in}, C{ne}, ranges, and C{|} and C{~} in an
+       L{Expr} - are combined with bitwise operations before any objects are fetched, and
+       counting matching objects is a popcount.  Objects missing the attribute are kept
+       apart from those with a None value."""
+    is_bitmap = True
+
+    def __init__(self, attr):
+        self.attr = attr
+        self.keyof = _key_getter(attr)
+        self.is_unique = False
+        self.is_ordered = False
+        self.bits = {}
+        self.missing = 0
+        self.rows = []
+        self.nrows = 0
+        self._pending = []
+
+    def bind(self, rows):
+        self.rows = rows
+        self.rebuild()
+        return self
+
+    def rebuild(self):
+        """recompute all bitmaps from the bound list of objects."""
+        bykey = defaultdict(list)
+        missing = []
+        keyof = self.keyof
+        for i, ob in enumerate(self.rows):
+            try:
+                bykey[keyof(ob)].append(i)
+            except AttributeError:
+                missing.append(i)
+        nbits = len(self.rows)
+        self.bits = dict((k, _bits_from_positions(pos, nbits)) for k, pos in bykey.iteritems())
+        self.missing = _bits_from_positions(missing, nbits) if missing else 0
+        self.nrows = nbits
+        self._pending = []
+        self._mods += 1
+
+    def _sync(self):
+        """bring the bitmaps up to date: merge single inserts, and rebuild if the list of
+           objects has been truncated behind the index's back."""
+        if len(self.rows) < self.nrows:
+            self.rebuild()
+        elif self._pending:
+            bykey = defaultdict(list)
+            for k, pos in self._pending:
+                bykey[k].append(pos)
+            for k, pos in bykey.iteritems():
+                self.bits[k] = self.bits.get(k, 0) | _bits_from_positions(pos, pos[-1] + 1)
+            self._pending = []
+
+    def __setitem__(self, k, v):
+        # the object has just been appended to the table's list
+        pos = len(self.rows) - 1
+        if pos < 0 or self.rows[pos] is not v:
+            self.rebuild()
+            return
+        self._pending.append((k, pos))
+        self.nrows = pos + 1
+        self._mods += 1
+
+    def extend(self, keys, objs):
+        # the objects have just been appended to the table's list
+        start = len(self.rows) - len(keys)
+        if start < 0 or (keys and self.rows[start] is not objs[0]):
+            self.rebuild()
+            return
+        self._sync()
+        bykey = defaultdict(list)
+        for i, k in enumerate(keys, start):
+            bykey[k].append(i)
+        nbits = len(self.rows)
+        bits = self.bits
+        for k, pos in bykey.iteritems():
+            bits[k] = bits.get(k, 0) | _bits_from_positions(pos, nbits)
+        self.nrows = nbits
+        self._mods += len(keys)
+
+    def _drop_positions(self, positions):
+        """remove the given (sorted) positions from every bitmap, shifting later bits down."""
+        if len(positions) == 1:
+            p = positions[0]
+            lowmask = (1 << p) - 1
+            def drop(b):
+                return (b & lowmask) | ((b >> (p+1)) << p)
+        else:
+            dropped = frozenset(positions)
+            nbits = len(self.rows)
+            def drop(b):
+                return _bits_from_positions([i - bisect.bisect_left(positions, i)
+                                             for i in _bit_positions(b) if i not in dropped], nbits)
+        newbits = ((k, drop(b)) for k, b in self.bits.iteritems())
+        self.bits = dict((k, b) for k, b in newbits if b)
+        self.missing = drop(self.missing)
+        self.nrows -= len(positions)
+        self._mods += len(positions)
+
+    def remove(self, obj):
+        # called before the object is removed from the table's list
+        self._sync()
+        for i, ob in enumerate(self.rows):
+            if ob is obj:
+                self._drop_positions([i])
+                return
+
+    def remove_many(self, objs):
+        self._sync()
+        ids = set(id(ob) for ob in objs)
+        positions = [i for i, ob in enumerate(self.rows) if id(ob) in ids]
+        if positions:
+            self._drop_positions(positions)
+        return []
+
+    def all_bits(self):
+        """bitmap of every object position."""
+        self._sync()
+        return (1 << self.nrows) - 1
+
+    def bits_for(self, op, val):
+        """bitmap of the objects matching the where() criterion C{attr__op=val}."""
+        self._sync()
+        bits = self.bits
+        if op == "eq":
+            return bits.get(val, 0)
+        if op == "in":
+            return reduce(operator.or_, (bits.get(v, 0) for v in _value_set(val)), 0)
+        if op == "isnull":
+            nulls = bits.get(None, 0)
+            return nulls if val else reduce(operator.or_, bits.itervalues(), 0) & ~nulls
+        # few distinct values, so test each key
+        test = _WHERE_OPS[op]
+        none_ok = op in _NONE_OPS
+        return reduce(operator.or_, (b for k, b in bits.iteritems()
+                                     if (k is not None or none_ok) and test(k, val)), 0)
+
+    def rows_for(self, bits):
+        """the objects at the positions set in a bitmap."""
+        rows = self.rows
+        return [rows[i] for i in _bit_positions(bits)]
+
+    def __getitem__(self, k):
+        self._sync()
+        b = self.bits.get(k)
+        return self.rows_for(b) if b else []
+    def __len__(self):
+        self._sync()
+        return len(self.bits)
+    def __iter__(self):
+        self._sync()
+        return iter(self.bits)
+    def __contains__(self, k):
+        self._sync()
+        return k in self.bits
+    def keys(self):
+        self._sync()
+        return sorted(self.bits)
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+    def count(self, k):
+        self._sync()
+        return _popcount(self.bits.get(k, 0))
+    def key_counts(self):
+        self._sync()
+        return [(k, _popcount(b)) for k, b in self.bits.iteritems()]
+    def estimate(self, op, val):
+        return _popcount(self.bits_for(op, val))
+    def copy_template(self):
+        return self.__class__(self.attr)
+
+def _token_splitter(tokenizer):
+    """function splitting a string into tokens; a string tokenizer is a regular
+       expression matching the separators between tokens."""
+    if isinstance(tokenizer, basestring):
+        return re.compile(tokenizer).split
+    return tokenizer
+
+def _value_tokens(val, split):
+    """the set of tokens in an attribute value: strings are split with the given
+       function, and list, tuple and set values are their own tokens."""
+    if val is None:
+        return set()
+    if isinstance(val, basestring):
+        return set(tok for tok in split(val) if tok)
+    if isinstance(val, (list, tuple, set, frozenset)):
+        return set(val)
+    return set([val])
+
+# default tokenizer of token indexes, and the one used by hastoken criteria
+_WORD_TOKENIZER = r"\s+"
+_split_words = _token_splitter(_WORD_TOKENIZER)
+
+def _word_tokens(val):
+    """the whitespace-separated tokens of a value, for C{attr__hastoken} criteria."""
+    return frozenset(_value_tokens(val, _split_words))
+
+class _TokenIndex(_ObjIndex):
+    """Inverted index from the tokens of each object's attribute value to the objects
+       whose value contains them.  String values are split by the tokenizer (a regular
+       expression matching the separators - whitespace by default - or a function
+       returning the tokens); list, tuple and set values are their own tokens."""
+    is_tokens = True
+
+    def __init__(self, attr, tokenizer=_WORD_TOKENIZER):
+        _ObjIndex.__init__(self, attr)
+        self.tokenizer = tokenizer
+        self.split = _token_splitter(tokenizer)
+    def tokens(self, val):
+        """the set of tokens in an attribute value."""
+        return _value_tokens(val, self.split)
+    def words(self, val):
+        """the tokens of the value of a hastoken criterion, or None if this index does
+           not split values into the same whitespace-separated tokens."""
+        if self.tokenizer != _WORD_TOKENIZER:
+            return None
+        return _word_tokens(val)
+    def contains_candidates(self, val):
+        """objects that may contain the substring val: those having a token that contains
+           the longest run of non-whitespace characters in val.  Only a whitespace
+           tokenizer guarantees that such a run lies within one token of every string
+           containing val, so for other tokenizers (or a value that is not a string, or
+           is all whitespace) None is returned."""
+        if self.tokenizer != _WORD_TOKENIZER or not isinstance(val, basestring):
+            return None
+        pieces = [piece for piece in self.split(val) if piece]
+        if not pieces:
+            return None
+        piece = max(pieces, key=len)
+        return self.matching_any([tok for tok in self.obs
+                                  if isinstance(tok, basestring) and piece in tok])
+    def __setitem__(self, k, v):
+        obs = self.obs
+        for tok in self.tokens(k):
+            obs[tok].append(v)
+        self._mods += 1
+    def extend(self, keys, objs):
+        for k, obj in izip(keys, objs):
+            self[k] = obj
+    def remove(self, obj):
+        try:
+            toks = self.tokens(self.keyof(obj))
+        except AttributeError:
+            return
+        for tok in toks:
+            bucket = self.obs.get(tok)
+            if bucket:
+                bucket[:] = [ob for ob in bucket if ob is not obj]
+                if not bucket:
+                    del self.obs[tok]
+        self._mods += 1
+    def remove_many(self, objs):
+        idsbytoken = defaultdict(set)
+        for obj in objs:
+            try:
+                toks = self.tokens(self.keyof(obj))
+            except AttributeError:
+                continue
+            for tok in toks:
+                idsbytoken[tok].add(id(obj))
+            self._mods += 1
+        emptied = []
+        for tok, ids in idsbytoken.iteritems():
+            bucket = self.obs.get(tok)
+            if bucket:
+                bucket[:] = [ob for ob in bucket if id(ob) not in ids]
+                if not bucket:
+                    del self.obs[tok]
+                    emptied.append(tok)
+        return emptied
+    def matching_all(self, tokens):
+        """objects having all of the given tokens, intersecting the smallest lists first."""
+        buckets = sorted((self.obs.get(tok, []) for tok in set(tokens)), key=len)
+        if not buckets:
+            return []
+        rows = buckets[0]
+        for bucket in buckets[1:]:
+            if not rows:
+                break
+            ids = set(imap(id, bucket))
+            rows = [ob for ob in rows if id(ob) in ids]
+        return list(rows)
+    def matching_any(self, tokens):
+        """objects having any of the given tokens."""
+        seen = set()
+        rows = []
+        for tok in set(tokens):
+            for ob in self.obs.get(tok, ()):
+                if id(ob) not in seen:
+                    seen.add(id(ob))
+                    rows.append(ob)
+        return rows
+    def estimate(self, op, val):
+        if op == "hastoken" and self.words(val):
+            return min(self.count(tok) for tok in self.words(val))
+        return None
+    def copy_template(self):
+        return self.__class__(self.attr, self.tokenizer)
+
+# comparison operators accepted as C{attr__op=value} criteria by Table.where
+_WHERE_OPS = {
+    "eq" : operator.eq,
+    "ne" : operator.ne,
+    "gt" : operator.gt,
+    "ge" : operator.ge,
+    "lt" : operator.lt,
+    "le" : operator.le,
+    "between" : lambda val, bounds: bounds[0] <= val <= bounds[1],
+    "in" : lambda val, vals: val in vals,
+    "startswith" : lambda val, prefix: isinstance(val, basestring) and val.startswith(prefix),
+    "endswith" : lambda val, suffix: isinstance(val, basestring) and val.endswith(suffix),
+    "contains" : lambda val, item: hasattr(val, "__contains__") and item in val,
+    "hastoken" : lambda val, tokens: _word_tokens(tokens) <= _word_tokens(val),
+    "isnull" : lambda val, isnull: (val is None) == bool(isnull),
+    "like" : lambda val, pattern: (isinstance(val, basestring) and
+                                   _like_pattern(pattern)[1].match(val) is not None),
+    }
+_LIKE_PATTERNS = {}
+
+def _like_pattern(pattern):
+    """the literal prefix of a SQL C{LIKE} pattern (C{%} matches any characters, C{_} any
+       one character), and a compiled regular expression matching the whole pattern."""
+    ret = _LIKE_PATTERNS.get(pattern)
+    if ret is None:
+        prefix = re.match(r"[^%_]*", pattern).group()
+        rx = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+        if len(_LIKE_PATTERNS) > 1000:
+            _LIKE_PATTERNS.clear()
+        ret = _LIKE_PATTERNS[pattern] = (prefix, re.compile(rx + r"\Z", re.S))
+    return ret
+
+# kind of index that would answer scans for each operator, for Table.index_report
+_SCAN_INDEX_KINDS = {
+    "eq" : "hash", "in" : "hash", "isnull" : "hash",
+    "gt" : "sorted", "ge" : "sorted", "lt" : "sorted", "le" : "sorted", "between" : "sorted",
+    "startswith" : "sorted", "like" : "sorted", "hastoken" : "tokens",
+    }
+
+# operators that can match records whose attribute value is None
+_NONE_OPS = frozenset(["eq", "in", "isnull"])
+
+# guessed fraction of records matching each operator, for ordering criteria that
+# cannot be estimated from an index
+_OP_SELECTIVITY = {
+    "eq" : 0.1, "ne" : 0.9, "gt" : 0.33, "ge" : 0.33, "lt" : 0.33, "le" : 0.33,
+    "between" : 0.25, "in" : 0.1, "startswith" : 0.1, "endswith" : 0.1, "contains" : 0.1,
+    "isnull" : 0.1, "like" : 0.1, "hastoken" : 0.1,
+    }
+
+def _parse_criterion(key):
+    """split a where() keyword into (attribute, operator); plain attribute names are 'eq'."""
+    attr, sep, op = key.rpartition("__")
+    if sep and attr and op in _WHERE_OPS:
+        return attr, op
+    return key, "eq"
+
+def _criteria_test(criteria):
+    """predicate testing a record against a dict of where()-style keyword criteria."""
+    tests = []
+    for key, val in criteria.items():
+        attr, op = _parse_criterion(key)
+        tests.append((attr, _WHERE_OPS[op], _criterion_value(op, val), op in _NONE_OPS))
+    def test(ob):
+        for attr, fn, val, none_ok in tests:
+            if not hasattr(ob, attr):
+                return False
+            obval = getattr(ob, attr)
+            if (obval is None and not none_ok) or not fn(obval, val):
+                return False
+        return True
+    return test
+
+def _criterion_value(op, val):
+    """the value of a where() criterion, in the form its test in C{_WHERE_OPS} takes most
+       quickly."""
+    if op == "in":
+        return _value_set(val)
+    if op == "hastoken":
+        return _word_tokens(val)
+    return val
+
+def _value_set(vals):
+    """values for an C{__in} criterion, as a set if they are hashable."""
+    try:
+        return frozenset(vals)
+    except TypeError:
+        return list(vals)
+
+_MISSING = object()
+
+def _prefix_upper_bound(prefix):
+    """a string that sorts after every string starting with the (non-empty) prefix - the
+       prefix with its last character bumped, after dropping any trailing characters that
+       are already the highest possible - or None if there is no such string."""
+    if isinstance(prefix, unicode):
+        prefix = prefix.rstrip(unichr(sys.maxunicode))
+        return prefix[:-1] + unichr(ord(prefix[-1]) + 1) if prefix else None
+    prefix = prefix.rstrip(chr(255))
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else None
+
+def _index_bucket(ind, attr, val):
+    """records whose attr equals val, from a single-attribute index; hash indexes built
+       by L{Table.create_index} file all false values (and missing attributes) together
+       under None."""
+    if val:
+        return list(ind[val])
+    if ind.is_ordered or ind.is_unique or val is None:
+        rows = ind[val]
+    else:
+        rows = ind[val] + ind[None]
+    return [ob for ob in rows if getattr(ob, attr, _MISSING) == val]
+
+def _index_answers(ind, op, val):
+    """whether an index can look up the records matching the criterion C{attr__op=val}."""
+    if ind.is_tokens:
+        if op == "hastoken":
+            return bool(ind.words(val))
+        return op == "contains" and ind.tokenizer == _WORD_TOKENIZER and \
+            isinstance(val, basestring) and bool(val.strip())
+    if ind.is_prefix:
+        return op in ("startswith", "like") and isinstance(val, basestring)
+    if ind.is_bitmap or op in ("eq", "in") or (op == "isnull" and val):
+        return True
+    return ind.is_ordered and (op in ("gt", "ge", "lt", "le", "between") or
+                               (op in ("startswith", "like") and isinstance(val, basestring)))
+
+def _index_rows(ind, attr, op, val):
+    """records matching the criterion C{attr__op=val} looked up in an index on attr,
+       or None if the index cannot answer it."""
+    if ind.is_tokens:
+        if op == "hastoken":
+            toks = ind.words(val)
+            return ind.matching_all(toks) if toks else None
+        rows = ind.contains_candidates(val) if op == "contains" else None
+        if rows is None:
+            return None
+        # the candidates include records with a longer token containing val's characters
+        contains = _WHERE_OPS["contains"]
+        return [ob for ob in rows if contains(getattr(ob, attr, None), val)]
+    if ind.is_prefix:
+        # keys are the values' string forms
+        if op in ("startswith", "like") and isinstance(val, basestring):
+            obs = ind.obs
+            return [ob for k in ind.matching(op, val) for ob in obs[k]]
+        return None
+    if ind.is_bitmap:
+        return ind.rows_for(ind.bits_for(op, val))
+    if op == "eq":
+        return _index_bucket(ind, attr, val)
+    if op == "in":
+        # records in different buckets are distinct, so the union is a concatenation
+        rows = []
+        for v in _value_set(val):
+            rows.extend(_index_bucket(ind, attr, v))
+        return rows
+    if op == "isnull" and val:
+        return _index_bucket(ind, attr, None)
+    if ind.is_ordered:
+        if op in ("gt", "ge", "lt", "le", "between"):
+            return ind.range(*_range_bounds(op, val))
+        if op == "startswith" and isinstance(val, basestring):
+            obs = ind.obs
+            return [ob for k in ind.prefixkeys(val) for ob in obs[k]]
+        if op == "like" and isinstance(val, basestring):
+            obs = ind.obs
+            return [ob for k in ind.likekeys(val) for ob in obs[k]]
+    return None
+
+def _index_kind(ind):
+    """the create_index() kind of an index."""
+    if ind.is_tokens:
+        return "tokens"
+    if ind.is_prefix:
+        return "prefix"
+    if ind.is_bitmap:
+        return "bitmap"
+    if isinstance(ind.attr, tuple):
+        return "composite"
+    if ind.is_unique:
+        return "unique"
+    return "sorted" if ind.is_ordered else "hash"
+
+def _range_bounds(op, val):
+    """convert a range operator and value to C{_SortedObjIndex.range} arguments."""
+    if op == "gt":
+        return val, None, False, True
+    if op == "ge":
+        return val, None, True, True
+    if op == "lt":
+        return None, val, True, False
+    if op == "le":
+        return None, val, True, True
+    return val[0], val[1], True, True
+
+class Expr(object):
+    """Column expression, built from L{col} and L{lit} with Python's arithmetic and
+       comparison operators, as in::
+
+           (col("price") * col("qty") > 100) & (col("state") == "AZ")
+
+       Use C{&}, C{|} and C{~} for and, or and not.  An expression can be passed wherever a
+       function of a record is accepted (L{Table.where}, L{Table.addfield}, L{Table.select},
+       L{Table.sort}, L{Query}); it is compiled once, to a single function built from
+       C{operator.attrgetter} and the operator functions.  Unlike a lambda, an expression
+       can be inspected: comparisons of an attribute with a constant are turned into
+       keyword criteria by L{Table.where}, so they can use indexes (and, as for keyword
+       criteria, None values then only match C{==}, C{isin} and C{isnull}), and tables
+       created with C{columnar=True} evaluate expressions a column at a time.
+    """
+    _fn = None
+
+    def compile(self):
+        """Return the function of a record that computes this expression."""
+        if self._fn is None:
+            self._fn = self._compile()
+        return self._fn
+
+    def __call__(self, rec):
+        return self.compile()(rec)
+
+    def __nonzero__(self):
+        raise TypeError("cannot use a column expression as a boolean - use & | ~ instead of and/or/not")
+
+    __hash__ = object.__hash__
+
+    def _binop(op, symbol, reflected=False):
+        def method(self, other):
+            other = other if isinstance(other, Expr) else _Lit(other)
+            if reflected:
+                return _BinOp(op, symbol, other, self)
+            return _BinOp(op, symbol, self, other)
+        return method
+
+    __add__ = _binop(operator.add, "+")
+    __radd__ = _binop(operator.add, "+", True)
+    __sub__ = _binop(operator.sub, "-")
+    __rsub__ = _binop(operator.sub, "-", True)
+    __mul__ = _binop(operator.mul, "*")
+    __rmul__ = _binop(operator.mul, "*", True)
+    __div__ = _binop(operator.div, "/")
+    __rdiv__ = _binop(operator.div, "/", True)
+    __truediv__ = _binop(operator.truediv, "/")
+    __rtruediv__ = _binop(operator.truediv, "/", True)
+    __floordiv__ = _binop(operator.floordiv, "//")
+    __rfloordiv__ = _binop(operator.floordiv, "//", True)
+    __mod__ = _binop(operator.mod, "%")
+    __rmod__ = _binop(operator.mod, "%", True)
+    __pow__ = _binop(operator.pow, "**")
+    __rpow__ = _binop(operator.pow, "**", True)
+    __eq__ = _binop(operator.eq, "==")
+    __ne__ = _binop(operator.ne, "!=")
+    __lt__ = _binop(operator.lt, "<")
+    __le__ = _binop(operator.le, "<=")
+    __gt__ = _binop(operator.gt, ">")
+    __ge__ = _binop(operator.ge, ">=")
+    del _binop
+
+    def __and__(self, other):
+        return _BoolOp(True, self, other if isinstance(other, Expr) else _Lit(other))
+    def __rand__(self, other):
+        return _BoolOp(True, _Lit(other), self)
+    def __or__(self, other):
+        return _BoolOp(False, self, other if isinstance(other, Expr) else _Lit(other))
+    def __ror__(self, other):
+        return _BoolOp(False, _Lit(other), self)
+    def __invert__(self):
+        return _UnaryOp(operator.not_, "~", self)
+    def __neg__(self):
+        return _UnaryOp(operator.neg, "-", self)
+
+    def isin(self, values):
+        """Expression testing whether this expression's value is one of C{values}."""
+        return _In(self, values)
+
+    def between(self, lo, hi):
+        """Expression testing C{lo <= value <= hi}."""
+        return (self >= lo) & (self <= hi)
+
+    def isnull(self):
+        """Expression testing whether this expression's value is None."""
+        return _BinOp(operator.is_, "is", self, _Lit(None))
+
+    def _evaluate(self, store):
+        """values of this expression for every row of a L{_ColumnStore}."""
+        return map(self.compile(), store)
+
+    def _conjuncts(self):
+        return [self]
+
+    def _criterion(self):
+        """this expression as a where() keyword criterion C{(key, value)}, or None."""
+        return None
+
+class _Col(Expr):
+    def __init__(self, name):
+        self.name = name
+    def _compile(self):
+        return operator.attrgetter(self.name)
+    def _evaluate(self, store):
+        return list(store.column(self.name))
+    def _key(self):
+        return ("col", self.name)
+    def __repr__(self):
+        return "col(%r)" % self.name
+
+class _Lit(Expr):
+    def __init__(self, value):
+        self.value = value
+    def _compile(self):
+        value = self.value
+        return lambda rec: value
+    def _evaluate(self, store):
+        return [self.value] * len(store)
+    def _key(self):
+        return ("lit", self.value)
+    def __repr__(self):
+        return "lit(%r)" % (self.value,)
+
+# comparison operators that map to where() keyword criteria, and their mirror images
+# for constant-on-the-left comparisons
+_CRITERION_SUFFIXES = {operator.eq: "", operator.ne: "__ne", operator.gt: "__gt",
+                       operator.ge: "__ge", operator.lt: "__lt", operator.le: "__le",
+                       operator.is_: "__isnull"}
+_MIRRORED_OPS = {operator.eq: operator.eq, operator.ne: operator.ne, operator.gt: operator.lt,
+                 operator.ge: operator.le, operator.lt: operator.gt, operator.le: operator.ge}
+
+class _BinOp(Expr):
+    def __init__(self, op, symbol, left, right):
+        self.op, self.symbol, self.left, self.right = op, symbol, left, right
+
+    def _compile(self):
+        op, left, right = self.op, self.left, self.right
+        # fuse attribute and constant operands into the operator call
+        if isinstance(left, _Col) and isinstance(right, _Lit):
+            get, val = operator.attrgetter(left.name), right.value
+            return lambda rec: op(get(rec), val)
+        if isinstance(left, _Lit) and isinstance(right, _Col):
+            val, get = left.value, operator.attrgetter(right.name)
+            return lambda rec: op(val, get(rec))
+        if isinstance(left, _Col) and isinstance(right, _Col):
+            get = operator.attrgetter(left.name, right.name)
+            return lambda rec: op(*get(rec))
+        lfn, rfn = left.compile(), right.compile()
+        return lambda rec: op(lfn(rec), rfn(rec))
+
+    def _evaluate(self, store):
+        op = self.op
+        if isinstance(self.right, _Lit):
+            return list(imap(op, self.left._evaluate(store), repeat(self.right.value)))
+        return map(op, self.left._evaluate(store), self.right._evaluate(store))
+
+    def _criterion(self):
+        op, left, right = self.op, self.left, self.right
+        if isinstance(left, _Lit) and isinstance(right, _Col) and op in _MIRRORED_OPS:
+            op, left, right = _MIRRORED_OPS[op], right, left
+        if (op in _CRITERION_SUFFIXES and isinstance(left, _Col) and isinstance(right, _Lit) and
+                "__" not in left.name and not left.name.startswith("_")):
+            if op is operator.is_:
+                return (left.name + "__isnull", True) if right.value is None else None
+            return left.name + _CRITERION_SUFFIXES[op], right.value
+        return None
+
+    def _key(self):
+        return (self.symbol, self.left._key(), self.right._key())
+
+    def __repr__(self):
+        return "(%r %s %r)" % (self.left, self.symbol, self.right)
+
+class _BoolOp(Expr):
+    def __init__(self, isand, left, right):
+        self.isand, self.left, self.right = isand, left, right
+
+    def _compile(self):
+        lfn, rfn = self.left.compile(), self.right.compile()
+        if self.isand:
+            return lambda rec: lfn(rec) and rfn(rec)
+        return lambda rec: lfn(rec) or rfn(rec)
+
+    def _evaluate(self, store):
+        pairs = izip(self.left._evaluate(store), self.right._evaluate(store))
+        if self.isand:
+            return [a and b for a, b in pairs]
+        return [a or b for a, b in pairs]
+
+    def _conjuncts(self):
+        if self.isand:
+            return self.left._conjuncts() + self.right._conjuncts()
+        return [self]
+
+    def _key(self):
+        return ("&" if self.isand else "|", self.left._key(), self.right._key())
+
+    def __repr__(self):
+        return "(%r %s %r)" % (self.left, "&" if self.isand else "|", self.right)
+
+class _UnaryOp(Expr):
+    def __init__(self, op, symbol, operand):
+        self.op, self.symbol, self.operand = op, symbol, operand
+
+    def _compile(self):
+        op, fn = self.op, self.operand.compile()
+        return lambda rec: op(fn(rec))
+
+    def _evaluate(self, store):
+        return map(self.op, self.operand._evaluate(store))
+
+    def _key(self):
+        return (self.symbol, self.operand._key())
+
+    def __repr__(self):
+        return "%s%r" % (self.symbol, self.operand)
+
+class _In(Expr):
+    def __init__(self, operand, values):
+        self.operand = operand
+        self.values = frozenset(values)
+
+    def _compile(self):
+        fn, values = self.operand.compile(), self.values
+        return lambda rec: fn(rec) in values
+
+    def _evaluate(self, store):
+        values = self.values
+        return [val in values for val in self.operand._evaluate(store)]
+
+    def _criterion(self):
+        operand = self.operand
+        if isinstance(operand, _Col) and "__" not in operand.name and not operand.name.startswith("_"):
+            return operand.name + "__in", self.values
+        return None
+
+    def _key(self):
+        return ("in", self.operand._key(), self.values)
+
+    def __repr__(self):
+        return "%r.isin(%r)" % (self.operand, sorted(self.values))
+
+def col(name):
+    """Column expression for a record attribute - see L{Expr}."""
+    return _Col(name)
+
+def lit(value):
+    """Constant expression - see L{Expr}."""
+    return _Lit(value)
+
+def _compiled(fn):
+    """the function to call per record for a function or L{Expr}."""
+    return fn.compile() if isinstance(fn, Expr) else fn
+
+def _expr_criteria(expr, exclude=()):
+    """split an L{Expr} into where() keyword criteria (for the and-ed comparisons of an
+       attribute with a constant) and the remaining expression (or None)."""
+    criteria = {}
+    rest = []
+    for term in expr._conjuncts():
+        crit = term._criterion()
+        if crit is None or crit[0] in criteria or crit[0] in exclude:
+            rest.append(term)
+        else:
+            criteria[crit[0]] = crit[1]
+    residual = reduce(operator.and_, rest) if rest else None
+    return criteria, residual
 
 class _ObjIndexWrapper(object):
     def __init__(self, ind):
@@ -243,10 +1544,7 @@ class _ObjIndexWrapper(object):
     def __getattr__(self, attr):
         return getattr(self._index, attr)
     def __getitem__(self, k):
-        ret = Table()
-        if k in self._index:
-            ret.insert_many(self._index[k])
-        return ret
+        return Table(data=list(self._index[k]) if k in self._index else None)
     def __contains__(self, k):
         return k in self._index
 
@@ -261,10 +1559,7 @@ class _UniqueObjIndexWrapper(object):
         if k:
             return self._index[k][0]
         else:
-            ret = Table()
-            if k in self._index:
-                ret.insert_many(self._index[k])
-            return ret
+            return Table(data=list(self._index[k]) if k in self._index else None)
             
 # memoized tables are temporary Table's that are given names so you can refer to them later in the
 # computation.  As a trivial example, here's how you can perform multiple WHERE filters on a set
@@ -285,6 +1580,592 @@ def SUMCOL(tblname, field):
     """experimental function to return the python sum() of a memoized Table."""
     return sum(MEMOIZED_TABLES.get(tblname, Table()).getcol(field))
 
+class ResultCache(object):
+    """Least-recently-used cache of query results, for tables that have called
+       L{Table.cache_results}.  Results of L{Table.where}, L{Table.groupby} and L{Table.join}
+       are kept by table, table version and call arguments, so any insert or remove on the
+       source table (or on a joined table) makes its earlier results unreachable.  The
+       cache is bounded both by number of results and by total number of result rows.
+    """
+    def __init__(self, maxentries=128, maxrows=1000000):
+        """Create a new, empty cache.
+           @param maxentries: maximum number of results to keep
+           @type maxentries: int
+           @param maxrows: maximum number of records to keep, summed over all results;
+               a result larger than this is never cached
+           @type maxrows: int
+        """
+        self.maxentries = maxentries
+        self.maxrows = maxrows
+        self._entries = OrderedDict()
+        self._versions = {}
+        self.rows = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        result, version = self._entries.pop(key)
+        self.rows -= len(result)
+
+    def _purge(self, uid, version):
+        # drop results computed from older versions of a table
+        if self._versions.get(uid, version) < version:
+            for key in [k for k in self._entries if k[0] == uid and k[1] < version]:
+                self._discard(key)
+        self._versions[uid] = max(version, self._versions.get(uid, version))
+
+    def get(self, key):
+        """Return the cached result for key, or None."""
+        self._purge(key[0], key[1])
+        entry = self._entries.pop(key, None)
+        # a cached result that has since been modified is no longer valid
+        if entry is None or entry[0]._version != entry[1]:
+            if entry is not None:
+                self.rows -= len(entry[0])
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, result):
+        """Add a result to the cache, evicting the least recently used results as needed."""
+        if len(result) > self.maxrows:
+            return
+        if key in self._entries:
+            self._discard(key)
+        self._entries[key] = (result, result._version)
+        self.rows += len(result)
+        while len(self._entries) > self.maxentries or self.rows > self.maxrows:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all cached results (statistics are kept)."""
+        self._entries.clear()
+        self._versions.clear()
+        self.rows = 0
+
+    def stats(self):
+        """Return a dict of cache statistics: hits, misses, evictions, entries, and rows."""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), rows=self.rows)
+
+RESULT_CACHE = ResultCache()
+_table_uids = count(1)
+
+def _is_aggregator(expr):
+    """whether a groupby output is a streaming aggregator, with init, step and finalize
+       methods (see C{reporting_funcs.Aggregator}), rather than a function of the list of
+       a group's records."""
+    return all(callable(getattr(expr, name, None)) for name in ("init", "step", "finalize"))
+
+def _aggregate(aggs, obs):
+    """the values of a list of aggregators over a list of records, stepping all of them
+       through each record in a single pass."""
+    states = [agg.init() for agg in aggs]
+    steps = list(enumerate(agg.step for agg in aggs))
+    for ob in obs:
+        for i, step in steps:
+            states[i] = step(states[i], ob)
+    return [agg.finalize(state) for agg, state in izip(aggs, states)]
+
+# values that a cached function can read from its closure or globals, represented as
+# themselves in its cache key
+_FROZEN_TYPES = (int, long, float, complex, bool, basestring, type(None), type, types.ClassType,
+                 types.ModuleType, types.BuiltinFunctionType, type(set.add))
+
+def _code_names(code):
+    """names of the globals (and attributes) used by a code object and the functions
+       defined in it."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(_code_names(const))
+    return names
+
+def _function_token(func, seen=frozenset()):
+    """cache key form of a function: its code, and the values of its closure cells,
+       defaults and the globals that it reads."""
+    code = func.__code__
+    if code in seen:
+        # recursive function
+        return ("function", code)
+    seen = seen | set([code])
+    cells = tuple(_free_value_token(cell.cell_contents, seen) for cell in func.__closure__ or ())
+    funcglobals = func.__globals__
+    names = tuple((name, _free_value_token(funcglobals[name], seen))
+                  for name in sorted(_code_names(code)) if name in funcglobals)
+    return ("function", code, cells, names, _cache_token(func.__defaults__))
+
+def _free_value_token(val, seen):
+    """cache key form of a value read by a function from its closure or globals; raises
+       C{TypeError} for mutable values, whose changes a cached result would not follow."""
+    if isinstance(val, types.FunctionType):
+        return _function_token(val, seen)
+    if isinstance(val, tuple):
+        return ("tuple",) + tuple(_free_value_token(v, seen) for v in val)
+    if isinstance(val, frozenset):
+        return ("frozenset", frozenset(_free_value_token(v, seen) for v in val))
+    if isinstance(val, _FROZEN_TYPES) or type(val) is object:
+        return val
+    if isinstance(val, (Table, Expr)) or _is_aggregator(val):
+        return _cache_token(val)
+    raise TypeError("result depends on mutable %s value" % type(val).__name__)
+
+def _cache_token(val):
+    """hashable form of a query argument for a L{ResultCache} key; tables are
+       represented by identity and version, and functions by their code and the values
+       they read from their closures and globals, so that C{SUM("x")} in two separate
+       calls gives the same key, and rebinding a global that a function reads gives a
+       new one.  Raises C{TypeError} (so that the call is not cached) for a function
+       reading a mutable value, such as a list, dict or object."""
+    if isinstance(val, Table):
+        return ("table", val._uid, val._version)
+    if isinstance(val, Expr):
+        return ("expr", val._key())
+    if _is_aggregator(val):
+        return ("aggregator",) + tuple(_cache_token(getattr(val, name, None))
+                                       for name in ("init", "step", "merge", "finalize"))
+    if isinstance(val, types.FunctionType):
+        return _function_token(val)
+    if isinstance(val, (list, tuple)):
+        return (type(val).__name__,) + tuple(imap(_cache_token, val))
+    if isinstance(val, dict):
+        return ("dict", frozenset((k, _cache_token(v)) for k, v in val.iteritems()))
+    return val
+
+def _cached_result(method):
+    """decorator for Table query methods whose results can be kept in the table's
+       L{ResultCache}; each caller gets its own view of the cached result."""
+    name = method.__name__
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self._result_cache
+        if cache is None:
+            return method(self, *args, **kwargs)
+        try:
+            key = (self._uid, self._version, name, _cache_token(args), _cache_token(kwargs))
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        ret = cache.get(key)
+        if ret is None:
+            ret = method(self, *args, **kwargs)
+            cache.put(key, ret)
+        return ret._view(list(ret.obs))
+    return wrapper
+
+class _MixedOrderKey(object):
+    """sort key for attributes sorted in different directions; subclasses created by
+       L{_sort_key} set C{descending} to a flag per attribute."""
+    __slots__ = ("vals",)
+    descending = ()
+    def __init__(self, vals):
+        self.vals = vals
+    def __lt__(self, other):
+        for a, b, desc in izip(self.vals, other.vals, self.descending):
+            if a != b:
+                return a > b if desc else a < b
+        return False
+    def __eq__(self, other):
+        return self.vals == other.vals
+
+def _sort_key(key, reverse=False):
+    """convert a sort specification - a string of attribute names as described in
+       L{Table.sort}, or a key function - to a single key function and reverse flag."""
+    if not isinstance(key, basestring):
+        return _compiled(key), reverse
+    attr_orders = [(a.split()+['asc',])[:2] for a in key.split(',')]
+    attrs = [attr for attr,order in attr_orders]
+    descending = tuple(order == "desc" for attr,order in attr_orders)
+    keyfn = operator.attrgetter(*attrs)
+    if all(descending) or not any(descending):
+        # equal keys keep their original order either way, as with successive sorts
+        return keyfn, descending[0]
+    orderkey = type("_OrderKey", (_MixedOrderKey,), {"__slots__": (), "descending": descending})
+    return (lambda ob: orderkey(keyfn(ob))), False
+
+def _sort_records(obs, key, reverse=False):
+    """sort a list of records in place, in a single pass, by a key function or by a
+       string of attribute names as described in L{Table.sort}."""
+    keyfn, reverse = _sort_key(key, reverse)
+    obs.sort(key=keyfn, reverse=reverse)
+    return obs
+
+def _top_records(obs, key, numrecs, reverse=False):
+    """the first numrecs records of obs in sorted order, using a bounded heap instead of
+       sorting all the records."""
+    keyfn, reverse = _sort_key(key, reverse)
+    return (heapq.nlargest if reverse else heapq.nsmallest)(numrecs, obs, key=keyfn)
+
+def _select_columns(fields, exprs):
+    """parse select()'s field list and output expressions."""
+    parsed_fields = []
+    for flds in [parse_colnames(fld) for fld in fields]:
+        parsed_fields += flds
+    def get_field(name):
+        def get_field_helper(rec):
+            return getattr(rec, name, "")
+        return get_field_helper
+    def eval_expr(expr):
+        # compile once; evaluate with the record's attributes (and the record itself,
+        # as 'rec') as local names
+        code = compile(expr, "<select expression>", "eval")
+        def eval_expr_helper(rec):
+            names = _object_asdict(rec)
+            names["rec"] = rec
+            return eval(code, globals(), names)
+        return eval_expr_helper
+    exprs = dict(exprs)
+    for name, expr in exprs.items():
+        if isinstance(expr, basestring):
+            if re.search(r'^[a-zA-Z0-9_]+$', expr):
+                exprs[name] = get_field(expr)
+            else:
+                exprs[name] = eval_expr(expr)
+        else:
+            exprs[name] = _compiled(expr)
+    return parsed_fields, exprs
+
+def _projector(fields, exprs, rectype):
+    """function building a new rectype record with the selected fields and expressions."""
+    exprs = exprs.items()
+    def project(rec):
+        newrec = rectype()
+        for fieldname in fields:
+            setattr(newrec, fieldname, getattr(rec, fieldname))
+        for fieldname, expr in exprs:
+            setattr(newrec, fieldname, expr(rec))
+        return newrec
+    return project
+
+def _field_value_fn(val_or_fn, default=None, swallow_exceptions=False):
+    """function computing an addfield() value for a record."""
+    if not callable(val_or_fn):
+        return lambda rec: val_or_fn
+    val_or_fn = _compiled(val_or_fn)
+    def value(rec):
+        try:
+            val = val_or_fn(rec)
+        except Exception:
+            if swallow_exceptions:
+                return default
+            raise
+        return default if val is None else val
+    return value
+
+def _values_getter(names):
+    """function returning the tuple of a record's values of the given attributes, with
+       None for any attribute the record does not have."""
+    if not names:
+        return lambda rec: ()
+    if len(names) == 1:
+        name = names[0]
+        return lambda rec: (getattr(rec, name, None),)
+    get = operator.attrgetter(*names)
+    def values(rec):
+        try:
+            return get(rec)
+        except AttributeError:
+            return tuple(getattr(rec, name, None) for name in names)
+    return values
+
+def _record_builder(rectype, names):
+    """function building a rectype record from a tuple of values of the given attributes,
+       filling in the record's C{__dict__} or slots directly instead of calling setattr
+       for each one."""
+    new = object.__new__
+    if issubclass(rectype, _SlottedRecord):
+        setters = [getattr(rectype, name).__set__ for name in names]
+        def build(vals):
+            rec = new(rectype)
+            for setter, val in izip(setters, vals):
+                setter(rec, val)
+            return rec
+    else:
+        def build(vals):
+            rec = new(rectype)
+            rec.__dict__.update(izip(names, vals))
+            return rec
+    return build
+
+def _merge_matches(left, right):
+    """generator of the pairs of lists of records with equal keys in two sorted indexes,
+       in key order, stepping through both sorted key lists together (and bisecting past
+       runs of keys missing from the other index); records with None values are matched
+       first, as in a hash join."""
+    lobs, robs = left.obs, right.obs
+    if lobs.get(None) and robs.get(None):
+        # the None keys include the records missing the attribute, which match nothing
+        lnone, rnone = _index_bucket(left, left.attr, None), _index_bucket(right, right.attr, None)
+        if lnone and rnone:
+            yield lnone, rnone
+    lkeys, rkeys = left.sortedkeys, right.sortedkeys
+    nl, nr = len(lkeys), len(rkeys)
+    i = j = 0
+    while i < nl and j < nr:
+        lk, rk = lkeys[i], rkeys[j]
+        if lk < rk:
+            i = bisect.bisect_left(lkeys, rk, i+1)
+        elif rk < lk:
+            j = bisect.bisect_left(rkeys, lk, j+1)
+        else:
+            yield lobs[lk], robs[rk]
+            i += 1
+            j += 1
+
+def _index_groups(ind):
+    """(key, list of records) pairs of an index, including the records that a unique
+       index keeps apart under a None key."""
+    groups = ind.items()
+    if ind.is_unique and ind.none_values:
+        groups = groups + [(None, list(ind.none_values))]
+    return groups
+
+def _join_groups(ind):
+    """(join key, list of records) pairs of an index, with each false key's records
+       regrouped by their own values - hash indexes built by L{Table.create_index} file all
+       false values under None, but joins match values exactly, as L{_index_probe} does.
+       Records missing the attribute (or with an unhashable false value) are grouped under
+       C{_MISSING}, which matches no key."""
+    keyof = ind.keyof
+    for key, rows in _index_groups(ind):
+        if key:
+            yield key, rows
+            continue
+        bykey = {}
+        for ob in rows:
+            try:
+                k = keyof(ob)
+                hash(k)
+            except (AttributeError, TypeError):
+                k = _MISSING
+            bykey.setdefault(k, []).append(ob)
+        for item in bykey.iteritems():
+            yield item
+
+_JOIN_TYPES = ("inner", "left", "right", "full", "semi", "anti")
+
+def _join_is_empty(how, thisobs, otherobs):
+    """whether a join of the given type is empty, because of an empty table."""
+    if how in ("left", "anti"):
+        return not thisobs
+    if how == "right":
+        return not otherobs
+    if how == "full":
+        return not (thisobs or otherobs)
+    return not (thisobs and otherobs)
+
+def _outer_matches(thisindex, otherindex, how):
+    """generator of the pairs of lists of matching records for a left, right or full
+       join, driven from the index of the table whose unmatched records are kept; an
+       unmatched list of records is paired with None."""
+    thislookup = lambda key: _index_probe(thisindex, thisindex.attr, key)
+    otherlookup = lambda key: _index_probe(otherindex, otherindex.attr, key)
+    if how == "right":
+        for key, rows in _join_groups(otherindex):
+            yield thislookup(key) or None, rows
+        return
+    for key, rows in _join_groups(thisindex):
+        yield rows, otherlookup(key) or None
+    if how == "full":
+        for key, rows in _join_groups(otherindex):
+            if not thislookup(key):
+                yield None, rows
+
+def _index_probe(ind, attr, key):
+    """records in an index on attr matching a join key; hash indexes built by
+       L{Table.create_index} file all false keys under None."""
+    if key:
+        return ind[key]
+    return _index_bucket(ind, attr, key)
+
+def _join_distinct(tbl, attr):
+    """number of distinct join keys of a table's attribute, from its index statistics, or
+       the number of records if the attribute is not indexed."""
+    ind = tbl._own_indexes().get(attr)
+    if ind is None:
+        return max(len(tbl), 1)
+    return max(_join_probes(ind), 1)
+
+def _plan_join_order(tables, edges):
+    """order in which to join the tables of a join graph (edges are C{(table, attribute,
+       table, attribute)} tuples of table positions): the first table, and then each table
+       to add with the edge joining it to the tables already joined.  The join estimated to
+       be smallest is done first - estimating the size of a join as the product of the
+       sizes of its inputs divided by the larger number of distinct keys - and then the
+       table whose join with the result so far is estimated to be smallest is added."""
+    def join_size(size, i, a, j, b):
+        return float(size) * len(tables[j]) / max(_join_distinct(tables[i], a),
+                                                   _join_distinct(tables[j], b))
+    size, edge = min((join_size(len(tables[e[0]]), *e), e) for e in edges)
+    i, a, j, b = edge
+    if len(tables[j]) < len(tables[i]):
+        i, a, j, b = j, b, i, a
+    first = i
+    steps = [(i, a, j, b)]
+    joined = set([i, j])
+    while len(joined) < len(tables):
+        candidates = []
+        for i, a, j, b in edges:
+            if (i in joined) != (j in joined):
+                if j in joined:
+                    i, a, j, b = j, b, i, a
+                candidates.append((join_size(size, i, a, j, b), (i, a, j, b)))
+        size, step = min(candidates)
+        steps.append(step)
+        joined.add(step[2])
+    return first, steps
+
+def _probe_join(stream, tables, i, a, j, b):
+    """extend each tuple of records from the tables joined so far with each record of
+       table j whose attribute b matches attribute a of its record from table i."""
+    keyof = _key_getter(a)
+    ind = tables[j]._join_index(b, True)
+    for combo in stream:
+        try:
+            key = keyof(combo[i])
+        except AttributeError:
+            continue
+        for match in _index_probe(ind, b, key):
+            newcombo = list(combo)
+            newcombo[j] = match
+            yield newcombo
+
+class _BloomFilter(object):
+    """Bloom filter over a set of keys: a bit array in which each key sets C{nhashes}
+       bits, so that testing a key that was added is always true, and testing any other
+       key is true with probability C{error_rate}.  The bit array is sized for the number
+       of keys and the error rate, unless capped at C{maxbytes} (which raises the error
+       rate)."""
+    def __init__(self, keys, error_rate=0.01, maxbytes=None):
+        keys = set(keys)
+        n = max(len(keys), 1)
+        nbits = int(math.ceil(-n * math.log(error_rate) / math.log(2) ** 2))
+        if maxbytes:
+            nbits = min(nbits, maxbytes * 8)
+        self.nbits = nbits = max(nbits, 8)
+        self.nhashes = max(1, int(round(float(nbits) / n * math.log(2))))
+        self.bits = bytearray((nbits + 7) // 8)
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        # double hashing, from the two halves of the (scrambled) 64-bit hash of the key
+        h = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        pos, step = h >> 32, (h & 0xFFFFFFFF) | 1
+        bits, nbits = self.bits, self.nbits
+        for _ in xrange(self.nhashes):
+            pos %= nbits
+            bits[pos >> 3] |= 1 << (pos & 7)
+            pos += step
+
+    def __contains__(self, key):
+        # most keys not in the filter are rejected by the first bit or two tested
+        h = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        pos, step = h >> 32, (h & 0xFFFFFFFF) | 1
+        bits, nbits = self.bits, self.nbits
+        for _ in xrange(self.nhashes):
+            pos %= nbits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos += step
+        return True
+
+def _join_keys(obs, attr):
+    """generator of the join keys of a list of records - their values of attr, matched by
+       equality as in L{_join_groups}; missing attributes (and unhashable false values)
+       become C{_MISSING}, which matches no key."""
+    keyof = _key_getter(attr)
+    for ob in obs:
+        try:
+            key = keyof(ob)
+            if not key:
+                hash(key)
+        except (AttributeError, TypeError):
+            key = _MISSING
+        yield key
+
+def _join_projection(thiscols, othercols):
+    """names of the columns to fetch from each table's records, the aliases of all the
+       joined columns, and the C{(position, other table's attribute)} pairs of the columns
+       that both tables supply; if both tables supply an attribute, the first table's
+       value is kept, as with DataObject's write-once attributes."""
+    seen = {}
+    names = ([], [])
+    aliases = []
+    shared = []
+    for side, cols in enumerate((thiscols, othercols)):
+        for _,c,a in cols:
+            if a not in seen:
+                seen[a] = len(aliases)
+                names[side].append(c)
+                aliases.append(a)
+            elif side and seen[a] < len(names[0]):
+                shared.append((seen[a], c))
+    return names, aliases, shared
+
+def _join_fills(fill, aliases, nthis):
+    """tuples of fill values for the missing table's columns in an outer join, for
+       each table."""
+    if isinstance(fill, dict):
+        fills = [fill.get(a) for a in aliases]
+    else:
+        fills = [fill] * len(aliases)
+    return tuple(fills[:nthis]), tuple(fills[nthis:])
+
+def _join_partitions(obs, attr, getvals, nparts):
+    """lists of C{(join key, values tuple)} pairs of a table's records, partitioned by
+       the hash of the join key, and the values tuples of the records without a key
+       (which match nothing, and are not sent to the workers)."""
+    parts = [[] for i in xrange(nparts)]
+    unkeyed = []
+    for ob, key in izip(obs, _join_keys(obs, attr)):
+        if key is _MISSING:
+            unkeyed.append(getvals(ob))
+        else:
+            parts[hash(key) % nparts].append((key, getvals(ob)))
+    return parts, unkeyed
+
+def _join_partition(task):
+    """hash join of one partition of a parallel join, run in a worker process; returns
+       the list of joined values tuples, including the unmatched records of this table
+       (padded with otherfill) if otherfill is not None."""
+    thisrows, otherrows, otherfill = task
+    bykey = defaultdict(list)
+    for key, vals in otherrows:
+        bykey[key].append(vals)
+    ret = []
+    for key, tvals in thisrows:
+        matches = bykey.get(key)
+        if matches:
+            ret.extend([tvals + ovals for ovals in matches])
+        elif otherfill is not None:
+            ret.append(tvals + otherfill)
+    return ret
+
+def _pool_map(fn, tasks, workers):
+    """list of the results of a module-level function over a list of tasks, computed
+       in a pool of worker processes."""
+    if ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor(workers) as pool:
+            return list(pool.map(fn, tasks))
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(fn, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def _join_probes(ind):
+    """number of distinct keys (including None) in an index - the number of lookups in
+       the other table's index when a join is driven from this one."""
+    st = ind.stats()
+    return st.distinct + (1 if st.nulls else 0)
+
 def parse_colnames(fieldlist):
     """common utility for parsing a list of field names"""
     if isinstance(fieldlist, str):
@@ -313,19 +2194,38 @@ class Table(object):
         - grouped, using L{groupby} to create a summary table of computed values, grouped by a key 
           attribute
         - L{imported<csv_import>}/L{exported<csv_export>} to CSV-format files
+        - stored column-by-column, using C{Table(columnar=True)}, so that large tables do not
+          need an object per row and L{sum}/L{avg}/L{min}/L{max} run directly over columns
+        - cached, using L{cache_results}, so that repeating a query on unchanged data reuses
+          its earlier result
        Queries and joins return their results as new Table objects, so that queries and joins can
        be easily performed as a succession of operations.
     """
-    def __init__(self, table_name='', data=None, objlist=None, converter=str, show_hidden_objlist_fields=False):
+    def __init__(self, table_name='', data=None, objlist=None, converter=str, show_hidden_objlist_fields=False,
+                 columnar=False):
         """Create a new, empty Table.
            @param table_name: name for Table
            @param objlist: either a list of DataObjects or dicts
            @type table_name: string (optional)
+           @param columnar: store each attribute as its own column instead of keeping
+               one object per row - see L{_ColumnStore}
+           @type columnar: boolean
         """
         self(table_name)
-        self.obs = [] if data is None else data
+        if columnar:
+            self.obs = _ColumnStore(data)
+        else:
+            self.obs = [] if data is None else data
         self._indexes = {}
         self._knownfields = []
+        self._record_class = None
+        # bumped whenever records are added, removed, reordered or recomputed
+        self._version = 0
+        self._uid = next(_table_uids)
+        # unindexed where() scans per (attribute, kind of index that would answer them),
+        # and how indexes not created by the user came about - see index_report()
+        self._scan_counts = defaultdict(int)
+        self._index_origins = {}
         if objlist:
             for obj in objlist:
                 if isinstance(obj, dict):
@@ -339,6 +2239,51 @@ class Table(object):
                                  if not callable(getattr(obj, name)) and
                                  (show_hidden_objlist_fields or name[0] != '_')])))
 
+    # records removed by remove() but still in the record list and the indexes, as
+    # counts by object id; they are dropped in one pass the next time either is used
+    _removed = None
+
+    @property
+    def obs(self):
+        """the table's records: a list, or a L{_ColumnStore} for a columnar table"""
+        if self._removed:
+            self._compact()
+        return self._obs
+
+    @obs.setter
+    def obs(self, obs):
+        self._obs = obs
+        self._removed = None
+
+    @property
+    def _indexes(self):
+        if self._removed:
+            self._compact()
+        return self._index_map
+
+    @_indexes.setter
+    def _indexes(self, indexes):
+        self._index_map = indexes
+
+    def _compact(self):
+        """drop the records marked as removed from the record list and the indexes, in
+           a single pass over the list and one bulk update per index; only the objects
+           found in the list (by identity) are taken out of the indexes."""
+        removed, self._removed = self._removed, None
+        keep, dropped = [], []
+        for ob in self._obs:
+            n = removed.get(id(ob))
+            if n:
+                removed[id(ob)] = n - 1
+                dropped.append(ob)
+            else:
+                keep.append(ob)
+        if dropped:
+            # bitmap indexes map positions in the list, so update them first
+            for ind in self._own_indexes().values():
+                ind.remove_many(dropped)
+            self._obs[:] = keep
+
     def __len__(self):
         """Return the number of objects in the Table."""
         return len(self.obs)
@@ -350,9 +2295,7 @@ class Table(object):
     def __getitem__(self, i):
         """Provides direct indexed/sliced access to the Table's underlying list of objects."""
         if isinstance(i, slice):
-            ret = self.copy_template()
-            ret.insert_many(self.obs[i])
-            return ret
+            return self._view(self.obs[i])
         else:
             return self.obs[i]
     
@@ -383,7 +2326,14 @@ class Table(object):
             return ret
         raise AttributeError("Table '%s' has no index '%s'" % (self.table_name, attr))
 
+    @property
+    def columnar(self):
+        """True if the Table keeps its data in columns rather than row objects."""
+        return isinstance(self._obs, _ColumnStore)
+
     def getcol(self, attr):
+        if self.columnar:
+            return list(self.obs.column(attr))
         return [getattr(ob, attr) for ob in self.obs]
 
     def __bool__(self):
@@ -400,9 +2350,49 @@ class Table(object):
         self.table_name = table_name
         return self
 
-    def set_known_fields(self, fieldlist):
-        """sets field order."""
+    def set_known_fields(self, fieldlist, slots=False):
+        """sets field order.  If C{slots} is True, also declares the fields as the table
+           schema: records created by L{csv_import} are built from a compact C{__slots__}
+           record class (see L{record_class}) instead of DataObject, and tables derived with
+           L{select}, L{join}, L{groupby} and L{splitfield} use slotted records as well.
+           Slotted records cannot gain new attributes by assignment; L{addfield} and
+           L{addfields} extend the schema as needed."""
         self._knownfields = parse_colnames(fieldlist)
+        if slots:
+            self._record_class = record_class(self._knownfields)
+
+    def _derived_record_type(self, ret, fields, other=None):
+        """pick the record type for the rows of table C{ret} (or of a generator, if C{ret}
+           is None) derived from this table (and C{other}): slotted records if a source
+           table uses them, otherwise DataObject."""
+        slotted = self._record_class is not None or \
+                  (other is not None and other._record_class is not None)
+        rectype = _record_type(fields, slotted)
+        if ret is not None:
+            ret._record_class = rectype if rectype is not DataObject else None
+        return rectype
+
+    def _extend_schema(self, *fields):
+        """switch a slotted table to a wider record class, rebuilding its records and indexes."""
+        newfields = list(self._record_class.__slots__) + list(fields)
+        self._record_class = rectype = record_class(newfields)
+        if self._knownfields:
+            self._knownfields += [fld for fld in fields if fld not in self._knownfields]
+        if not self.columnar:
+            # a column store builds its rows from the columns, and gains the new columns
+            # from addfield - only a row list holds records to rebuild
+            self.obs[:] = [rectype(**rec._asdict()) if isinstance(rec, _SlottedRecord)
+                           else rec for rec in self.obs]
+            self._reindex()
+        self._version += 1
+
+    def _reindex(self):
+        """rebuild every index from the current records, filing their keys as
+           L{create_index} does."""
+        for attr, ind in self._indexes.items():
+            self._indexes[attr] = newind = ind.copy_template().bind(self.obs)
+            if not newind.is_bitmap:
+                self._fill_index(newind, self.obs)
 
     def unpack_field(self, field, func=None):
         """unpack a dict field into a bunch of fields."""
@@ -412,7 +2402,7 @@ class Table(object):
             if func is None:
                 func = lambda val: val
             obj.__dict__.update(func(getattr(rec, field)))
-            for fld in rec.__dict__.keys():
+            for fld in _object_attrnames(rec):
                 if fld != field:
                     setattr(obj, fld, getattr(rec, fld))
             newtbl.insert(obj)
@@ -432,22 +2422,26 @@ class Table(object):
             if len(self.obs) == 0:
                 raise ValueError("can't guess fields() from table '%s' -- no records present." %
                                  self.table_name)
-            self._knownfields = sorted(self.obs[0].__dict__.keys())
+            self._knownfields = sorted(_object_attrnames(self.obs[0]))
         return self._knownfields
 
     def copy_template(self, name=None):
         """Create empty copy of the current table, with copies of all
            index definitions.
         """
-        ret = Table(self.table_name)
-        for k,v in self._indexes.items():
-            ret._indexes[k] = v.copy_template()
+        ret = Table(self.table_name, columnar=self.columnar)
+        for k,v in self._index_defs().items():
+            ret._indexes[k] = v.copy_template().bind(ret.obs)
+        ret._record_class = self._record_class
         if name is not None:
             ret(name)
         return ret
 
     def __add__(self, table2):
-        """Create an iterator over the objects in the Table."""
+        """Create a new Table with the objects of both tables (a L{TableView} unless there
+           are unique indexes, whose keys are checked immediately)."""
+        if not any(ind.is_unique for ind in self._index_defs().values()):
+            return self._view(list(self.obs) + list(table2.obs), shared=False)
         ret = self.clone(clone_recs=False)
         ret.insert_many(table2.obs)
         return ret
@@ -462,46 +2456,118 @@ class Table(object):
             ret(name)
         return ret
 
-    def create_index(self, attr, unique=False, accept_none=False):
+    def create_index(self, attr, unique=False, accept_none=False, kind="hash", tokenizer=r"\s+"):
         """Create a new index on a given attribute.
            If C{unique} is True and records are found in the table with duplicate
            attribute values, the index is deleted and C{KeyError} is raised.
 
+           A C{kind="sorted"} index also keeps its key values in sorted order, and is used
+           by L{where} for range criteria (C{attr__gt}, C{attr__le}, C{attr__between}, etc.)
+           and by L{min}/L{max}.
+
+           Passing a tuple of attribute names creates a composite index, keyed on the tuple
+           of the records' values for those attributes; L{where} uses it when all of its
+           attributes are given as equality criteria, and L{join} for multi-attribute joins.
+           Composite indexes can be hash, sorted or bitmap indexes.
+
            If the table already has an index on the given attribute, then no 
            action is taken and no exception is raised.
            @param attr: the attribute to be used for indexed access and joins
-           @type attr: string
+           @type attr: string, or tuple of strings for a composite index
            @param unique: flag indicating whether the indexed field values are 
                expected to be unique across table entries
            @type unique: boolean
            @param accept_none: flag indicating whether None is an acceptable
                unique key value for this attribute
            @type accept_none: boolean
+           A C{kind="bitmap"} index keeps a bitset of record positions per value, for
+           attributes with few distinct values; L{where} combines criteria on bitmap-indexed
+           attributes with bitwise operations, and L{hist} counts them with popcounts.
+
+           A C{kind="tokens"} index is an inverted index from the tokens of each record's
+           value to the records containing them.  With the default whitespace tokenizer,
+           L{where} answers C{attr__hastoken} criteria by intersecting the records of each
+           token of the given value, and narrows C{attr__contains} substring criteria to
+           the records with a token containing the value's longest word, before testing
+           them.  Other criteria on the attribute, and joins on it, do not use the index.
+
+           A C{kind="prefix"} index keeps the string values of the attribute in sorted
+           order, to look up C{attr__startswith} and C{attr__like} criteria on them; as in
+           an unindexed L{where}, non-string values (such as numeric codes) never match
+           these criteria.  Other criteria and joins do not use the index.
+
+           @param kind: type of index - "hash" (default), "sorted", "bitmap", "tokens" or
+               "prefix"
+           @type kind: string
+           @param tokenizer: for a C{kind="tokens"} index, a regular expression matching
+               the separators between the tokens of string values (whitespace by
+               default), or a function returning a string's tokens
+           @type tokenizer: string or callable
         """
+        if isinstance(attr, list):
+            attr = tuple(attr)
+        if isinstance(attr, tuple) and len(attr) == 1:
+            attr = attr[0]
+        if isinstance(attr, tuple) and kind in ("tokens", "prefix"):
+            raise ValueError("%s indexes cannot be composite" % kind)
         if attr in self._indexes:
             return self
-            
-        if unique:
+
+        if kind == "sorted":
+            if unique:
+                raise ValueError("sorted indexes cannot be unique")
+            self._indexes[attr] = _SortedObjIndex(attr)
+            accept_none = True
+        elif kind == "bitmap":
+            if unique:
+                raise ValueError("bitmap indexes cannot be unique")
+            if self.columnar:
+                raise ValueError("bitmap indexes are not supported on columnar tables")
+            self._indexes[attr] = _BitmapIndex(attr).bind(self.obs)
+            return self
+        elif kind == "tokens":
+            if unique:
+                raise ValueError("token indexes cannot be unique")
+            self._indexes[attr] = _TokenIndex(attr, tokenizer)
+            accept_none = True
+        elif kind == "prefix":
+            if unique:
+                raise ValueError("prefix indexes cannot be unique")
+            self._indexes[attr] = _PrefixObjIndex(attr)
+            accept_none = True
+        elif kind != "hash":
+            raise ValueError("unknown index kind: %s" % kind)
+        elif unique:
             self._indexes[attr] = _UniqueObjIndex(attr,accept_none)
         else:
             self._indexes[attr] = _ObjIndex(attr)
             accept_none = True
         ind = self._indexes[attr]
         try:
-            for obj in self.obs:
-                if hasattr(obj, attr):
-                    obval = getattr(obj, attr) or None
-                else:
-                    obval = None
-                if obval or accept_none:
-                    ind[obval] = obj
-                else:
-                    raise KeyError("None is not an allowed key")
+            self._fill_index(ind, self.obs, accept_none)
             return self
                     
         except KeyError:
             del self._indexes[attr]
             raise
+
+    @staticmethod
+    def _fill_index(ind, obs, accept_none=True):
+        """file records in a new index: records missing the attribute, and (unless the
+           index is ordered) all records with false values, are filed under None, which
+           raises C{KeyError} unless accept_none."""
+        keyof = ind.keyof
+        for obj in obs:
+            try:
+                obval = keyof(obj)
+            except AttributeError:
+                obval = None
+            if not ind.is_ordered:
+                obval = obval or None
+            if obval or accept_none:
+                ind[obval] = obj
+            else:
+                raise KeyError("None is not an allowed key")
     
     def delete_index(self, attr):
         """Deletes an index from the Table.  Can be used to drop and rebuild an index,
@@ -511,7 +2577,33 @@ class Table(object):
         """
         if attr in self._indexes:
             del self._indexes[attr]
+            self._index_origins.pop(attr, None)
             
+    _result_cache = None
+
+    def cache_results(self, cache=True):
+        """Keep the results of L{where}, L{groupby} and L{join} on this table in a
+           L{ResultCache}, so that repeating a query on an unchanged table returns the
+           earlier result.  The cache is invalidated by changes made through the table
+           (insert, remove, sort, addfield, etc.), but not by modifying records directly.
+           Function arguments are matched on their code and on the values they read from
+           their closures and globals; calls with functions that read mutable values
+           (lists, dicts, other objects) are not cached.
+           @param cache: cache to use; C{True} for the module's shared cache, or
+               C{False} to stop caching
+           @type cache: L{ResultCache} or boolean
+        """
+        if cache is True:
+            cache = RESULT_CACHE
+        elif cache is False:
+            cache = None
+        self._result_cache = cache
+        return self
+
+    def _touch(self):
+        """record a change to this table's records, invalidating cached results."""
+        self._version += 1
+
     def save(self, name, reuse=True):
         """chained way to memoize results-- use t() to fetch."""
         if not reuse or name not in MEMOIZED_TABLES:
@@ -526,10 +2618,9 @@ class Table(object):
     def insert(self, obj):
         """Insert a new object into this Table.
            @param obj: any Python object
-           Objects can be constructed using the defined DataObject type, or they can
-           be any Python object that does not use the Python C{__slots__} feature; C{littletable}
-           introspect's the object's C{__dict__} or C{_fields} attributes to obtain join and 
-           index attributes and values.
+           Objects can be constructed using the defined DataObject type, a L{record_class}, or
+           they can be any Python object; C{littletable} introspect's the object's C{__dict__},
+           C{_fields} or C{__slots__} attributes to obtain join and index attributes and values.
            
            If the table contains a unique index, and the record to be inserted would add
            a duplicate value for the indexed attribute, then C{KeyError} is raised, and the
@@ -541,32 +2632,44 @@ class Table(object):
            
         # verify new object doesn't duplicate any existing unique index values
         uniqueIndexes = [ind for ind in self._indexes.values() if ind.is_unique]
-        if any((getattr(obj, ind.attr, None) is None and not ind.accept_none) 
-                or (
-                hasattr(obj, ind.attr) and getattr(obj, ind.attr) in ind
-                ) 
-                for ind in uniqueIndexes):
-            # had a problem, find which one
-            for ind in uniqueIndexes:
-                if (getattr(obj, ind.attr, None) is None and not ind.accept_none):
-                    raise KeyError("unique key cannot be None or blank for index %s" % ind.attr, obj)
-                if getattr(obj, ind.attr) in ind:
-                    raise KeyError("duplicate unique key value '%s' for index %s" % (getattr(obj,ind.attr), ind.attr), obj)
+        for ind in uniqueIndexes:
+            try:
+                k = ind.keyof(obj)
+            except AttributeError:
+                if not ind.accept_none:
+                    raise KeyError("unique key cannot be None or blank for index %s" % _attr_label(ind.attr), obj)
+                continue
+            if k is None and not ind.accept_none:
+                raise KeyError("unique key cannot be None or blank for index %s" % _attr_label(ind.attr), obj)
+            if k in ind:
+                raise KeyError("duplicate unique key value '%s' for index %s" % (k, _attr_label(ind.attr)), obj)
 
         self.obs.append(obj)
-        for attr, ind in self._indexes.items():
-            obval = getattr(obj, attr)
-            ind[obval] = obj
+        for ind in self._indexes.values():
+            ind[ind.keyof(obj)] = obj
+        self._version += 1
         return self
             
     def insert_many(self, it, clone_recs=False):
-        """Inserts a collection of objects into the table."""
-        if clone_recs:
-            for ob in it:
-                self.insert(copy.deepcopy(ob))
-        else:
-            for ob in it:
-                self.insert(ob)
+        """Inserts a collection of objects into the table.  The objects are appended in
+           one step, and then each index is extended in a single pass.  Unique index keys
+           are checked for the whole batch before anything is added, so if any object
+           would duplicate a unique key (or lacks an indexed attribute), the exception is
+           raised and the table is left unchanged."""
+        obs = [copy.deepcopy(ob) for ob in it] if clone_recs else list(it)
+        if not obs:
+            return self
+        indexkeys = []
+        for ind in self._indexes.values():
+            keyof = ind.keyof
+            keys = [keyof(ob) for ob in obs]
+            if ind.is_unique:
+                ind.check_new_keys(keys)
+            indexkeys.append((ind, keys))
+        self.obs.extend(obs)
+        for ind, keys in indexkeys:
+            ind.extend(keys, obs)
+        self._version += 1
         return self
 
     def insert_obs_fast(self, obs):
@@ -583,30 +2686,413 @@ class Table(object):
 
     def remove(self, ob):
         """Removes an object from the table. If object is not in the table, then
-           no action is taken and no exception is raised."""
-        # remove from indexes
-        for unused,ind in self._indexes.items():
-            ind.remove(ob)
-
-        # remove from main object list
-        self.obs.remove(ob)
+           no action is taken and no exception is raised.  The object (matched by
+           identity) is marked as removed, and marked objects are dropped from the
+           record list and the indexes in a single pass when either is next used, so
+           removing many records one at a time costs one pass over the table rather
+           than one per record.  A columnar table removes the first row equal to the
+           object, and rebuilds its indexes."""
+        if self.columnar:
+            try:
+                self.obs.remove(ob)
+            except ValueError:
+                return
+            # the indexes hold their own snapshots of the rows, not the row the
+            # caller got from iterating the table
+            self._reindex()
+        else:
+            if self._removed is None:
+                self._removed = defaultdict(int)
+            self._removed[id(ob)] += 1
+        self._version += 1
 
     def remove_many(self, it):
-        """Removes a collection of objects from the table."""
-        for ob in it:
-            self.remove(ob)
+        """Removes a collection of objects from the table, in a single pass over the
+           table's records and one bulk update per index.  Objects not in the table
+           are ignored."""
+        if self.columnar:
+            numremoved = 0
+            for ob in it:
+                try:
+                    self.obs.remove(ob)
+                except ValueError:
+                    continue
+                numremoved += 1
+            if numremoved:
+                self._version += 1
+                self._reindex()
+            return
+        obs = list(it)
+        if not obs:
+            return
+        ids = set(id(ob) for ob in obs)
+        for ind in self._indexes.values():
+            ind.remove_many(obs)
+        self.obs[:] = [ob for ob in self.obs if id(ob) not in ids]
+        self._version += 1
+
+    def delete_where(self, wherefn):
+        """Deletes all objects for which C{wherefn(ob)} returns True, in a single pass
+           over the table and one bulk update per index.
+           @param wherefn: a method or lambda that returns a boolean result
+           @return: the number of objects removed from the table
+        """
+        if self.columnar:
+            mask = [not wherefn(ob) for ob in self.obs]
+            numdeleted = mask.count(False)
+            if numdeleted:
+                self.obs.compress(mask)
+                self._version += 1
+                self._reindex()
+            return numdeleted
+        keep, dropped = [], []
+        for ob in self.obs:
+            (dropped if wherefn(ob) else keep).append(ob)
+        if dropped:
+            for ind in self._indexes.values():
+                ind.remove_many(dropped)
+            self.obs[:] = keep
+            self._version += 1
+        return len(dropped)
 
     def _query_attr_sort_fn(self, attr_val):
-        attr,v = attr_val
-        if attr in self._indexes:
-            idx = self._indexes[attr]
-            if v in idx:
-                return len(idx[v])
+        """estimated number of records matching a where() criterion, from the index
+           statistics if the attribute is indexed; criteria that must be tested by
+           scanning sort after all of those that an index can answer."""
+        attr,op = _parse_criterion(attr_val[0])
+        v = attr_val[1]
+        numobs = len(self.obs)
+        idx = self._lookup_indexes().get(attr)
+        estimate = None
+        if idx is not None:
+            estimate = idx.estimate(op, v)
+            if estimate is not None and idx is not self._own_indexes().get(attr):
+                # a parent table's index - scale to the size of this table
+                estimate = estimate * numobs / max(idx.stats().count, 1)
+            if estimate is not None and _index_answers(idx, op, v):
+                return estimate
+        if estimate is None:
+            if op == "in":
+                selectivity = min(1.0, _OP_SELECTIVITY["in"] * len(v))
+            elif op == "isnull" and not v:
+                selectivity = 1.0 - _OP_SELECTIVITY["isnull"]
+            else:
+                selectivity = _OP_SELECTIVITY[op]
+            estimate = numobs * selectivity
+        return numobs + estimate
+
+    def index_stats(self, attr):
+        """Return statistics of the values of an indexed attribute, as a dict with:
+            - C{count} - number of records
+            - C{distinct} - number of distinct values other than None
+            - C{nulls} - number of records where the value is None (or, for hash indexes
+              created after records were inserted, any false value)
+            - C{top} - the most frequent values, as C{(value, count)} tuples
+            - C{histogram} - equi-depth histogram of the values other than None, as
+              C{(largest value, cumulative count)} tuples, one per bucket
+           The statistics are computed when first needed, and recomputed once the index
+           has changed by more than about 10%.  L{where} uses them to test the most
+           selective criteria first, and L{join} to choose which table drives the join;
+           L{pivot} does not, as it builds a sub-table for every key whatever the keys'
+           frequencies.
+           @param attr: name of an indexed attribute (or tuple of names, for a composite index)
+        """
+        if isinstance(attr, list):
+            attr = tuple(attr)
+        return self._indexes[attr].stats().asdict()
+
+    _auto_index_threshold = None
+
+    def auto_index(self, threshold=10):
+        """Create indexes automatically: once L{where} has had to scan the table for
+           equality or range criteria on an unindexed attribute C{threshold} times, a hash
+           index (or, for range, C{startswith} and C{like} criteria, a sorted index) is
+           created on the attribute; L{pivot} also indexes the attributes it is given.
+           Queries on views of the table count towards the table's scans.
+           @param threshold: number of scans of an attribute before it is indexed, or
+               None to stop creating indexes
+           @type threshold: int
+        """
+        self._auto_index_threshold = threshold
+        return self
+
+    def _note_scan(self, attr, op):
+        """count a where() scan for a criterion on attr that no index could answer."""
+        kind = _SCAN_INDEX_KINDS.get(op)
+        if kind is None or isinstance(attr, tuple):
+            return
+        tbl = self._lookup_root() or self
+        tbl._scan_counts[attr, kind] += 1
+        threshold = tbl._auto_index_threshold
+        if (threshold is not None and tbl._scan_counts[attr, kind] >= threshold and
+                attr not in tbl._indexes):
+            tbl._create_index_for(attr, "auto", kind=kind)
+
+    def _create_index_for(self, attr, origin, **kwargs):
+        """create an index that the user did not ask for, noting where it came from."""
+        self.create_index(attr, **kwargs)
+        self._index_origins[attr] = origin
+
+    def index_report(self):
+        """Report on this table's indexing, as a table with a record per attribute:
+            - C{attr} - attribute name (or names, for a composite index)
+            - C{index} - kind of the attribute's index, or None
+            - C{origin} - how the index was created: C{"user"}, or C{"join"} or C{"auto"}
+              for indexes created by L{join} or by L{auto_index}
+            - C{uses} - number of lookups answered by the index
+            - C{scans} - number of times L{where} had to scan the records for a criterion
+              on the attribute (including queries on views of this table)
+            - C{advice} - C{"create hash"}/C{"create sorted"} for scanned attributes
+              without a suitable index, C{"replace with sorted"} for attributes scanned
+              for range criteria that a non-unique index of another kind cannot answer
+              (L{delete_index}, then L{create_index} with C{kind="sorted"}),
+              C{"unused"} for indexes that have not been used, or C{"ok"}
+           sorted by descending number of scans.
+        """
+        scans = defaultdict(dict)
+        for (attr, kind), n in self._scan_counts.items():
+            scans[attr][kind] = n
+        ret = Table(self.table_name + "_index_report")
+        for attr in set(scans) | set(self._indexes):
+            ind = self._indexes.get(attr)
+            kind = None if ind is None else _index_kind(ind)
+            counts = scans.get(attr, {})
+            if counts.get("sorted") and ind is None:
+                advice = "create sorted"
+            elif counts.get("sorted") and not (ind.is_unique or _index_answers(ind, "gt", 0)):
+                advice = "replace with sorted"
+            elif counts.get("hash") and ind is None:
+                advice = "create hash"
+            elif ind is not None and not ind.uses:
+                advice = "unused"
             else:
-                return 0
+                advice = "ok"
+            ret.insert(DataObject(attr=_attr_label(attr), index=kind,
+                                  origin=None if ind is None else self._index_origins.get(attr, "user"),
+                                  uses=0 if ind is None else ind.uses,
+                                  scans=sum(counts.values()), advice=advice))
+        return ret.sort("scans desc,attr")
+
+    def _index_defs(self):
+        """indexes defining this table's index attributes (used as templates)."""
+        return self._indexes
+
+    def _own_indexes(self):
+        """this table's populated indexes, without building any."""
+        return self._indexes
+
+    def _lookup_indexes(self):
+        """populated indexes that can answer lookups for this table's records - see
+           L{_indexed_rows}."""
+        return self._indexes
+
+    def _indexed_rows(self, rows):
+        """narrow the result of a L{_lookup_indexes} lookup to this table's records."""
+        return rows
+
+    def _lookup_root(self):
+        """table whose indexes views of this table can use for lookups, or None."""
+        return None if self.columnar else self
+
+    def _view(self, rows, shared=True):
+        """wrap a list of this table's records in a L{TableView}; if C{shared} is False, the
+           rows are not all from this table and the view will not use its indexes."""
+        return TableView(self, rows, shared)
+
+    def _matching_rows(self, key, val, lazy=False):
+        """list of records matching a single where() criterion, using an index if possible
+           (if lazy, a full scan is returned as an iterator instead of a list)."""
+        attr, op = _parse_criterion(key)
+        ind = self._lookup_indexes().get(attr)
+        rows = None
+        # skip the index when it would return more records than a scan has to test
+        if ind is not None and (self._lookup_root() is self or
+                                (ind.estimate(op, val) or 0) <= len(self.obs)):
+            rows = _index_rows(ind, attr, op, val)
+        if rows is not None and len(rows) <= len(self.obs):
+            ind.uses += 1
+            return self._indexed_rows(rows)
+        if ind is None or not _index_answers(ind, op, val):
+            self._note_scan(attr, op)
+        if op == "eq" and self.columnar:
+            return self.obs.rows_where(attr, val)
+        return (ifilter if lazy else filter)(_criteria_test({key: val}), self.obs)
+
+    def _indexed_criteria(self, criteria):
+        """whether any of a list of where() criteria can be answered by an index."""
+        indexes = self._lookup_indexes()
+        for key, val in criteria:
+            attr, op = _parse_criterion(key)
+            if attr in indexes and _index_answers(indexes[attr], op, val):
+                return True
+        return False
+
+    def _columnar_where(self, criteria, wherefn):
+        """view of the records of a columnar table matching a list of where() criteria
+           and, if it is an L{Expr}, the filter function, testing the values of each
+           column in turn rather than row snapshots; returns the view and the filter
+           function still to be applied to its records."""
+        store = self.obs
+        mask = None
+        for key, val in criteria:
+            attr, op = _parse_criterion(key)
+            self._note_scan(attr, op)
+            if attr not in store.fields:
+                return self._view([]), None
+            val = _criterion_value(op, val)
+            fn, column = _WHERE_OPS[op], store.column(attr)
+            if op in _NONE_OPS:
+                tests = imap(fn, column, repeat(val))
+            else:
+                tests = (colval is not None and fn(colval, val) for colval in column)
+            mask = list(tests) if mask is None else [keep and test for keep, test in izip(mask, tests)]
+        if isinstance(wherefn, Expr):
+            try:
+                exprmask = wherefn._evaluate(store)
+            except (ArithmeticError, TypeError, ValueError):
+                # & and | evaluate both operands over the whole column, which can fail
+                # where testing one record at a time would have stopped early - leave
+                # the expression to be tested on each matching record
+                pass
+            else:
+                mask = exprmask if mask is None else [a and b for a, b in izip(mask, exprmask)]
+                wherefn = None
+        if mask is None:
+            return self._view(list(store)), wherefn
+        return self._view(store.rows_masked(mask)), wherefn
+
+    def query(self, *args, **kwargs):
+        """Create a lazily-evaluated L{Query} on this table; any arguments are passed
+           to L{Query.where}."""
+        ret = Query(self)
+        if args or kwargs:
+            ret = ret.where(*args, **kwargs)
+        return ret
+
+    def _composite_index_for(self, criteria):
+        """the composite index covering the most equality criteria (all of its attributes
+           must be given), or None."""
+        best = None
+        for attr, ind in self._lookup_indexes().items():
+            if (isinstance(attr, tuple) and all(a in criteria for a in attr) and
+                    (best is None or len(attr) > len(best.attr))):
+                best = ind
+        return best
+
+    def _where_function(self, args, kwargs):
+        """the filter function given to where() (or None); the comparisons of attributes
+           with constant values in an L{Expr} are moved into the keyword criteria."""
+        if not args:
+            return None
+        wherefn = args[0]
+        if isinstance(wherefn, Expr):
+            criteria, wherefn = _expr_criteria(wherefn, kwargs)
+            kwargs.update(criteria)
+        return wherefn
+
+    def _where_criteria(self, kwargs, wherefn=None):
+        """the records matching a composite index, or the bitmap indexes, on some of the
+           where() criteria (or None if no such index applies); the remaining criteria in
+           the order in which they should be applied - ascending order of number of
+           matching records, to minimize the number of records that each subsequent
+           criterion has to filter; and the remaining filter function."""
+        rows = None
+        ind = self._composite_index_for(kwargs)
+        if ind is not None:
+            # all of a composite index's attributes are given - one dict probe
+            # replaces a filtering pass per attribute
+            rows = self._indexed_rows(list(ind[tuple(kwargs.pop(a) for a in ind.attr)]))
+            ind.uses += 1
         else:
-            return 1e9
-        
+            rows, wherefn = self._bitmap_rows(kwargs, wherefn)
+        tokenrows, wherefn = self._token_match_rows(wherefn)
+        if tokenrows is not None:
+            if rows is None:
+                rows = tokenrows
+            else:
+                ids = set(imap(id, tokenrows))
+                rows = [ob for ob in rows if id(ob) in ids]
+        criteria = kwargs.items()
+        if len(criteria) > 1:
+            criteria = sorted(criteria, key=self._query_attr_sort_fn)
+        return rows, criteria, wherefn
+
+    def _token_match_rows(self, wherefn):
+        """the records matching a token-matching filter function (such as
+           C{reporting_funcs.MATCH_SELLER_CATS}) from a token index on its attribute, or
+           None if there is no such index; returns the records and the remaining filter
+           function.  The filter function describes itself with a C{token_match} attribute
+           C{(attr, tokenizer, include, exclude)}: records with any of the include tokens
+           and none of the exclude tokens match."""
+        match = getattr(wherefn, "token_match", None)
+        if match is None:
+            return None, wherefn
+        attr, tokenizer, include, exclude = match
+        ind = self._lookup_indexes().get(attr)
+        if ind is None or not ind.is_tokens or ind.tokenizer != tokenizer:
+            return None, wherefn
+        ind.uses += 1
+        rows = ind.matching_any(include)
+        if exclude and rows:
+            excluded = set(imap(id, ind.matching_any(exclude)))
+            rows = [ob for ob in rows if id(ob) not in excluded]
+        return self._indexed_rows(rows), None
+
+    def _bitmap_rows(self, kwargs, wherefn):
+        """the records matching all of the criteria (and L{Expr} terms of wherefn) that
+           bitmap indexes can answer, combining their bitmaps before fetching any records
+           (or None if there are no such criteria); returns the records and the rest of
+           wherefn."""
+        indexes = self._lookup_indexes()
+        bitmaps = [ind for ind in indexes.values() if ind.is_bitmap]
+        if not bitmaps:
+            return None, wherefn
+        bits = None
+        for key in list(kwargs):
+            ind = indexes.get(_parse_criterion(key)[0])
+            if ind is not None and ind.is_bitmap:
+                ind.uses += 1
+                b = ind.bits_for(_parse_criterion(key)[1], kwargs.pop(key))
+                bits = b if bits is None else bits & b
+        if isinstance(wherefn, Expr):
+            rest = []
+            for term in wherefn._conjuncts():
+                b = self._expr_bits(term, indexes, bitmaps[0])
+                if b is None:
+                    rest.append(term)
+                else:
+                    bits = b if bits is None else bits & b
+            wherefn = reduce(operator.and_, rest) if rest else None
+        if bits is None:
+            return None, wherefn
+        return self._indexed_rows(bitmaps[0].rows_for(bits)), wherefn
+
+    def _expr_bits(self, expr, indexes, universe):
+        """bitmap of the records matching an L{Expr}, if every comparison in it can be
+           answered by a bitmap index, else None; C{&}, C{|} and C{~} become bitwise
+           operations, with negations taken over all positions in the C{universe} index."""
+        if isinstance(expr, _BoolOp):
+            left = self._expr_bits(expr.left, indexes, universe)
+            if left is None:
+                return None
+            right = self._expr_bits(expr.right, indexes, universe)
+            if right is None:
+                return None
+            return left & right if expr.isand else left | right
+        if isinstance(expr, _UnaryOp) and expr.op is operator.not_:
+            bits = self._expr_bits(expr.operand, indexes, universe)
+            return None if bits is None else universe.all_bits() & ~bits
+        crit = expr._criterion()
+        if crit is None:
+            return None
+        attr, op = _parse_criterion(crit[0])
+        ind = indexes.get(attr)
+        if ind is None or not ind.is_bitmap:
+            return None
+        ind.uses += 1
+        return ind.bits_for(op, crit[1])
+
+    @_cached_result
     def where(self, *args, **kwargs):
         """Retrieves matching objects from the table, based on given
            named parameters.  If multiple named parameters are given, then
@@ -616,59 +3102,112 @@ class Table(object):
                
                lambda ob : ob.unitprice > 10
                
-           @type wherefn: callable(object) returning boolean
+           @type wherefn: callable(object) returning boolean, or an L{Expr}, whose
+              comparisons of attributes with constant values are used as keyword
+              criteria, and which is evaluated a column at a time on columnar tables
            
            @param **kwargs: attributes for selecting records, given as additional 
-              named arguments of the form C{attrname="attrvalue"}.
+              named arguments of the form C{attrname="attrvalue"}.  Other comparisons
+              can be given as C{attrname__op=value}, where op is one of:
+               - C{ne}, C{gt}, C{ge}, C{lt}, C{le} - compare with value
+               - C{between} - value is a C{(low, high)} tuple, inclusive
+               - C{in} - value is a collection of values to match
+               - C{startswith}, C{endswith} - value is a string
+               - C{like} - value is a SQL-style pattern, where C{%} matches any characters
+                 and C{_} any single character, e.g. C{"ANV%-001"}
+               - C{contains} - attribute value contains the given item or substring
+               - C{hastoken} - attribute value has all of the whitespace-separated tokens
+                 of the given value as whole tokens (a list, tuple or set value's items
+                 are its tokens)
+               - C{isnull} - True to match None values, False to match the rest
+              C{in} and C{isnull} use any index on the attribute, ranges use a
+              C{kind="sorted"} index, and C{startswith} and C{like} (for the characters
+              before the first wildcard) use a C{kind="sorted"} or C{kind="prefix"} index.  Records where the attribute
+              is None only match C{eq}, C{in} and C{isnull} criteria.
               
            Special kwargs:
             - C{_orderby="attr,..."} - resulting table should sort content objects
                 by the C{attr}s given in a comma-separated string; to sort in 
                 descending order, reference the attribute as C{attr desc}.
-            - C{_limit} - maximum number of records to return
+            - C{_limit} - maximum number of records to return; together with
+                C{_orderby}, only the top C{_limit} records are selected, using a
+                bounded heap rather than a full sort
+            These are applied after all of the other criteria and C{wherefn}.
 
-           @return: a new Table containing the matching objects
+           @return: a new L{TableView} containing the matching objects
         """
         # extract meta keys
-        flags = [(k,v) for k,v in kwargs.items() if k.startswith("_")]
-        for f,v in flags:
+        flags = dict((k,v) for k,v in kwargs.items() if k.startswith("_"))
+        for f in flags:
             del kwargs[f]
-
-        if kwargs:
-            # order query criteria in ascending order of number of matching items
-            # for each individual given attribute; this will minimize the number 
-            # of filtering records that each subsequent attribute will have to
-            # handle
-            kwargs = kwargs.items()
-            if len(kwargs) > 1 and len(self.obs) > 100:
-                kwargs = sorted(kwargs, key=self._query_attr_sort_fn)
-                
-            ret = self
-            for k,v in kwargs:
-                newret = ret.copy_template()
-                if k in ret._indexes:
-                    newret.insert_many(ret._indexes[k][v])
-                else:
-                    newret.insert_many( r for r in ret.obs 
-                                    if hasattr(r,k) and getattr(r,k) == v )
-                ret = newret
+        wherefn = self._where_function(args, kwargs)
+        rows, criteria, wherefn = self._where_criteria(kwargs, wherefn)
+
+        if rows is None and self.columnar and not self._indexed_criteria(criteria):
+            # test the criteria (and an Expr) over whole columns, and only build the
+            # matching rows
+            ret, wherefn = self._columnar_where(criteria, wherefn)
+        elif rows is not None or criteria:
+            ret = self if rows is None else self._view(rows)
+            # each step is a view on the previous one, answering indexed criteria from
+            # this table's indexes, so no intermediate indexes get built
+            for k,v in criteria:
+                ret = ret._view(ret._matching_rows(k, v))
+            if ret is self:
+                ret = self._view(list(self.obs))
         else:
-            ret = self.clone(clone_recs=False)
+            ret = self._view(list(self.obs))
         
-        for f,v in flags:
-            if f == "_orderby":
-                ret.sort(v)
-            if f == "_limit":
-                del ret.obs[v:]
+        if wherefn is not None:
+            ret = ret._view(list(ifilter(_compiled(wherefn), ret.obs)))
 
-        if args:
-            wherefn = args[0]
-            newret = ret.copy_template()
-            newret.insert_many(ifilter(wherefn, ret.obs))
-            ret = newret
+        orderby, limit = flags.get("_orderby"), flags.get("_limit")
+        if orderby is not None and limit is not None:
+            ret = ret._view(_top_records(ret.obs, orderby, limit))
+        else:
+            if orderby is not None:
+                ret.sort(orderby)
+            if limit is not None:
+                del ret.obs[limit:]
 
         return ret
 
+    def iter_where(self, *args, **kwargs):
+        """Generator version of L{where}, taking the same arguments: yields the matching
+           records one at a time instead of building a result table.  The first criterion
+           is answered from an index in the same way as L{where}, and the remaining
+           criteria and C{wherefn} filter the records as they are yielded.  C{_orderby}
+           has to collect the matching records to sort them (with C{_limit}, only the top
+           C{_limit} records are kept).
+        """
+        flags = dict((k,v) for k,v in kwargs.items() if k.startswith("_"))
+        for f in flags:
+            del kwargs[f]
+        wherefn = self._where_function(args, kwargs)
+
+        rows, criteria, wherefn = self._where_criteria(kwargs, wherefn)
+        if rows is None:
+            if criteria:
+                k,v = criteria.pop(0)
+                rows = self._matching_rows(k, v, lazy=True)
+            else:
+                rows = self.obs
+        rows = iter(rows)
+        for k,v in criteria:
+            rows = ifilter(_criteria_test({k: v}), rows)
+        if wherefn is not None:
+            rows = ifilter(_compiled(wherefn), rows)
+
+        orderby, limit = flags.get("_orderby"), flags.get("_limit")
+        if orderby is not None and limit is not None:
+            rows = _top_records(rows, orderby, limit)
+        elif orderby is not None:
+            rows = _sort_records(list(rows), orderby)
+        elif limit is not None:
+            rows = islice(rows, limit)
+        for rec in rows:
+            yield rec
+
     def delete(self, **kwargs):
         """Deletes matching objects from the table, based on given
            named parameters.  If multiple named parameters are given, then
@@ -679,6 +3218,8 @@ class Table(object):
         """
         if not kwargs:
             return 0
+        if self.columnar:
+            return self.delete_where(_criteria_test(kwargs))
         
         affected = self.where(**kwargs)
         self.remove_many(affected)
@@ -698,46 +3239,35 @@ class Table(object):
         return ret
 
     def select(self, *fields, **exprs):
-        parsed_fields = []
-        for flds in [parse_colnames(fld) for fld in fields]:
-            parsed_fields += flds
+        parsed_fields, exprs = _select_columns(fields, exprs)
         ret = Table()
-        def get_field(name):
-            def get_field_helper(rec):
-                return getattr(rec, name, "")
-            return get_field_helper
-        def eval_expr(expr):
-            def eval_expr_helper(rec):
-                return eval(expr)
-        for i, expr in enumerate(exprs.values()):
-            if isinstance(expr, basestring):
-                if re.search(r'^[a-zA-Z0-9_]+$', expr):
-                    exprs[i] = get_field(expr)
-                else:
-                    exprs[i] = eval_field(expr)
-        for rec in self.obs:
-            newrec = DataObject()
-            for fieldname in parsed_fields:
-                setattr(newrec, fieldname, getattr(rec, fieldname))
-            for fieldname, expr in exprs.items():
-                setattr(newrec, fieldname, expr(rec))
-            ret.insert(newrec)
+        rectype = self._derived_record_type(ret, parsed_fields + exprs.keys())
+        ret.insert_many(imap(_projector(parsed_fields, exprs, rectype), self.obs))
         return ret
 
+    def iter_select(self, *fields, **exprs):
+        """Generator version of L{select}: yields the selected fields of each record as
+           a new record, without building a result table."""
+        parsed_fields, exprs = _select_columns(fields, exprs)
+        rectype = self._derived_record_type(None, parsed_fields + exprs.keys())
+        return imap(_projector(parsed_fields, exprs, rectype), self.obs)
+
     def sort(self, key, reverse=False):
-        """sort the results by the given key or keys, e.g. key1 asc, key2, key3 desc"""
-        if isinstance(key, basestring):
-            attrs = [s.strip() for s in key.split(',')]
-            # leftmost attr is the most primary sort key, so do succession of 
-            # sorts from right to left
-            attr_orders = [(a.split()+['asc',])[:2] for a in attrs][::-1]
-            for attr,order in attr_orders:
-                 self.obs.sort(key=lambda ob:getattr(ob,attr), reverse=(order=="desc"))
-        else:
-            keyfn = key
-            self.obs.sort(key=keyfn, reverse=reverse)
+        """sort the results by the given key or keys, e.g. key1 asc, key2, key3 desc
+           (sorted in one pass on a combined key).  The sort is stable: records with
+           equal keys keep their current order, so sorts on successive keys combine."""
+        _sort_records(self.obs, key, reverse)
+        self._reordered()
         return self
 
+    def _reordered(self):
+        """record a change in the order of this table's records; bitmap indexes refer to
+           record positions, so they are rebuilt."""
+        self._version += 1
+        for ind in self._own_indexes().values():
+            if ind.is_bitmap:
+                ind.rebuild()
+
     def unique(self, fields=None):
         """select unique rows."""
         ret = self.copy_template()
@@ -758,7 +3288,7 @@ class Table(object):
         ret = self.copy_template()
         for rec in self.obs:
             newrec = DataObject()
-            for fld, val in rec.__dict__.items():
+            for fld, val in _object_asdict(rec).items():
                 setattr(newrec, fld, func(val))
             ret.insert(newrec)
         return ret
@@ -766,7 +3296,8 @@ class Table(object):
     def addsummaryrow(self, rollupfields="", keep_original_data=True, **outexprs):
         """groupby() each column specified in the keyword args and use this to create a new
         row-- "" is the default if not specified; if the value is not a callable, use that
-        as the value for that column. see groupby() for help on rollupfields.
+        as the value for that column. see groupby() for help on rollupfields; aggregators
+        (see reporting_funcs.Aggregator) are all computed in one pass over the records.
         """
         ret = self.clone(clone_recs=False)
         newrec = DataObject()
@@ -774,9 +3305,14 @@ class Table(object):
             for func, fieldlist in [funcspec.split(":") for funcspec in rollupfields.split(";")]:
                 for field in fieldlist.split(","):
                     outexprs[field] = (globals()[func])(field)
+        aggs = [(fld, func) for fld, func in outexprs.items() if _is_aggregator(func)]
+        values = dict(izip([fld for fld,_ in aggs], _aggregate([agg for _,agg in aggs], self.obs)))
         for fld, func in outexprs.items():
-            setattr(newrec, fld, func([rec for rec in self.obs])) \
-                if callable(func) else setattr(newrec, fld, func)
+            if fld in values:
+                setattr(newrec, fld, values[fld])
+            else:
+                setattr(newrec, fld, func([rec for rec in self.obs])) \
+                    if callable(func) else setattr(newrec, fld, func)
         if keep_original_data:
             ret.insert(newrec)
             return ret
@@ -787,9 +3323,18 @@ class Table(object):
         function if you want your own, e.g. SUM.  examples:
         load_table("orders", "2011-01-01", "2011-03-01").hist('company_id')
         load_table("orders", "2011-01-01", "2011-03-01").hist('company_id', SUM('totalcost'))
+        the counts (or an aggregator func) are computed in one pass, without collecting
+        each key's records.
         """
         if func is None:
-            func = lambda recs: len(recs)
+            ind = self._own_indexes().get(keyfield)
+            if ind is not None and ind.is_bitmap:
+                # count each value's records with a popcount
+                counts = dict(ind.key_counts())
+                if ind.missing:
+                    counts["all"] = _popcount(ind.missing)
+                return counts
+            func = COUNT()
         return self.groupby(keyfield, out=func).dict(keyfield, "out")
 
     def dict(self, keyfield, valfield=None, fmt="rec"):
@@ -800,7 +3345,7 @@ class Table(object):
             return dict( (rec[keyfield], rec[valfield]) for rec in self.obs)
         if fmt == "rec":
             return dict( (rec[keyfield], rec) for rec in self.obs)
-        return dict( (rec[keyfield], rec.__dict__) for rec in self.obs)
+        return dict( (rec[keyfield], _object_asdict(rec)) for rec in self.obs)
     
     def py_dict(self, keyfield, valfield=None):
         return self.dict(keyfield, valfield=valfield, fmt="__dict__")
@@ -810,22 +3355,42 @@ class Table(object):
 
     def list(self, field):
         """get a field as a list of values"""
-        return [getattr(rec, field) for rec in self.obs]
+        return self.getcol(field)
 
     def tolist(self, field):
         return self.list(field)
 
     def sum(self, field):
+        if self.columnar:
+            col = self.obs.column(field)
+            if isinstance(col, array.array):
+                return float(sum(col))
+            return sum(float(val) for val in col)
         return sum([float(getattr(rec, field)) for rec in self.obs])
 
     def avg(self, field):
         if len(self.obs) == 0: return 0.0
-        return (sum([float(getattr(rec, field)) for rec in self.obs]) / len(self.obs))
+        return self.sum(field) / len(self.obs)
+
+    def _sorted_index(self, field):
+        """sorted index on field if one covers every record, else None."""
+        ind = self._own_indexes().get(field)
+        if ind is not None and ind.is_ordered and ind.sortedkeys and not ind.obs.get(None):
+            return ind
+        return None
 
     def max(self, field):
+        if self._sorted_index(field):
+            return self._sorted_index(field).max()
+        if self.columnar:
+            return max(self.obs.column(field))
         return max([getattr(rec, field) for rec in self.obs])
 
     def min(self, field):
+        if self._sorted_index(field):
+            return self._sorted_index(field).min()
+        if self.columnar:
+            return min(self.obs.column(field))
         return min([getattr(rec, field) for rec in self.obs])
 
     def set(self, field):
@@ -893,6 +3458,10 @@ class Table(object):
         keep==True keeps the source field in the output
         """
         ret = self.copy_template()
+        rectype = DataObject
+        if self._record_class is not None:
+            rectype = self._derived_record_type(
+                ret, [fld for fld in self._record_class.__slots__ if keep or fld != field] + [destfield])
         rx = re.compile(splitregexp)
         for rec in self.obs:
             srcval = getattr(rec, field, "")
@@ -902,15 +3471,30 @@ class Table(object):
             if maxrecords:
                 vals = vals[0:maxrecords-1]
             for val in vals:
-                newrec = DataObject()
-                newrec.__dict__.update(rec.__dict__)
+                newvals = dict(_object_asdict(rec))
                 if not keep:
-                    newrec.__delattr__(field)
-                newrec.__dict__[destfield] = val
-                ret.insert(newrec)
+                    del newvals[field]
+                newvals[destfield] = val
+                ret.insert(rectype(**newvals))
         return ret
 
-    def join(self, other, attrlist=None, auto_create_indices=True, **kwargs):
+    def _join_key_attrs(self, other, kwargs):
+        """join attribute (or tuple of attributes) for each table, from join()'s kwargs;
+           multiple attributes are put in the order of an existing composite index."""
+        pairs = sorted(kwargs.items())
+        if len(pairs) == 1:
+            return pairs[0]
+        for tbl, side in ((self, 0), (other, 1)):
+            attrs = set(pair[side] for pair in pairs)
+            for indattr in tbl._indexes:
+                if isinstance(indattr, tuple) and len(indattr) == len(pairs) and set(indattr) == attrs:
+                    pairs.sort(key=lambda pair: indattr.index(pair[side]))
+                    return tuple(p[0] for p in pairs), tuple(p[1] for p in pairs)
+        return tuple(p[0] for p in pairs), tuple(p[1] for p in pairs)
+
+    @_cached_result
+    def join(self, other, attrlist=None, auto_create_indices=True, how="inner", fill=None,
+             bloom=False, bloom_maxbytes=None, workers=None, **kwargs):
         """
         Join the objects of one table with the objects of another, based on the given 
         matching attributes in the named arguments.  The attrlist specifies the attributes to 
@@ -930,28 +3514,182 @@ class Table(object):
         @param other: other table to join to
         @param attrlist: list of attributes to be copied to the new joined table; if 
             none provided, all attributes of both tables will be used (taken from the first 
-            object in each table)
+            object in each table, or for an empty table, from its known fields or
+            indexed attributes)
         @type attrlist: string, or list of strings or C{(table,attribute[,alias])} tuples
             (list may contain both strings and tuples)
         @param **kwargs: attributes to join on, given as additional named arguments
             of the form C{table1attr="table2attr"}, or a dict mapping attribute names.
+            If several attributes are given, the join matches on all of them, using
+            a composite index (see L{create_index}) on each table.  Keys match when
+            their values are equal, as in L{where} (so 0 matches 0 but not None or "");
+            records without the join attribute match nothing.
+        @param how: type of join:
+            - C{"inner"} (default) - only pairs of matching records
+            - C{"left"}, C{"right"}, C{"full"} - also the records of this table, of the
+              other table, or of both, that have no match, with the missing table's
+              columns set to the fill value
+            - C{"semi"}, C{"anti"} - the records of this table that do (or do not) have
+              a match in the other table, found by looking up each record's key in the
+              other table's index; the records themselves are returned, in a view of
+              this table, and attrlist is ignored
+        @type how: string
+        @param fill: value for the columns of the missing table in the unmatched records of
+            an outer join, or a dict of values by column name (columns not in the dict
+            are set to None)
+        @param bloom: reduce the larger table (of those whose unmatched records are not
+            kept) before joining, if it has no index on its join attribute: only its
+            records whose keys pass a Bloom filter built from the other table's keys are
+            indexed and joined; True for a false-positive rate of 1%, or the rate to use
+        @type bloom: boolean or float
+        @param bloom_maxbytes: maximum size of the Bloom filter's bit array
+        @type bloom_maxbytes: int
+        @param workers: number of worker processes for an inner or left join of large
+            tables: both tables' records are hash partitioned on the join key, and each
+            pair of partitions is joined in its own process (the join attributes' indexes
+            and bloom are not used); other join types are always run in this process
+        @type workers: int
         @returns: a new Table containing the joined data as new DataObjects
+
+        If both join attributes have C{kind="sorted"} indexes, the tables are joined by
+        merging the indexes' sorted keys, and the result is in join key order; otherwise
+        the index of the table with fewer distinct keys drives lookups in the other's.
+        The columns to copy are resolved once, and each joined record is built directly
+        from the tuple of its values.
         """
-        thiscol,othercol = kwargs.items()[0]
+        thiscol,othercol = self._join_key_attrs(other, kwargs)
+        if how not in _JOIN_TYPES:
+            raise ValueError("unknown join type: %s" % how)
+        if how in ("semi", "anti"):
+            return self._view(self._semi_join(other, auto_create_indices, thiscol, othercol,
+                                              how == "anti"))
 
         retname = ("(%s:%s^%s:%s)" % 
-                (self.table_name, thiscol, other.table_name, othercol))
-        # make sure both tables contain records to join - if not, just return empty list
-        if not (self.obs and other.obs):
+                (self.table_name, _attr_label(thiscol), other.table_name, _attr_label(othercol)))
+        # make sure there are records to join - if not, just return empty list
+        if _join_is_empty(how, self.obs, other.obs):
             return Table(retname)
-        
+
+        ret = Table(retname)
+        parallel = workers > 1 and how in ("inner", "left")
+        if parallel:
+            thiscols, othercols = self._join_columns(other, attrlist)
+        else:
+            thiscols, othercols, matchingrows = self._join_plan(other, attrlist,
+                                                                auto_create_indices,
+                                                                thiscol, othercol, how,
+                                                                (bloom, bloom_maxbytes))
+        rectype = self._derived_record_type(ret, [a for _,_,a in thiscols + othercols], other)
+        for tbl,collist in zip([self,other],[thiscols,othercols]):
+            for _,c,a in collist:
+                if c in tbl._indexes:
+                    ret.create_index(a) # no unique indexes in join results
+        if parallel:
+            ret.insert_many(self._parallel_join_records(other, rectype, thiscols, othercols,
+                                                        thiscol, othercol, how, fill, workers))
+        else:
+            ret.insert_many(self._join_records(rectype, thiscols, othercols, matchingrows, fill))
+        return ret
+
+    def iter_join(self, other, attrlist=None, auto_create_indices=True, astuples=False,
+                  how="inner", fill=None, bloom=False, bloom_maxbytes=None, workers=None,
+                  **kwargs):
+        """Generator version of L{join}, taking the same arguments: yields the joined
+           records (or, for semi and anti joins, this table's records) one at a time
+           instead of building a result table.
+           @param astuples: yield each joined record as a plain tuple of its values, in
+               the order of the columns in attrlist (or of each table's attributes)
+           @type astuples: boolean
+        """
+        thiscol,othercol = self._join_key_attrs(other, kwargs)
+        if how not in _JOIN_TYPES:
+            raise ValueError("unknown join type: %s" % how)
+        if how in ("semi", "anti"):
+            return iter(self._semi_join(other, auto_create_indices, thiscol, othercol,
+                                        how == "anti"))
+        if _join_is_empty(how, self.obs, other.obs):
+            return iter([])
+        if workers > 1 and how in ("inner", "left"):
+            thiscols, othercols = self._join_columns(other, attrlist)
+            if astuples:
+                rectype = tuple
+            else:
+                rectype = self._derived_record_type(None, [a for _,_,a in thiscols + othercols],
+                                                    other)
+            return self._parallel_join_records(other, rectype, thiscols, othercols,
+                                               thiscol, othercol, how, fill, workers)
+        thiscols, othercols, matchingrows = self._join_plan(other, attrlist, auto_create_indices,
+                                                            thiscol, othercol, how,
+                                                            (bloom, bloom_maxbytes))
+        if astuples:
+            rectype = tuple
+        else:
+            rectype = self._derived_record_type(None, [a for _,_,a in thiscols + othercols], other)
+        return self._join_records(rectype, thiscols, othercols, matchingrows, fill)
+
+    def _semi_join(self, other, auto_create_indices, thiscol, othercol, anti):
+        """this table's records that have (or, if anti, do not have) a matching record in
+           the other table, in table order, probing the other table's index with each
+           record's key."""
+        otherindex = other._join_index(othercol, auto_create_indices)
+        keyof = _key_getter(thiscol)
+        def matched(ob):
+            try:
+                key = keyof(ob)
+            except AttributeError:
+                return False
+            return bool(_index_probe(otherindex, othercol, key))
+        if anti:
+            return [ob for ob in self.obs if not matched(ob)]
+        return filter(matched, self.obs)
+
+    def _bloom_reduced(self, other, thiscol, othercol, how, bloom, maxbytes):
+        """this table and the other table, with the larger of them (whose unmatched records
+           are not kept by the join, and that is not indexed on its join attribute)
+           replaced by a view of the records whose keys pass a Bloom filter of the other
+           table's keys."""
+        error_rate = 0.01 if bloom is True else bloom
+        if not 0 < error_rate < 1:
+            raise ValueError("Bloom filter error rate must be between 0 and 1")
+        sides = [(self, thiscol, other, othercol), (other, othercol, self, thiscol)]
+        if how == "left":
+            sides = sides[1:]
+        elif how == "right":
+            sides = sides[:1]
+        elif how != "inner":
+            return self, other
+        big, bigcol, small, smallcol = max(sides, key=lambda side: len(side[0].obs))
+        if len(big.obs) <= len(small.obs) or bigcol in big._own_indexes():
+            return self, other
+        keys = _BloomFilter((k for k in _join_keys(small.obs, smallcol) if k is not _MISSING),
+                            error_rate, maxbytes)
+        passes = keys.__contains__
+        rows = [ob for ob, key in izip(big.obs, _join_keys(big.obs, bigcol)) if passes(key)]
+        reduced = big._view(rows, shared=False)
+        return (reduced, other) if big is self else (self, reduced)
+
+    def _join_index(self, attr, auto_create_indices):
+        """the index on a join attribute, created if necessary and allowed."""
+        ind = self._indexes.get(attr)
+        if ind is not None and (ind.is_tokens or ind.is_prefix):
+            raise ValueError("cannot join on token- or prefix-indexed attribute: "+_attr_label(attr))
+        if ind is None:
+            if not auto_create_indices:
+                raise ValueError("indexed attribute required for join: "+_attr_label(attr))
+            self._create_index_for(attr, "join")
+            ind = self._indexes[attr]
+        ind.uses += 1
+        return ind
+
+    def _join_columns(self, other, attrlist):
+        """columns to copy from each table in a join, as C{(table, name, alias)} tuples."""
         attrlist = parse_colnames(attrlist)
             
         # expand attrlist to full (table, name, alias) tuples
-        thisnames = set(_object_attrnames(self.obs[0]))
-        othernames = set(_object_attrnames(other.obs[0]))
+        thisnames = self._join_attrnames()
+        othernames = other._join_attrnames()
         fullcols = []
-        if attrlist is not None:
+        if attrlist:
             for col in attrlist:
                 if isinstance(col, tuple):
                     # assume col contains at least (table, colname), fill in alias if missing 
@@ -970,25 +3708,46 @@ class Table(object):
 
         thiscols = list(ifilter(lambda o:o[0] is self, fullcols))
         othercols = list(ifilter(lambda o:o[0] is other, fullcols))
-
-        thiscolindex = othercolindex = None
-        if thiscol in self._indexes:
-            thiscolindex = self._indexes[thiscol]
-        elif auto_create_indices:
-            self.create_index(thiscol)
-            thiscolindex = self._indexes[thiscol]
-        else:
-            raise ValueError("indexed attribute required for join: "+thiscol)
-        if othercol in other._indexes:
-            othercolindex = other._indexes[othercol]
-        elif auto_create_indices:
-            other.create_index(othercol)
-            othercolindex = other._indexes[othercol]
-        else:
-            raise ValueError("indexed attribute required for join: "+othercol)
-
-        # use table with fewer keys to drive join
-        if len(thiscolindex) < len(othercolindex):
+        return thiscols, othercols
+
+    def _join_attrnames(self):
+        """names of the attributes of this table's records, for the columns of a join:
+           those of the first record, or for an empty table, its known fields, record
+           class fields or indexed attributes."""
+        if self.obs:
+            return list(_object_attrnames(self.obs[0]))
+        if self._knownfields:
+            return list(self._knownfields)
+        if self._record_class is not None:
+            return list(self._record_class.__slots__)
+        names = set()
+        for attr in self._index_defs():
+            names.update(attr if isinstance(attr, tuple) else (attr,))
+        return sorted(names)
+
+    def _join_plan(self, other, attrlist, auto_create_indices, thiscol, othercol, how="inner",
+                   bloom=(False, None)):
+        """columns to copy from each table, as C{(table, name, alias)} tuples, and a
+           generator of the pairs of lists of matching records from each table (with None
+           in place of the missing table's list, for the unmatched records of outer joins)."""
+        thiscols, othercols = self._join_columns(other, attrlist)
+
+        thistbl, othertbl = self, other
+        if bloom[0]:
+            thistbl, othertbl = self._bloom_reduced(other, thiscol, othercol, how, *bloom)
+        # a reduced table is a view, whose index on the remaining records is always built
+        thiscolindex = thistbl._join_index(thiscol, auto_create_indices or thistbl is not self)
+        othercolindex = othertbl._join_index(othercol, auto_create_indices or othertbl is not other)
+
+        if how != "inner":
+            return thiscols, othercols, _outer_matches(thiscolindex, othercolindex, how)
+
+        if thiscolindex.is_ordered and othercolindex.is_ordered:
+            return thiscols, othercols, _merge_matches(thiscolindex, othercolindex)
+
+        # drive the join from the table with fewer distinct keys, probing the other
+        # table's index once per key
+        if _join_probes(thiscolindex) < _join_probes(othercolindex):
             shortindex, longindex = (thiscolindex, othercolindex)
             swap = False
         else:
@@ -996,40 +3755,80 @@ class Table(object):
             swap = True
             
         # find matching rows
-        matchingrows = []
-        for key,rows in shortindex.items():
-            if key in longindex:
-                if swap:
-                    matchingrows.append( (longindex[key], rows) )
-                else:
-                    matchingrows.append( (rows, longindex[key]) )
-
-        joinrows = []
+        def matchingrows():
+            longattr = longindex.attr
+            for key,rows in _join_groups(shortindex):
+                matches = _index_probe(longindex, longattr, key)
+                if matches:
+                    if swap:
+                        yield matches, rows
+                    else:
+                        yield rows, matches
+
+        return thiscols, othercols, matchingrows()
+
+    @staticmethod
+    def _join_records(rectype, thiscols, othercols, matchingrows, fill=None):
+        """generator of joined records (or value tuples, if rectype is C{tuple}), from
+           the pairs of lists of matching records; each table's values are fetched once
+           per record, with a getter for all of its columns.  A missing list of records
+           (for the unmatched records of an outer join) supplies fill values instead."""
+        # the shared columns are taken from the other table when this table's record
+        # is missing
+        names, aliases, shared = _join_projection(thiscols, othercols)
+        thisvals, othervals = _values_getter(names[0]), _values_getter(names[1])
+        build = None if rectype is tuple else _record_builder(rectype, aliases)
+        thisfill, otherfill = _join_fills(fill, aliases, len(names[0]))
         for thisrows,otherrows in matchingrows:
-            for trow,orow in product(thisrows,otherrows):
-                retobj = DataObject()
-                for _,c,a in thiscols:
-                    setattr(retobj, a, getattr(trow,c))
-                for _,c,a in othercols:
-                    setattr(retobj, a, getattr(orow,c))
-                joinrows.append(retobj)
-
-        ret = Table(retname)
-        for tbl,collist in zip([self,other],[thiscols,othercols]):
-            for _,c,a in collist:
-                if c in tbl._indexes:
-                    ret.create_index(a) # no unique indexes in join results
-        ret.insert_many(joinrows)
-        return ret
+            if thisrows is None:
+                for orow in otherrows:
+                    tvals = thisfill
+                    if shared:
+                        tvals = list(thisfill)
+                        for i, c in shared:
+                            tvals[i] = getattr(orow, c, None)
+                        tvals = tuple(tvals)
+                    vals = tvals + othervals(orow)
+                    yield vals if build is None else build(vals)
+                continue
+            othervalues = [otherfill] if otherrows is None else map(othervals, otherrows)
+            for trow in thisrows:
+                tvals = thisvals(trow)
+                if build is None:
+                    for ovals in othervalues:
+                        yield tvals + ovals
+                else:
+                    for ovals in othervalues:
+                        yield build(tvals + ovals)
+
+    def _parallel_join_records(self, other, rectype, thiscols, othercols, thiscol, othercol,
+                               how, fill, workers):
+        """generator of the records (or value tuples) of an inner or left join, hash
+           partitioned on the join key and joined in a pool of worker processes; only the
+           keys and the values of the joined columns are sent to the workers."""
+        names, aliases, shared = _join_projection(thiscols, othercols)
+        otherfill = _join_fills(fill, aliases, len(names[0]))[1] if how == "left" else None
+        thisparts, unkeyed = _join_partitions(self.obs, thiscol, _values_getter(names[0]), workers)
+        otherparts = _join_partitions(other.obs, othercol, _values_getter(names[1]), workers)[0]
+        results = _pool_map(_join_partition, zip(thisparts, otherparts, repeat(otherfill)), workers)
+        if otherfill is not None and unkeyed:
+            results.append([tvals + otherfill for tvals in unkeyed])
+        if rectype is tuple:
+            return (vals for part in results for vals in part)
+        build = _record_builder(rectype, aliases)
+        return (build(vals) for part in results for vals in part)
 
     def join_on(self, attr):
         """Creates a JoinTerm in preparation for joining with another table, to 
            indicate what attribute should be used in the join.  Only indexed attributes
            may be used in a join.
            @param attr: attribute name to join from this table (may be different
-               from the attribute name in the table being joined to)
-           @type attr: string
+               from the attribute name in the table being joined to); a tuple of
+               names joins on a composite index
+           @type attr: string or tuple of strings
            @returns: L{JoinTerm}"""
+        if isinstance(attr, list):
+            attr = tuple(attr)
         if attr not in self._indexes:
             raise ValueError("can only join on indexed attributes")
         return JoinTerm(self, attr)
@@ -1041,7 +3840,13 @@ class Table(object):
         """
         if isinstance(attrlist, basestring):
             attrlist = attrlist.split()
+        if self._auto_index_threshold is not None:
+            for a in attrlist:
+                if a not in self._indexes:
+                    self._create_index_for(a, "auto")
         if all(a in self._indexes for a in attrlist):
+            for a in attrlist:
+                self._indexes[a].uses += 1
             return PivotTable(self,[],attrlist)
         else:
             raise ValueError("pivot can only be called using indexed attributes: ")
@@ -1054,10 +3859,14 @@ class Table(object):
         try:
             listofdicts = reader(source)
             attrs = parse_colnames(attrs)
+            rectype = DataObject
+            if self._record_class is not None:
+                rectype = self._record_class
+                attrs = attrs or list(rectype.__slots__)
             if len(attrs) == 0:
-                self.insert_many(DataObject(**mydict) for mydict in listofdicts)
+                self.insert_many(rectype(**mydict) for mydict in listofdicts)
             else:
-                self.insert_many(DataObject(** (
+                self.insert_many(rectype(** (
                         dict(tup for tup in mydict.items() if tup[0] in attrs)))
                                  for mydict in listofdicts)
             if transforms:
@@ -1086,7 +3895,7 @@ class Table(object):
                be set to the given default value
            @type transforms: dict (optional)
         """
-        return self._import(csv_source, transforms, attrs)
+        return self._import(csv_source, transforms, attrs=attrs)
 
     def _xsv_import(self, xsv_source, transforms=None, splitstr="\t", attrs=""):
         xsv_reader = lambda src: csv.DictReader(src, delimiter=splitstr, quoting=csv.QUOTE_NONE)
@@ -1132,6 +3941,9 @@ class Table(object):
             if hasattr(self.obs[0], "__dict__"):
                 for o in self.obs:
                     csvout.writerow(o.__dict__)
+            elif isinstance(self.obs[0], _SlottedRecord):
+                for o in self.obs:
+                    csvout.writerow(o._asdict())
             else:
                 for o in self.obs:
                     row = dict(starmap(lambda obj, fld: (fld, getattr(obj, fld)),
@@ -1172,6 +3984,22 @@ class Table(object):
         """Computes multiple attributes assuming a tuple-result from the given function."""
         fields = parse_colnames(attrnames)
         defaults = [None for unused in fields] if defaults is None else defaults
+        self._touch()
+        if self._record_class is not None:
+            newfields = [fld for fld in fields if fld not in self._record_class.__slots__]
+            if newfields:
+                self._extend_schema(*newfields)
+        if self.columnar:
+            rowvals = []
+            for rec in self:
+                try:
+                    rowvals.append(fn(rec))
+                except Exception:
+                    rowvals.append(defaults)
+            for i, field in enumerate(fields):
+                self.obs.set_column(field, [vals[i] for vals in rowvals])
+            self._reindex()
+            return self
         for rec in self:
             try:
                 vals = fn(rec)
@@ -1195,83 +4023,146 @@ class Table(object):
 
                lambda ob : ob.commission * ob.gross_sales
 
-           @type val_or_fn: value or function(obj) returns value
+           @type val_or_fn: value, or function(obj) returning value, or L{Expr}
            @param default: value to use if an exception is raised while trying
            to evaluate fn
            """
-        
-        for rec in self:
-            if callable(val_or_fn):
-              try:
-                  val = val_or_fn(rec)
-                  if val is None:
-                      val = default
-              except Exception, exc:
-                  if swallow_exceptions:
-                      val = default
-                  else:
-                      raise exc
+        if self._record_class is not None and attrname not in self._record_class.__slots__:
+            self._extend_schema(attrname)
+        self._touch()
+        if self.columnar and isinstance(val_or_fn, Expr) and not swallow_exceptions:
+            try:
+                colvals = val_or_fn._evaluate(self.obs)
+            except (ArithmeticError, TypeError, ValueError):
+                # & and | evaluate both operands for every row, which can fail where
+                # computing one record at a time would not - compute record by record
+                pass
             else:
-              val = val_or_fn
-            if isinstance(rec, DataObject):
+                self.obs.set_column(attrname, [default if val is None else val for val in colvals])
+                self._reindex()
+                return self
+        # columnar tables build rows as snapshots, so collect the values and
+        # replace the column in one step
+        colvals = [] if self.columnar else None
+        valuefn = _field_value_fn(val_or_fn, default, swallow_exceptions)
+        for rec in self:
+            val = valuefn(rec)
+            if colvals is not None:
+                colvals.append(val)
+            elif isinstance(rec, DataObject):
                 object.__setattr__(rec, attrname, val)
             else:
                 setattr(rec, attrname, val)
+        if colvals is not None:
+            self.obs.set_column(attrname, colvals)
+            # indexes hold row snapshots, which must be rebuilt with the new column
+            self._reindex()
         return self
 
+    @_cached_result
     def groupby(self, keyexpr, rollupfields="", include_all="", first_fields="",
-                multi_group_sep="_xx_", **outexprs):
+                multi_group_sep="_xx_", composite_index=False, **outexprs):
         """simple prototype of group by, with support for expressions in the group-by clause 
            and outputs.  first_fields = fields where we should include the first record.
            @param keyexpr: grouping field and optional expression for computing the key value;
                 if a string is passed, group on that column
                 if a tuple is passed, [0] is the group name, [2] is a lambda
-                if a list is passed, group on multiple columns - see multi_group_sep below
-           @type keyexpr: string or tuple
+                if a list is passed, group on multiple columns: each group is keyed on
+                the tuple of its records' values, which are written to the result's
+                columns of the same names (with include_all in each of them for the
+                include_all record)
+           @type keyexpr: string, tuple or list of strings
            @param rollupfields: string with this format:
                 FUNCTION1:field1,field2,field3;FUNCTION2:field4,field5
                 e.g.
                 groupby(rollupfields="SUM:field1,field2;AVG:field3") is equivalent to
                 groupby(field1=SUM('field1'),field2=SUM('field2'),field3=AVG('field3'))
-           @param multi_group_sep: a way to avoid conflicts in the algorithm which joins
-                and splits the column names and values for the case where 
+           @param multi_group_sep: no longer used - multiple-column groups are keyed
+                on tuples of values, rather than on strings joined with this separator
+           @param composite_index: for a list keyexpr, create a unique composite index
+                on the tuple of the result's key columns (see L{create_index})
+           @type composite_index: boolean
+           @param outexprs: output columns - an aggregator (see reporting_funcs.Aggregator,
+                which all the built-in aggregates are) is stepped through each group's
+                records as they are read, in a single pass for all outputs, keeping only
+                its state for each group; any other callable is called with the list of
+                the group's records, which are then kept in memory; other values are
+                copied to every group's record
            """
+        keynames = None
         if isinstance(keyexpr, basestring):
             groupname = keyexpr
             keyfn = lambda o : getattr(o, keyexpr, 'all')
         elif isinstance(keyexpr, list):
-            groupname = multi_group_sep.join(keyexpr)
-            keyfn = lambda r: multi_group_sep.join([getattr(r, field) for field in keyexpr])
+            keynames = tuple(keyexpr)
+            keyfn = _key_getter(keynames)
+            if len(keynames) == 1:
+                keyfn = lambda r, getkey=keyfn: (getkey(r),)
         elif isinstance(keyexpr, tuple):
             groupname, keyfn = keyexpr
 
-        groupedobs = defaultdict(list)
-        for ob in self.obs:
-            groupedobs[keyfn(ob)].append(ob)
-
         if rollupfields != "":
             for func, fieldlist in [funcspec.split(":") for funcspec in rollupfields.split(";")]:
                 for field in fieldlist.split(","):
                     outexprs[field] = (globals()[func])(field)
+        aggs = [agg for agg in outexprs.values() if _is_aggregator(agg)]
+        aggpos = dict((id(agg), i) for i, agg in enumerate(aggs))
+        inits = [agg.init for agg in aggs]
+        steps = list(enumerate(agg.step for agg in aggs))
+        keeprecs = any(callable(expr) and id(expr) not in aggpos for expr in outexprs.values())
+
+        # each group's first record, its aggregators' states and, only if some output is
+        # a function of the list of the group's records, the records themselves
+        groups = {}
+        for ob in self.obs:
+            key = keyfn(ob)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (ob, [init() for init in inits], [] if keeprecs else None)
+            states = group[1]
+            for i, step in steps:
+                states[i] = step(states[i], ob)
+            if keeprecs:
+                group[2].append(ob)
+
         tbl = Table()
-        tbl.create_index(groupname, unique=True)
-        for key, recs in groupedobs.iteritems():
-            groupobj = DataObject(**{groupname:key})
+        if keynames is None:
+            keycols = lambda key: {groupname:key}
+            rectype = self._derived_record_type(
+                tbl, [groupname] + outexprs.keys() + first_fields.split())
+            tbl.create_index(groupname, unique=True)
+        else:
+            keycols = lambda key: dict(izip(keynames, key))
+            rectype = self._derived_record_type(
+                tbl, list(keynames) + outexprs.keys() + first_fields.split())
+            if composite_index:
+                tbl.create_index(keynames, unique=True)
+        for key, (first, states, recs) in groups.iteritems():
+            groupobj = rectype(**keycols(key))
             for subkey, expr in outexprs.items():
-                setattr(groupobj, subkey, expr(recs) if callable(expr) else expr)
+                i = aggpos.get(id(expr))
+                if i is not None:
+                    setattr(groupobj, subkey, expr.finalize(states[i]))
+                else:
+                    setattr(groupobj, subkey, expr(recs) if callable(expr) else expr)
             if first_fields != "":
                 for fld in first_fields.split():
-                    setattr(groupobj, fld, getattr(recs[0], fld, ""))
+                    setattr(groupobj, fld, getattr(first, fld, ""))
             tbl.insert(groupobj)
         if include_all != "":
-            groupobj = DataObject(**{groupname:include_all})
+            allkey = include_all if keynames is None else (include_all,) * len(keynames)
+            groupobj = rectype(**keycols(allkey))
             for subkey, expr in outexprs.items():
-                setattr(groupobj, subkey, expr(self.obs) if callable(expr) else expr)
+                i = aggpos.get(id(expr))
+                merge = getattr(expr, "merge", None) if i is not None else None
+                if merge is not None:
+                    # combine the groups' states, rather than stepping through the records again
+                    state = reduce(merge, [group[1][i] for group in groups.itervalues()],
+                                   expr.init())
+                    setattr(groupobj, subkey, expr.finalize(state))
+                else:
+                    setattr(groupobj, subkey, expr(self.obs) if callable(expr) else expr)
             tbl.insert(groupobj)
-        if isinstance(keyexpr, list):
-            for i, field in enumerate(keyexpr):
-                tbl.addfield(field, lambda r: getattr(r, groupname).split(multi_group_sep)[i])
-            tbl.dropfields(groupname)
         return tbl
     
     def insert_dictlist(self, mylist, append=False):
@@ -1300,6 +4191,299 @@ class Table(object):
         return self
 
 
+class TableView(Table):
+    """Lightweight result of a query or slice of a L{Table}: a list of references to the
+       parent table's records, sharing the parent's index definitions.  A view only builds
+       its own indexes when they are needed - for indexed access, joins and pivots, when
+       the view is modified, or when L{detach} is called.  Until then, L{where} criteria on
+       indexed attributes are answered from the parent table's indexes (as long as neither
+       table has been modified), so chained queries do not copy indexes at every step.
+    """
+    _index_sources = {}
+    _built_indexes = None
+    _root = None
+
+    def __init__(self, parent, obs, shared=True):
+        """TableView initializer - do not create these directly, use L{Table.where}."""
+        super(TableView,self).__init__(parent.table_name)
+        self.obs = obs
+        self._record_class = parent._record_class
+        self._index_sources = parent._index_defs()
+        self._built_indexes = None
+        self._root = parent._lookup_root() if shared else None
+        self._root_version = self._root._version if self._root is not None else None
+        # table that owns the records
+        self._owner = parent._owner if isinstance(parent, TableView) else parent
+
+    @property
+    def _indexes(self):
+        if self._removed:
+            self._compact()
+        if self._built_indexes is None:
+            self._built_indexes = {}
+            for attr, src in self._index_sources.items():
+                ind = self._built_indexes[attr] = src.copy_template().bind(self.obs)
+                if not ind.is_bitmap:
+                    ind.extend(_index_keys(ind, self.obs), self.obs)
+        return self._built_indexes
+
+    @_indexes.setter
+    def _indexes(self, indexes):
+        self._built_indexes = indexes
+
+    def _root_valid(self):
+        return (self._root is not None and self._built_indexes is None and
+                self._version == 0 and self._root._version == self._root_version)
+
+    def _index_defs(self):
+        if self._built_indexes is not None:
+            return self._built_indexes
+        return self._index_sources
+
+    def _own_indexes(self):
+        return self._built_indexes or {}
+
+    def _lookup_indexes(self):
+        if self._built_indexes is not None:
+            return self._built_indexes
+        if self._root_valid():
+            return self._root._indexes
+        return {}
+
+    def _indexed_rows(self, rows):
+        if not self._root_valid():
+            return rows
+        ids = set(id(ob) for ob in self.obs)
+        return [ob for ob in rows if id(ob) in ids]
+
+    def _lookup_root(self):
+        if self._root_valid():
+            return self._root
+        return self if self._built_indexes is not None else None
+
+    def _touch(self):
+        # the records belong to the owning table too
+        super(TableView,self)._touch()
+        self._owner._touch()
+
+    def detach(self):
+        """Build this view's own indexes and stop using its parent table's indexes."""
+        self._indexes
+        self._root = None
+        return self
+
+class Query(object):
+    """Lazily-evaluated query on a L{Table}, created with L{Table.query}.  Calling
+       L{where}, L{select}, L{addfield}, L{sort}, L{limit} or L{groupby} on a Query only
+       records a step in its plan (returning a new Query), as in::
+
+           top = orders.query(state="AZ").addfield("total", lambda o: o.qty * o.price) \\
+                       .where(lambda o: o.total > 100).sort("total desc").limit(50).run()
+
+       The plan is executed when the Query is iterated or L{run}.  Keyword criteria are
+       pushed down past any steps that do not compute the attributes they test; those that
+       reach the start of the plan are given to the source table's L{Table.where}, so they
+       can use its indexes, and the remaining filters are applied cheapest-first (keyword
+       criteria before functions).  Records are then streamed through the remaining steps
+       in a single pass, so no intermediate Tables are built; only L{sort} and L{groupby}
+       need to collect the records seen so far.
+    """
+    def __init__(self, table, steps=()):
+        self.table = table
+        self.steps = list(steps)
+
+    def _add(self, *step):
+        return Query(self.table, self.steps + [step])
+
+    def where(self, *args, **kwargs):
+        """Add filtering steps, as in L{Table.where}; C{_orderby} and C{_limit} are applied
+           after the criteria and the filter function."""
+        flags = dict((k, kwargs.pop(k)) for k in list(kwargs) if k.startswith("_"))
+        if args and isinstance(args[0], Expr):
+            # comparisons in an expression become criteria that can be pushed down
+            criteria, residual = _expr_criteria(args[0], kwargs)
+            kwargs.update(criteria)
+            args = (residual,) if residual is not None else ()
+        ret = self
+        for k,v in kwargs.items():
+            ret = ret._add("criteria", k, v)
+        if args:
+            ret = ret._add("filter", args[0])
+        if "_orderby" in flags:
+            ret = ret.sort(flags["_orderby"])
+        if "_limit" in flags:
+            ret = ret.limit(flags["_limit"])
+        return ret
+
+    def select(self, *fields, **exprs):
+        """Add a projection step, as in L{Table.select}."""
+        return self._add("select", fields, exprs)
+
+    def addfield(self, attrname, val_or_fn, default=None, swallow_exceptions=False):
+        """Add a step computing a new attribute, as in L{Table.addfield}."""
+        return self._add("addfield", attrname, val_or_fn, default, swallow_exceptions)
+
+    def sort(self, key, reverse=False):
+        """Add a sorting step, as in L{Table.sort}."""
+        return self._add("sort", key, reverse)
+
+    def limit(self, numrecs):
+        """Add a step keeping only the first C{numrecs} records."""
+        return self._add("limit", numrecs)
+
+    def groupby(self, keyexpr, *args, **kwargs):
+        """Add a grouping step, as in L{Table.groupby}; following steps apply to the
+           grouped records."""
+        return self._add("groupby", keyexpr, args, kwargs)
+
+    @staticmethod
+    def _commutes(step, attr):
+        """whether a criterion on attr can be moved ahead of the given step."""
+        kind = step[0]
+        if kind in ("criteria", "filter", "sort"):
+            return True
+        if kind == "addfield":
+            return step[1] != attr
+        if kind == "select":
+            fields, exprs = step[1], step[2]
+            return (attr in _select_columns(fields, {})[0] and attr not in exprs)
+        return False
+
+    def _plan(self):
+        """returns the criteria to pass to the source table's where(), and the
+           remaining steps, in execution order."""
+        steps = []
+        for step in self.steps:
+            steps.append(step)
+            if step[0] != "criteria":
+                continue
+            # push criteria towards the start of the plan
+            i = len(steps) - 1
+            attr = _parse_criterion(step[1])[0]
+            while i > 0 and self._commutes(steps[i-1], attr):
+                steps[i-1], steps[i] = steps[i], steps[i-1]
+                i -= 1
+
+        # leading filters run against the source table; criteria with distinct keys
+        # go to where(), the rest stay as filters
+        headlen = 0
+        while headlen < len(steps) and steps[headlen][0] in ("criteria", "filter"):
+            headlen += 1
+        head, steps = steps[:headlen], steps[headlen:]
+        criteria = {}
+        filters = []
+        for step in head:
+            if step[0] == "criteria" and step[1] not in criteria:
+                criteria[step[1]] = step[2]
+            else:
+                filters.append(step)
+
+        # a sort followed by a limit only needs the top records
+        steps = filters + steps
+        for i in range(len(steps)-2, -1, -1):
+            if steps[i][0] == "sort" and steps[i+1][0] == "limit":
+                steps[i:i+2] = [("topk",) + steps[i][1:] + steps[i+1][1:]]
+
+        # within each run of consecutive filters, test keyword criteria before functions
+        i = 0
+        while i < len(steps):
+            j = i
+            while j < len(steps) and steps[j][0] in ("criteria", "filter"):
+                j += 1
+            if j > i:
+                steps[i:j] = sorted(steps[i:j], key=lambda step: step[0] != "criteria")
+            i = j + 1
+        return criteria, steps
+
+    def explain(self):
+        """Return a list of strings describing the steps that will be executed."""
+        criteria, steps = self._plan()
+        if criteria:
+            ret = ["where(%s) on table '%s'" % (", ".join("%s=%r" % kv for kv in sorted(criteria.items())),
+                                                 self.table.table_name)]
+        else:
+            ret = ["scan table '%s'" % self.table.table_name]
+        for step in steps:
+            if step[0] == "criteria":
+                ret.append("filter %s=%r" % step[1:])
+            elif step[0] == "topk":
+                ret.append("topk %d" % step[3])
+            else:
+                ret.append(step[0])
+        return ret
+
+    def _execute(self):
+        """returns an iterator over the query results, the record class of the results,
+           whether the results are all records of the source table, and the Table
+           built by a final groupby (or None)."""
+        criteria, steps = self._plan()
+        table = self.table
+        rows = iter(table.where(**criteria).obs) if criteria else iter(table.obs)
+        rectype = table._record_class
+        subset = True
+        result_table = None
+        for step in steps:
+            kind = step[0]
+            result_table = None
+            if kind == "criteria":
+                rows = ifilter(_criteria_test({step[1]: step[2]}), rows)
+            elif kind == "filter":
+                rows = ifilter(_compiled(step[1]), rows)
+            elif kind == "select":
+                fields, exprs = _select_columns(step[1], dict(step[2]))
+                rectype = _record_type(fields + exprs.keys(), rectype is not None)
+                rows = imap(_projector(fields, exprs, rectype), rows)
+                rectype = rectype if rectype is not DataObject else None
+                subset = False
+            elif kind == "addfield":
+                attrname = step[1]
+                if rectype is not None and attrname not in rectype.__slots__:
+                    # slotted records need a wider record class to hold the new field
+                    rectype = record_class(rectype.__slots__ + (attrname,))
+                    rows = imap(lambda rec, rectype=rectype: rectype(**_object_asdict(rec)), rows)
+                    subset = False
+                rows = imap(self._field_setter(attrname, _field_value_fn(*step[2:])), rows)
+            elif kind == "sort":
+                rows = iter(_sort_records(list(rows), step[1], step[2]))
+            elif kind == "limit":
+                rows = islice(rows, step[1])
+            elif kind == "topk":
+                rows = iter(_top_records(rows, step[1], step[3], step[2]))
+            elif kind == "groupby":
+                grouped = Table(table.table_name, data=list(rows))
+                grouped._record_class = rectype
+                result_table = grouped.groupby(step[1], *step[2], **step[3])
+                rows = iter(result_table.obs)
+                rectype = result_table._record_class
+                subset = False
+        return rows, rectype, subset, result_table
+
+    @staticmethod
+    def _field_setter(attrname, valuefn):
+        def setfield(rec):
+            if isinstance(rec, DataObject):
+                object.__setattr__(rec, attrname, valuefn(rec))
+            else:
+                setattr(rec, attrname, valuefn(rec))
+            return rec
+        return setfield
+
+    def __iter__(self):
+        """Execute the query, streaming the resulting records."""
+        return self._execute()[0]
+
+    def run(self):
+        """Execute the query, returning the results as a Table (a L{TableView} on the
+           source table if the results are records of the source table)."""
+        rows, rectype, subset, result_table = self._execute()
+        if result_table is not None:
+            return result_table
+        if subset:
+            return self.table._view(list(rows))
+        ret = Table(self.table.table_name, data=list(rows))
+        ret._record_class = rectype
+        return ret
+
 class PivotTable(Table):
     """Enhanced Table containing pivot results from calling table.pivot().
     """
@@ -1313,12 +4497,13 @@ class PivotTable(Table):
         self._subtable_dict = {}
         
         for k,v in parent._indexes.items():
-            self._indexes[k] = v.copy_template()
+            self._indexes[k] = v.copy_template().bind(self.obs)
         if not attr_val_path:
             self.insert_many(parent.obs)
         else:
+            # take the records straight from the parent's index, rather than querying
             attr,val = attr_val_path[-1]
-            self.insert_many(parent.where(**{attr:val}))
+            self.insert_many(parent._indexes[attr][val])
             parent._subtable_dict[val] = self
 
         if len(attrlist) > 0:
@@ -1486,7 +4671,22 @@ class JoinTerm(object):
 
        When calling the join expression, you can optionally specify a
        list of attributes as defined in L{Table.join}.
+
+       A join expression of more than two tables, as in::
+
+           wishlists = customers.join_on("id") + wishitems.join_on("custid") + catalog.join_on("sku")
+
+       joins each added table on its attribute with the first table before it that has an
+       attribute of that name.  The tables are not joined in the order written: the
+       join estimated to be smallest (from the tables' sizes and index statistics) is
+       done first, and then each table whose join with the result so far is estimated to
+       be smallest, by looking up the matching records in its index.  No intermediate
+       tables are built - records are only created for the final result, with the
+       attributes in the attribute list (by default all attributes of all of the tables,
+       the first table's value being kept for names in more than one table).
     """
+    _terms = ()
+
     def __init__(self, sourceTable, joinfield):
         self.sourcetable = sourceTable
         self.joinfield = joinfield
@@ -1504,7 +4704,10 @@ class JoinTerm(object):
                 return self
             else:
                 if other.jointo is None:
-                    return self() + other
+                    # add to the join graph, to be planned when the join is performed
+                    ret = copy.copy(self)
+                    ret._terms = self._terms + (other,)
+                    return ret
                 else:
                     return self() + other()
         raise ValueError("cannot add object of type '%s' to JoinTerm" % other.__class__.__name__)
@@ -1514,16 +4717,96 @@ class JoinTerm(object):
             return other.join_on(self.joinfield) + self
         raise ValueError("cannot add object of type '%s' to JoinTerm" % other.__class__.__name__)
             
-    def __call__(self, attrs=None):
+    def __call__(self, attrs=None, how="inner", fill=None):
+        """perform the join, as L{Table.join} with the given attributes, join type and
+           fill value."""
+        if self._terms:
+            if how != "inner":
+                raise ValueError("only inner joins can combine more than two tables")
+            return self._planned_join(attrs)
         if self.jointo:
             other = self.jointo
             if isinstance(other, Table):
                 other = other.join_on(self.joinfield)
-            ret = self.sourcetable.join(other.sourcetable, attrs, 
-                                        **{self.joinfield : other.joinfield})
+            if isinstance(self.joinfield, tuple):
+                joinattrs = dict(zip(self.joinfield, other.joinfield))
+            else:
+                joinattrs = {self.joinfield : other.joinfield}
+            ret = self.sourcetable.join(other.sourcetable, attrs, how=how, fill=fill, **joinattrs)
             return ret
         else:
-            return self.sourcetable.query()
+            return self.sourcetable.query().run()
+
+    def _join_graph(self):
+        """the tables of a join expression, in order, and the join conditions, as
+           C{(table, attribute, table, attribute)} tuples of table positions."""
+        other = self.jointo
+        if isinstance(other, Table):
+            other = other.join_on(self.joinfield)
+        tables = [self.sourcetable, other.sourcetable]
+        edges = [(0, self.joinfield, 1, other.joinfield)]
+        for term in self._terms:
+            attrs = term.joinfield if isinstance(term.joinfield, tuple) else (term.joinfield,)
+            for i, tbl in enumerate(tables):
+                names = set(_object_attrnames(tbl.obs[0])) if tbl.obs else set()
+                if all(a in names for a in attrs):
+                    break
+            else:
+                raise ValueError("no table to join on attribute: " + _attr_label(term.joinfield))
+            edges.append((i, term.joinfield, len(tables), term.joinfield))
+            tables.append(term.sourcetable)
+        return tables, edges
+
+    def _planned_join(self, attrs):
+        """join all of the tables of a join expression - see L{JoinTerm}."""
+        tables, edges = self._join_graph()
+        retname = "(%s:%s^%s:%s)" % (tables[0].table_name, _attr_label(edges[0][1]),
+                                     tables[1].table_name, _attr_label(edges[0][3]))
+        for i, a, j, b in edges[1:]:
+            retname = "(%s:%s^%s:%s)" % (retname, _attr_label(a), tables[j].table_name, _attr_label(b))
+        ret = Table(retname)
+        if not all(tbl.obs for tbl in tables):
+            return ret
+
+        # resolve the attribute list to (table position, name, alias) tuples
+        cols = []
+        attrlist = parse_colnames(attrs)
+        tablenames = [_object_attrnames(tbl.obs[0]) for tbl in tables]
+        if attrlist:
+            for col in attrlist:
+                if isinstance(col, tuple):
+                    pos = [i for i, tbl in enumerate(tables) if tbl is col[0]]
+                    if not pos:
+                        raise ValueError("table not in join: " + col[0].table_name)
+                    cols.append((pos[0], col[1], (col + (col[1],))[2]))
+                else:
+                    pos = [i for i, names in enumerate(tablenames) if col in names]
+                    if not pos:
+                        raise ValueError("attribute not found: " + col)
+                    cols.append((pos[0], col, col))
+        else:
+            cols = [(i, n, n) for i, names in enumerate(tablenames) for n in names]
+        seen = set()
+        cols = [c for c in cols if c[2] not in seen and not seen.add(c[2])]
+        aliases = [a for _, _, a in cols]
+        # records missing a column get None for it, as in a two-table join
+        getters = [(i, lambda ob, n=n: getattr(ob, n, None)) for i, n, _ in cols]
+
+        slotted = any(tbl._record_class is not None for tbl in tables)
+        rectype = _record_type(aliases, slotted)
+        ret._record_class = rectype if rectype is not DataObject else None
+        for i, n, a in cols:
+            if n in tables[i]._index_defs():
+                ret.create_index(a) # no unique indexes in join results
+        build = _record_builder(rectype, aliases)
+
+        first, steps = _plan_join_order(tables, edges)
+        stream = ([ob if i == first else None for i in range(len(tables))]
+                  for ob in tables[first].obs)
+        for step in steps:
+            stream = _probe_join(stream, tables, *step)
+        ret.insert_many(build(tuple(get(combo[i]) for i, get in getters)) for combo in stream)
+        return ret
 
     def join_on(self, col):
         return self().join_on(col)
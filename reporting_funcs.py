@@ -1,5 +1,5 @@
 # pylint:disable=C0103
-import base, re, datetime, logging
+import base, re, datetime, logging, operator
 
 def weekstart(ts, fmt=base.TIME_FMT, dayofweek=0, outfmt=None):
   """mon=0, sun=7"""
@@ -36,49 +36,108 @@ def HASFIELD(field, allowblank=False):
     return lambda r: getattr(r, field, None) is not None
   return lambda r: getattr(r, field, None) not in [None, ""]
 
+SELLER_CATS_SEP = r'; *'
+
 def MATCH_SELLER_CATS(include_cats, exclude_cats):
-  """helper function to match seller categories"""
-  return lambda rec: \
-    sum([(1 if cat in include_cats else 0) for cat in re.split(r'; *', rec.categories)]) > 0 and \
-    sum([(1 if cat in exclude_cats else 0) for cat in re.split(r'; *', rec.categories)]) == 0
+  """helper function to match seller categories.  a table with a token index on
+  categories, create_index("categories", kind="tokens", tokenizer=SELLER_CATS_SEP),
+  answers it from the index instead of splitting every record's categories."""
+  split = re.compile(SELLER_CATS_SEP).split
+  if not isinstance(include_cats, basestring):
+    include_cats = frozenset(include_cats)
+  if not isinstance(exclude_cats, basestring):
+    exclude_cats = frozenset(exclude_cats)
+  def match(rec):
+    cats = split(rec.categories)
+    return any(cat in include_cats for cat in cats) and \
+      not any(cat in exclude_cats for cat in cats)
+  if isinstance(include_cats, frozenset) and isinstance(exclude_cats, frozenset):
+    match.token_match = ("categories", SELLER_CATS_SEP, include_cats, exclude_cats)
+  return match
 
 def REC_NON_BLANK(fld):
   return lambda rec: getattr(rec, fld, "") != ""
   
+class Aggregator(object):
+  """an aggregate computed in one pass over a group of records: init() returns the
+  starting state, step(state, rec) the state after adding a record, merge(state1, state2)
+  the state of two groups' records combined (None if the result depends on the order of
+  the records), and finalize(state) the aggregate's value.  groupby, addsummaryrow and
+  hist step all their aggregators through each record once, keeping only the states;
+  an Aggregator can still be called on a list of records, like a plain function."""
+  def __init__(self, init, step, merge=None, finalize=None):
+    self.init = init
+    self.step = step
+    self.merge = merge
+    if finalize is not None:
+      self.finalize = finalize
+
+  @staticmethod
+  def finalize(state):
+    return state
+
+  def __call__(self, recs):
+    state, step = self.init(), self.step
+    for rec in recs:
+      state = step(state, rec)
+    return self.finalize(state)
+
+def _add_pairs(a, b):
+  return (a[0] + b[0], a[1] + b[1])
+
+def _union(a, b):
+  return a | b
+
+def _set_adder(valfn):
+  def step(vals, rec):
+    vals.add(valfn(rec))
+    return vals
+  return step
+
+def _count_if(pred):
+  return Aggregator(int, lambda n, r: n + 1 if pred(r) else n, operator.add)
+
 def COUNT():
-  return len
+  return Aggregator(int, lambda n, r: n + 1, operator.add)
 def COUNT_DISTINCT(*fields):
-  return lambda recs: len(set(
-        "\t".join(getattr(r, field, "") for field in fields) for r in recs))
+  return Aggregator(set, _set_adder(lambda r: "\t".join(getattr(r, field, "") for field in fields)),
+                    _union, len)
 def COUNT_IF(func):
-  return lambda recs: len([r for r in recs if func(r)])
+  return _count_if(func)
 def COUNT_IFEQ(field, val, method="sum"):
   if method == "sum":
-    return lambda recs: len([1 for r in recs if getattr(r, field, "") == val])
+    return _count_if(lambda r: getattr(r, field, "") == val)
+  # (matching records, records)
+  step = lambda s, r: (s[0] + 1 if getattr(r, field, "") == val else s[0], s[1] + 1)
   if method == "pct":
-    return lambda recs: 0.0 if len(recs) == 0 else \
-        len([1 for r in recs if getattr(r, field, "") == val]) / float(len(recs)) * 100.0
+    return Aggregator(lambda: (0, 0), step, _add_pairs,
+                      lambda s: 0.0 if s[1] == 0 else s[0] / float(s[1]) * 100.0)
   if method == "frac":
-    return lambda recs: 0.0 if len(recs) == 0 else \
-        len([1 for r in recs if getattr(r, field, "") == val]) / float(len(recs))
+    return Aggregator(lambda: (0, 0), step, _add_pairs,
+                      lambda s: 0.0 if s[1] == 0 else s[0] / float(s[1]))
 
 def ANY(field):
-  return lambda recs: any([bool(getattr(r, field, False)) for r in recs])
+  return Aggregator(bool, lambda s, r: s or bool(getattr(r, field, False)), operator.or_)
 def ALL(field):
-  return lambda recs: all([bool(getattr(r, field, True)) for r in recs])
+  return Aggregator(lambda: True, lambda s, r: s and bool(getattr(r, field, True)),
+                    operator.and_)
+
+def _sum_if(valfn, pred=None):
+  if pred is None:
+    return Aggregator(int, lambda tot, r: tot + valfn(r), operator.add)
+  return Aggregator(int, lambda tot, r: tot + valfn(r) if pred(r) else tot, operator.add)
 
 def SUM(field):
-  return lambda recs: sum(float(getattr(r, field, 0.0)) for r in recs)
+  return _sum_if(lambda r: float(getattr(r, field, 0.0)))
 def SUM_DISTINCT(field):
-  return lambda recs: sum(list(set(float(getattr(r, field, 0.0)) for r in recs)))
+  return Aggregator(set, _set_adder(lambda r: float(getattr(r, field, 0.0))), _union,
+                    lambda vals: sum(list(vals)))
 def SUM_IFEQ(field, val, otherfield=None):
   if otherfield is None:
-    return lambda recs: sum([float(getattr(r, field, 0.0)) \
-                               for r in recs if getattr(r, field) == val])
-  return lambda recs: sum([float(getattr(r, otherfield, 0.0)) \
-                             for r in recs if getattr(r, field) == val])
+    return _sum_if(lambda r: float(getattr(r, field, 0.0)), lambda r: getattr(r, field) == val)
+  return _sum_if(lambda r: float(getattr(r, otherfield, 0.0)), lambda r: getattr(r, field) == val)
 def SUM_IF(field, func):
-  return lambda recs: sum([float(getattr(r, field, 0.0)) for r in recs if func(r)])
+  return _sum_if(lambda r: float(getattr(r, field, 0.0)), func)
 
 def SUMIF_GROUP_DAYS(field_name, comparison_fld, days_lookback_start, days_lookback_end,
                                          startdate=None, comparison_fld_func=TS):
@@ -106,80 +165,86 @@ def SUMIF_GROUP_DAYS(field_name, comparison_fld, days_lookback_start, days_lookb
 
 def SUM_PCT(field, totalfield):
   """  NNN (mm.m%)  """
-  def func(recs):
-    totfld = sum(float(getattr(r, field, 0.0)) for r in recs)
-    tot = sum(float(getattr(r, totalfield, 0.0)) for r in recs)
+  def step(s, r):
+    return (s[0] + float(getattr(r, field, 0.0)), s[1] + float(getattr(r, totalfield, 0.0)))
+  def finalize(s):
+    totfld, tot = s
     return "%g (%.1f%%)" % (tot, base.safepct(totfld, tot))
-  return func
+  return Aggregator(lambda: (0, 0), step, _add_pairs, finalize)
+
+def _avg_if(valfn, pred):
+  """(total, count) of the records matching pred."""
+  def step(s, r):
+    if pred(r):
+      return (s[0] + valfn(r), s[1] + 1.0)
+    return s
+  return Aggregator(lambda: (0.0, 0.0), step, _add_pairs,
+                    lambda s: (s[0] / s[1]) if s[1] > 0.0 else 0.0)
 
 def AVG(field):
-  return lambda recs: 0 if len(recs) == 0 else \
-      sum(float(getattr(r, field)) for r in recs)/len(recs)
+  return Aggregator(lambda: (0, 0), lambda s, r: (s[0] + float(getattr(r, field)), s[1] + 1),
+                    _add_pairs, lambda s: 0 if s[1] == 0 else s[0] / s[1])
 def AVG_IFEQ(field, val, otherfield=None):
-  def avg_ifeq_func(recs):
-    total = count = 0.0
-    for rec in recs:
-      fieldval = getattr(rec, field)
-      if fieldval == val:
-        count += 1.0
-        total += float(getattr(rec, otherfield)) if otherfield else fieldval
-    return ((total / count) if count > 0.0 else 0.0)
-  return avg_ifeq_func
+  if otherfield:
+    return _avg_if(lambda r: float(getattr(r, otherfield)), lambda r: getattr(r, field) == val)
+  return _avg_if(lambda r: getattr(r, field), lambda r: getattr(r, field) == val)
 def AVG_IF(field, func):
-  def avg_if_func(recs):
-    total = count = 0.0
-    for rec in recs:
-      if func(rec):
-        count += 1.0
-        total += float(getattr(rec, field))
-    return ((total / count) if count > 0.0 else 0.0)
-  return avg_if_func
+  return _avg_if(lambda r: float(getattr(r, field)), func)
+
+# first and last depend on the order of the records, so they can't merge the states of
+# two groups' records
+_NO_REC = object()
 
 def FIRST(field, include_blank=False):
   if include_blank:
-    return lambda recs: getattr(recs[0], field)
-  def func(recs):
-    for rec in recs:
-      val = getattr(rec, field, "")
-      if val != "":
-        return val
-    return getattr(recs[0], field, "")
-  return func
+    return Aggregator(lambda: _NO_REC, lambda s, r: r if s is _NO_REC else s,
+                      finalize=lambda s: getattr(s, field))
+  return Aggregator(str, lambda s, r: s if s != "" else getattr(r, field, ""))
 def LAST(field, include_blank=False):
   if include_blank:
-    return lambda recs: getattr(recs[-1], field)
-  def func(recs):
-    revrecs = recs
-    revrecs.reverse()
-    for rec in revrecs: # reverse in place
-      val = getattr(rec, field, "")
-      if val != "":
-        return val
-    return getattr(revrecs[0], field, "")
-  return func
+    return Aggregator(lambda: _NO_REC, lambda s, r: r, finalize=lambda s: getattr(s, field))
+  def step(s, r):
+    val = getattr(r, field, "")
+    return val if val != "" else s
+  return Aggregator(str, step)
+
+def _extreme(field, better, name):
+  """min or max of a field, keeping the first of equal values."""
+  def step(s, r):
+    val = getattr(r, field)
+    return val if s is _NO_REC or better(val, s) else s
+  def merge(a, b):
+    return b if a is _NO_REC or (b is not _NO_REC and better(b, a)) else a
+  def finalize(s):
+    if s is _NO_REC:
+      raise ValueError("%s() of no records" % name)
+    return s
+  return Aggregator(lambda: _NO_REC, step, merge, finalize)
+
 def MIN(field):
-  return lambda recs: min(getattr(rec, field) for rec in recs)
+  return _extreme(field, operator.lt, "MIN")
 def MAX(field):
-  return lambda recs: max(getattr(rec, field) for rec in recs)
+  return _extreme(field, operator.gt, "MAX")
 def CONCAT(field, sep=",", filterfunc=None, sortfunc=None, uniquify=True):
-  def concatfunc(recs):
-    res = [str(getattr(rec, field)) for rec in recs if filterfunc is None or filterfunc(rec)]
-    if uniquify:
-      res = list(set(res))
-    return sep.join(sorted(res, key=sortfunc))
-  return concatfunc
+  add = set.add if uniquify else list.append
+  def step(res, rec):
+    if filterfunc is None or filterfunc(rec):
+      add(res, str(getattr(rec, field)))
+    return res
+  return Aggregator(set if uniquify else list, step, _union if uniquify else operator.add,
+                    lambda res: sep.join(sorted(res, key=sortfunc)))
 
 def MERGEFIELDS(fields="", joinstr=" "):
   """across several fields, keep the first non-empty value."""
-  def mergefunc(recs):
-    res = {}
-    for rec in recs:
-      for fld in fields.split():
-        val = getattr(rec, fld, "")
-        if val != "":
-          res[fld] = val
-    return joinstr.join(str(res.get(fld, "")) for fld in fields.split())
-  return mergefunc
+  fields = fields.split()
+  def step(res, rec):
+    for fld in fields:
+      val = getattr(rec, fld, "")
+      if val != "":
+        res[fld] = val
+    return res
+  return Aggregator(dict, step,
+                    finalize=lambda res: joinstr.join(str(res.get(fld, "")) for fld in fields))
 
 def FLOAT(field):
   return lambda rec: float(getattr(rec, field))
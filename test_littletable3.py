@@ -0,0 +1,830 @@
+"""Unit tests for littletable3 - run with C{python -m unittest discover -p "test_*.py"}"""
+import collections
+import sys
+import unittest
+
+import littletable3 as lt
+
+
+def make_table(name, rows, **kwargs):
+    """Table of DataObjects built from a list of dicts."""
+    tbl = lt.Table(name, **kwargs)
+    tbl.insert_many(lt.DataObject(**row) for row in rows)
+    return tbl
+
+
+def ids(tbl):
+    return sorted(r.id for r in tbl)
+
+
+def sample_rows(n=60):
+    colors = ["red", "green", "blue", None]
+    return [dict(id=i, a=i % 7, b=(i * 3) % 5, color=colors[i % 4], name="n%02d" % (i % 25))
+            for i in range(n)]
+
+
+def group_records(tbl, keyfn):
+    ret = {}
+    for r in tbl:
+        ret.setdefault(keyfn(r), []).append(r)
+    return ret
+
+
+class BitmapIndexTest(unittest.TestCase):
+    """bitmap indexes give the same where() results as hash and sorted indexes, and as
+    an unindexed scan"""
+    criteria = [dict(a=3), dict(a=0), dict(a__ne=2), dict(a__in=[1, 2, 9]), dict(a__gt=4),
+                dict(a__ge=4), dict(a__lt=2), dict(a__le=2), dict(a__between=(2, 4)),
+                dict(color="red"), dict(color=None), dict(color__isnull=True),
+                dict(color__isnull=False), dict(color__in=["red", None]), dict(color__gt="c"),
+                dict(name__startswith="n1"), dict(name__like="n_5"), dict(a=3, color="blue"),
+                dict(a__gt=2, b=1)]
+
+    def setUp(self):
+        self.plain = make_table("plain", sample_rows())
+        self.indexed = {}
+        for kind in ("hash", "sorted", "bitmap"):
+            tbl = self.indexed[kind] = make_table(kind, sample_rows())
+            for attr in ("a", "color", "name"):
+                tbl.create_index(attr, kind=kind)
+
+    def check_all(self):
+        for crit in self.criteria:
+            expected = ids(self.plain.where(**crit))
+            for kind, tbl in self.indexed.items():
+                self.assertEqual(ids(tbl.where(**crit)), expected, (kind, crit))
+                self.assertEqual(sorted(r.id for r in tbl.iter_where(**crit)), expected, (kind, crit))
+
+    def test_where(self):
+        self.check_all()
+
+    def test_after_changes(self):
+        for tbl in [self.plain] + self.indexed.values():
+            tbl.insert(lt.DataObject(id=100, a=3, b=1, color="blue", name="n15"))
+            tbl.insert_many(lt.DataObject(id=101 + i, a=i, b=0, color=None, name="x")
+                            for i in range(5))
+            tbl.remove(tbl.where(id=7)[0])
+            tbl.delete_where(lambda r: r.b == 2)
+        self.check_all()
+
+    def test_views(self):
+        for kind, tbl in self.indexed.items():
+            view = tbl.where(b__in=[0, 1])
+            self.assertEqual(ids(view.where(a__gt=3, color="red")),
+                             ids(self.plain.where(b__in=[0, 1]).where(a__gt=3, color="red")), kind)
+
+    def test_combined_expressions(self):
+        col = lt.col
+        tbl = self.indexed["bitmap"]
+        expr = ((col("a") == 1) | (col("color") == "red")) & ~(col("a").isin([3, 5]))
+        fn = lambda r: (r.a == 1 or r.color == "red") and r.a not in (3, 5)
+        self.assertEqual(ids(tbl.where(expr)), ids(self.plain.where(fn)))
+
+    def test_after_sort(self):
+        tbl = self.indexed["bitmap"]
+        tbl.sort("b desc")
+        self.plain.sort("b desc")
+        self.check_all()
+        self.assertEqual([r.id for r in tbl.where(color="red")],
+                         [r.id for r in self.plain.where(color="red")])
+        self.assertEqual(tbl.hist("a"), self.plain.hist("a"))
+
+
+class InsertManyTest(unittest.TestCase):
+    def test_matches_single_inserts(self):
+        for kind in ("hash", "sorted", "bitmap"):
+            one, bulk = lt.Table("one"), lt.Table("bulk")
+            for tbl in (one, bulk):
+                tbl.create_index("a", kind=kind)
+                tbl.create_index(["a", "b"], kind=kind)
+            recs = [lt.DataObject(**row) for row in sample_rows()]
+            for rec in recs:
+                one.insert(rec)
+            bulk.insert_many(recs)
+            for crit in [dict(a=0), dict(a=3), dict(a=3, b=4), dict(a__ne=1)]:
+                self.assertEqual(ids(bulk.where(**crit)), ids(one.where(**crit)), (kind, crit))
+
+    def test_unique_index(self):
+        # a unique index does not accept None keys by default
+        tbl = make_table("t", sample_rows()[1:])
+        tbl.create_index("id", unique=True)
+        self.assertRaises(KeyError, tbl.insert, lt.DataObject(id=5))
+        self.assertRaises(KeyError, tbl.insert, lt.DataObject(id=None))
+        # a batch with a duplicate key is rejected as a whole
+        self.assertRaises(KeyError, tbl.insert_many, [lt.DataObject(id=200), lt.DataObject(id=200)])
+        self.assertRaises(KeyError, tbl.insert_many, [lt.DataObject(id=201), lt.DataObject(id=5)])
+        self.assertEqual(len(tbl), 59)
+        self.assertEqual(tbl.where(id=201).obs, [])
+        self.assertEqual(tbl.id[5].a, 5)
+
+
+class CompositeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.plain = make_table("plain", sample_rows())
+
+    def test_where(self):
+        for kind in ("hash", "sorted", "bitmap"):
+            tbl = make_table("t", sample_rows())
+            tbl.create_index(["a", "b"], kind=kind)
+            for a, b in [(3, 4), (0, 0), (6, 2), (9, 9)]:
+                self.assertEqual(ids(tbl.where(a=a, b=b)), ids(self.plain.where(a=a, b=b)), kind)
+            self.assertEqual(ids(tbl.where(a=3, b=4, color="red")),
+                             ids(self.plain.where(a=3, b=4, color="red")), kind)
+
+    def test_join(self):
+        other = make_table("o", [dict(a=a, b=b, ab=a * 10 + b) for a in range(7) for b in range(3)])
+        joined = self.plain.join(other, "id ab", a="a", b="b")
+        self.assertEqual(sorted((r.id, r.ab) for r in joined),
+                         sorted((r.id, r.a * 10 + r.b) for r in self.plain if r.b < 3))
+
+    def test_kinds_without_composite_keys(self):
+        tbl = make_table("t", sample_rows())
+        for kind in ("tokens", "prefix"):
+            self.assertRaises(ValueError, tbl.create_index, ("a", "name"), kind=kind)
+        self.assertEqual(ids(tbl.where(a=3, name="n03")), [3])
+
+
+class IndexStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.tbl = make_table("t", sample_rows(100))
+        self.tbl.create_index("a")
+        self.tbl.create_index("color")
+
+    def test_stats(self):
+        stats = self.tbl.index_stats("a")
+        self.assertEqual((stats["count"], stats["distinct"], stats["nulls"]), (100, 6, 15))
+        self.assertEqual(stats["top"][0], (1, 15))
+        self.assertEqual(stats["histogram"][-1], (6, 85))
+        stats = self.tbl.index_stats("color")
+        self.assertEqual((stats["distinct"], stats["nulls"]), (3, 25))
+
+    def test_criteria_order_does_not_change_results(self):
+        plain = make_table("p", sample_rows(100))
+        for crit in [dict(a=1, color="red", b=2), dict(a__in=[1, 2], color__ne="red"),
+                     dict(color=None, a=0)]:
+            self.assertEqual(ids(self.tbl.where(**crit)), ids(plain.where(**crit)))
+
+    def test_pivot(self):
+        pivot = self.tbl.pivot("color a")
+        self.assertEqual(sum(len(sub) for sub in pivot.subtables), 100)
+        for sub in pivot.subtables:
+            color = sub.pivot_key()[0][1]
+            for subsub in sub.subtables:
+                a = subsub.pivot_key()[1][1]
+                self.assertEqual(ids(subsub), ids(self.tbl.where(color=color, a=a)))
+
+
+class SortedIndexTest(unittest.TestCase):
+    def make(self, indexed):
+        tbl = make_table("t", [dict(id=i, a=i % 3, b=(i * 7) % 11) for i in range(24)])
+        if indexed:
+            tbl.create_index("a", kind="sorted")
+        return tbl
+
+    def test_sort_is_stable(self):
+        for sorts in [["b", "a"], ["b desc", "a"], ["b", "a desc"], ["id desc", "a"]]:
+            results = []
+            for indexed in (False, True):
+                tbl = self.make(indexed)
+                for key in sorts:
+                    tbl.sort(key)
+                results.append([(r.a, r.b) for r in tbl])
+            self.assertEqual(results[1], results[0], sorts)
+
+    def test_sorted_index_answers_ranges(self):
+        plain, indexed = self.make(False), self.make(True)
+        for crit in [dict(a__gt=0), dict(a__le=1), dict(a__between=(1, 2)), dict(a__in=[0, 2])]:
+            self.assertEqual(ids(indexed.where(**crit)), ids(plain.where(**crit)))
+        self.assertEqual((indexed.min("a"), indexed.max("a")), (0, 2))
+
+
+class ExprTest(unittest.TestCase):
+    def setUp(self):
+        self.tbl = make_table("t", sample_rows())
+
+    def test_expressions_match_functions(self):
+        col = lt.col
+        cases = [(col("a") > 3, lambda r: r.a > 3),
+                 ((col("a") + col("b")) * 2 >= 10, lambda r: (r.a + r.b) * 2 >= 10),
+                 ((col("color") == "red") | ~(col("b") < 3),
+                  lambda r: r.color == "red" or not r.b < 3),
+                 (col("a").isin([1, 2]) & (col("b") != 0), lambda r: r.a in (1, 2) and r.b != 0)]
+        for expr, fn in cases:
+            self.assertEqual(ids(self.tbl.where(expr)), ids(self.tbl.where(fn)))
+
+    def test_extracted_criteria_use_indexes(self):
+        col, lit = lt.col, lt.lit
+        indexed = make_table("i", sample_rows())
+        indexed.create_index("a")
+        expr = (col("a") == 3) & (col("b") * lit(2) > col("a"))
+        self.assertEqual(ids(indexed.where(expr)),
+                         ids(self.tbl.where(lambda r: r.a == 3 and r.b * 2 > 3)))
+        self.assertEqual(indexed.index_report().where(attr="a")[0].uses, 1)
+
+    def test_expression_as_function(self):
+        expr = lt.col("a") * 10 + lt.col("b")
+        self.assertEqual([expr(r) for r in self.tbl], [r.a * 10 + r.b for r in self.tbl])
+
+
+class TopRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.tbl = make_table("t", sample_rows())
+
+    def test_orderby_limit(self):
+        top = self.tbl.where(b__gt=0, _orderby="a desc,id", _limit=5)
+        expected = sorted((r for r in self.tbl if r.b > 0), key=lambda r: (-r.a, r.id))[:5]
+        self.assertEqual([r.id for r in top], [r.id for r in expected])
+
+    def test_same_as_sort_then_slice(self):
+        for orderby in ["a", "a desc", "b,a desc", "color"]:
+            for limit in (1, 7, 100):
+                expected = list(self.tbl.where(a__ne=2))
+                lt._sort_records(expected, orderby)
+                top = self.tbl.where(a__ne=2, _orderby=orderby, _limit=limit)
+                self.assertEqual([r.id for r in top], [r.id for r in expected[:limit]],
+                                 (orderby, limit))
+
+    def test_query_sort_limit(self):
+        query = self.tbl.query(b=1).sort("a desc").limit(3)
+        self.assertEqual(query.explain()[1:], ["topk 3"])
+        self.assertEqual([r.id for r in query],
+                         [r.id for r in self.tbl.where(b=1, _orderby="a desc", _limit=3)])
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.tbl = make_table("t", sample_rows())
+
+    def test_query_matches_eager(self):
+        query = (self.tbl.query(color="red").addfield("ab", lambda r: r.a * 10 + r.b)
+                 .where(ab__gt=20).sort("ab desc").limit(4))
+        eager = self.tbl.where(color="red").where(lambda r: r.a * 10 + r.b > 20)
+        expected = sorted(eager, key=lambda r: -(r.a * 10 + r.b))[:4]
+        self.assertEqual([r.id for r in query.run()], [r.id for r in expected])
+        self.assertEqual(query.explain()[0], "where(color='red') on table 't'")
+
+    def test_criteria_pushed_past_unrelated_steps(self):
+        query = (self.tbl.query().addfield("ab", lambda r: r.a * 10 + r.b)
+                 .where(lambda r: r.id % 2).where(b=1, ab__lt=40))
+        plan = query.explain()
+        self.assertEqual(plan[0], "where(b=1) on table 't'")
+        self.assertEqual(plan[1:], ["addfield", "filter ab__lt=40", "filter"])
+        self.assertEqual(sorted(r.id for r in query),
+                         ids(self.tbl.where(lambda r: r.id % 2 and r.b == 1 and r.a < 4)))
+
+    def test_groupby_step(self):
+        query = self.tbl.query(b__gt=1).groupby("a", n=lt.COUNT()).where(n__gt=4)
+        expected = self.tbl.where(b__gt=1).groupby("a", n=lt.COUNT()).where(n__gt=4)
+        self.assertEqual(sorted((r.a, r.n) for r in query), sorted((r.a, r.n) for r in expected))
+
+
+class AggregatorTest(unittest.TestCase):
+    """aggregators computed in one pass give the same values as over each group's list"""
+    def setUp(self):
+        self.tbl = make_table("t", sample_rows())
+
+    def test_aggregates(self):
+        result = self.tbl.groupby("a", n=lt.COUNT(), total=lt.SUM("b"), avg=lt.AVG("b"),
+                                  lo=lt.MIN("id"), hi=lt.MAX("id"),
+                                  names=lt.COUNT_DISTINCT("name"), first=lt.FIRST("name"),
+                                  ids=lambda recs: [r.id for r in recs])
+        groups = group_records(self.tbl, lambda r: r.a)
+        self.assertEqual(sorted(r.a for r in result), sorted(groups))
+        for rec in result:
+            recs = groups[rec.a]
+            self.assertEqual(rec.n, len(recs))
+            self.assertEqual(rec.total, sum(r.b for r in recs))
+            self.assertAlmostEqual(rec.avg, float(rec.total) / len(recs))
+            self.assertEqual((rec.lo, rec.hi), (min(r.id for r in recs), max(r.id for r in recs)))
+            self.assertEqual(rec.names, len(set(r.name for r in recs)))
+            self.assertEqual(rec.first, recs[0].name)
+            self.assertEqual(rec.ids, [r.id for r in recs])
+
+    def test_custom_aggregator(self):
+        span = lt.Aggregator(lambda: None,
+                             lambda state, rec: (rec.id, rec.id) if state is None
+                                                else (state[0], rec.id),
+                             finalize=lambda state: state[1] - state[0])
+        recs = list(self.tbl.where(a=2))
+        self.assertEqual(span(recs), recs[-1].id - recs[0].id)
+        result = self.tbl.groupby("a", span=span)
+        for rec in result:
+            recs = list(self.tbl.where(a=rec.a))
+            self.assertEqual(rec.span, recs[-1].id - recs[0].id)
+
+    def test_addsummaryrow(self):
+        total = sum(r.b for r in self.tbl)
+        result = self.tbl.addsummaryrow(n=lt.COUNT(), total=lt.SUM("b"), label="all",
+                                        reds=lt.COUNT_IF(lambda r: r.color == "red"),
+                                        ids=lambda recs: len(recs))
+        summary = result.obs[-1]
+        self.assertEqual(len(result), 61)
+        self.assertEqual((summary.n, summary.total, summary.label, summary.reds, summary.ids),
+                         (60, total, "all", 15, 60))
+
+    def test_hist(self):
+        groups = group_records(self.tbl, lambda r: r.b)
+        self.assertEqual(self.tbl.hist("b"), dict((k, len(v)) for k, v in groups.items()))
+        self.assertEqual(self.tbl.hist("b", lt.SUM("a")),
+                         dict((k, sum(r.a for r in v)) for k, v in groups.items()))
+
+    def test_rollupfields(self):
+        result = self.tbl.groupby("name", rollupfields="SUM:a,b")
+        self.assertEqual(len(result), 25)
+        for rec in result:
+            recs = self.tbl.where(name=rec.name)
+            self.assertEqual((rec.a, rec.b), (sum(r.a for r in recs), sum(r.b for r in recs)))
+
+
+class GroupbyKeysTest(unittest.TestCase):
+    """groupby on a list of columns keys each group on the tuple of their values"""
+    def setUp(self):
+        self.tbl = make_table("t", sample_rows())
+
+    def test_multiple_columns(self):
+        result = self.tbl.groupby(["a", "b"], n=lt.COUNT(), composite_index=True)
+        groups = group_records(self.tbl, lambda r: (r.a, r.b))
+        self.assertEqual(sorted((r.a, r.b, r.n) for r in result),
+                         sorted(k + (len(v),) for k, v in groups.items()))
+        self.assertEqual(len(result.where(a=3, b=4)), 1)
+
+    def test_values_keep_their_types(self):
+        tbl = make_table("t", [dict(a=1, s="x_xx_y", n=1), dict(a=1, s="x_xx_y", n=2),
+                               dict(a=1.5, s="x", n=3), dict(a="1", s="x", n=4)])
+        result = tbl.groupby(["a", "s"], total=lt.SUM("n"))
+        self.assertEqual(sorted((repr(r.a), r.s, r.total) for r in result),
+                         [("'1'", "x", 4), ("1", "x_xx_y", 3), ("1.5", "x", 3)])
+
+    def test_single_column(self):
+        result = self.tbl.groupby(["b"], n=lt.COUNT())
+        self.assertEqual(sorted((r.b, r.n) for r in result), [(b, 12) for b in range(5)])
+
+    def test_include_all(self):
+        result = self.tbl.groupby(["a", "b"], include_all="*", n=lt.COUNT(),
+                                  composite_index=True)
+        everything = result.where(a="*", b="*")
+        self.assertEqual(len(everything), 1)
+        self.assertEqual(everything.obs[0].n, 60)
+        self.assertEqual(sum(r.n for r in result), 120)
+
+
+class JoinGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.custs = make_table("custs", [dict(cid=i, cname="c%d" % i) for i in range(5)])
+        self.orders = make_table("orders", [dict(oid=i, cid=i % 6, sku=i % 4) for i in range(20)])
+        self.items = make_table("items", [dict(sku=i, price=i * 1.5) for i in range(3)])
+        for tbl, attr in ((self.custs, "cid"), (self.orders, "cid"), (self.items, "sku")):
+            tbl.create_index(attr)
+
+    def test_join_expression(self):
+        joined = (self.custs.join_on("cid") + self.orders.join_on("cid") +
+                  self.items.join_on("sku"))("cname oid price")
+        expected = sorted(("c%d" % (i % 6), i, (i % 4) * 1.5) for i in range(20)
+                          if i % 6 < 5 and i % 4 < 3)
+        self.assertEqual(sorted((r.cname, r.oid, r.price) for r in joined), expected)
+
+    def test_join_order_does_not_change_results(self):
+        self.orders.create_index("sku")
+        joins = [self.custs.join_on("cid") + self.orders.join_on("cid") + self.items.join_on("sku"),
+                 self.items.join_on("sku") + self.orders.join_on("sku") + self.custs.join_on("cid")]
+        results = [sorted((r.cname, r.oid, r.price) for r in join("cname oid price"))
+                   for join in joins]
+        self.assertEqual(results[0], results[1])
+
+    def test_records_missing_columns(self):
+        self.custs.insert(lt.DataObject(cid=5))
+        self.items.insert(lt.DataObject(sku=3))
+        joined = (self.custs.join_on("cid") + self.orders.join_on("cid") +
+                  self.items.join_on("sku"))("cname oid price")
+        two_way = self.custs.join(self.orders, "cname oid sku", cid="cid")
+        self.assertEqual(len(joined), 20)
+        self.assertEqual(sorted((r.cname, r.oid) for r in joined),
+                         sorted((r.cname, r.oid) for r in two_way))
+        self.assertEqual(sorted(r.oid for r in joined if r.cname is None), [5, 11, 17])
+        self.assertEqual(sorted(r.oid for r in joined if r.price is None), [3, 7, 11, 15, 19])
+
+
+class BloomJoinTest(unittest.TestCase):
+    """joins reduced by a Bloom filter give the same results as plain joins"""
+    def setUp(self):
+        self.orders = make_table("orders", [dict(oid=i, sku=i % 50) for i in range(400)])
+        self.items = make_table("items", [dict(sku=s, price=s * 10) for s in range(0, 100, 3)])
+        self.items.create_index("sku")
+
+    def joined(self, **kwargs):
+        joined = self.orders.join(self.items, "oid price", sku="sku", **kwargs)
+        return sorted((r.oid, r.price) for r in joined)
+
+    def test_bloom_join(self):
+        self.assertEqual(self.joined(bloom=True), self.joined())
+        self.assertEqual(self.joined(bloom=0.2, bloom_maxbytes=8), self.joined())
+
+    def test_outer_joins_keep_unmatched_records(self):
+        for how in ("left", "right", "full"):
+            self.assertEqual(self.joined(how=how, bloom=True), self.joined(how=how), how)
+
+    def test_bad_error_rate(self):
+        self.assertRaises(ValueError, self.joined, bloom=1.5)
+
+
+class SlottedRecordsTest(unittest.TestCase):
+    def test_addfield_extends_schema(self):
+        tbl = lt.Table("t")
+        tbl.set_known_fields("a b", slots=True)
+        tbl.insert_many(lt.record_class(["a", "b"])(a=i, b=str(i)) for i in range(5))
+        tbl.create_index("a")
+        tbl.addfield("c", lambda r: r.a * 2)
+        self.assertEqual([r.c for r in tbl], [0, 2, 4, 6, 8])
+        self.assertEqual(tbl.where(a=3)[0].c, 6)
+
+    def test_columnar_addfield_with_slots(self):
+        tbl = lt.Table("t", columnar=True)
+        tbl.set_known_fields("a b", slots=True)
+        tbl.insert_many(lt.DataObject(a=i, b=str(i)) for i in range(5))
+        tbl.create_index("a")
+        tbl.addfield("c", lambda r: r.a * 2)
+        tbl.addfields("d e", lambda r: (r.a + 1, r.a + 2))
+        self.assertEqual([(r.c, r.d, r.e) for r in tbl], [(i*2, i+1, i+2) for i in range(5)])
+        # indexed lookups see the new columns
+        self.assertEqual(tbl.where(a=3)[0].c, 6)
+
+
+class RemoveTest(unittest.TestCase):
+    def setUp(self):
+        self.recs = [lt.DataObject(id=i + 1, a=i % 3) for i in range(9)]
+        self.tbl = lt.Table("t")
+        self.tbl.insert_many(self.recs)
+        self.tbl.create_index("id", unique=True)
+        self.tbl.create_index("a")
+
+    def ids(self, tbl):
+        return sorted(r.id for r in tbl)
+
+    def test_remove(self):
+        self.tbl.remove(self.recs[0])
+        self.tbl.remove(self.recs[4])
+        self.assertEqual(len(self.tbl), 7)
+        self.assertEqual(self.ids(self.tbl), [2, 3, 4, 6, 7, 8, 9])
+        # false keys are filed under None by create_index, and must still be removed
+        self.assertEqual(self.ids(self.tbl.where(a=0)), [4, 7])
+        self.assertEqual(self.ids(self.tbl.where(a=1)), [2, 8])
+        self.assertEqual(self.ids(self.tbl.where(id=1)), [])
+
+    def test_remove_missing_object(self):
+        self.tbl.remove(lt.DataObject(id=100, a=1))
+        self.assertEqual(len(self.tbl), 9)
+
+    def test_remove_equal_object_not_in_table(self):
+        # records are matched by identity, in the record list and the indexes alike
+        self.tbl.remove(lt.DataObject(id=2, a=1))
+        self.assertEqual(self.ids(self.tbl), range(1, 10))
+        self.assertEqual(self.ids(self.tbl.where(id=2)), [2])
+        self.assertRaises(KeyError, self.tbl.insert, lt.DataObject(id=2, a=1))
+
+    def test_remove_equal_tuples(self):
+        rec = collections.namedtuple("rec", "id a")
+        tbl = lt.Table("t")
+        first, second = rec(1, 1), rec(1, 1)
+        tbl.insert_many([first, second])
+        tbl.create_index("a")
+        tbl.remove(rec(1, 1))
+        self.assertEqual((len(tbl), len(tbl.where(a=1))), (2, 2))
+        tbl.remove(second)
+        self.assertEqual(len(tbl), 1)
+        self.assertTrue(tbl.where(a=1)[0] is first)
+        self.assertTrue(tbl[0] is first)
+
+    def test_remove_twice(self):
+        self.tbl.remove(self.recs[3])
+        self.tbl.remove(self.recs[3])
+        self.assertEqual(len(self.tbl), 8)
+        self.assertEqual(self.ids(self.tbl.where(a=0)), [1, 7])
+
+    def test_remove_then_insert(self):
+        self.tbl.remove(self.recs[0])
+        self.tbl.insert(lt.DataObject(id=10, a=0))
+        self.assertEqual(self.ids(self.tbl), range(2, 11))
+        self.assertEqual(self.ids(self.tbl.where(a=0)), [4, 7, 10])
+
+    def test_remove_many_and_delete_where(self):
+        self.tbl.remove_many(self.recs[:3])
+        self.assertEqual(self.ids(self.tbl.where(a=0)), [4, 7])
+        self.assertEqual(self.tbl.delete_where(lambda r: r.a == 1), 2)
+        self.assertEqual(self.ids(self.tbl), [4, 6, 7, 9])
+        self.assertEqual(self.ids(self.tbl.where(a=1)), [])
+
+    def test_remove_with_bitmap_index(self):
+        tbl = make_table("t", [dict(id=i, c="rgb"[i % 3]) for i in range(9)])
+        tbl.create_index("c", kind="bitmap")
+        tbl.remove(tbl[1])
+        tbl.remove(tbl[3])
+        self.assertEqual(sorted(r.id for r in tbl.where(c="g")), [7])
+        self.assertEqual(sorted(r.id for r in tbl.where(c="r")), [0, 3, 6])
+
+    def test_remove_columnar_row(self):
+        tbl = lt.Table("t", columnar=True)
+        tbl.insert_many(lt.DataObject(id=i + 1, a=i % 3) for i in range(6))
+        tbl.create_index("a")
+        row = [r for r in tbl if r.id == 4][0]
+        tbl.remove(row)
+        self.assertEqual(len(tbl), 5)
+        self.assertEqual(sorted(r.id for r in tbl.where(a=0)), [1])
+        tbl.remove(lt.DataObject(id=99, a=0))
+        self.assertEqual(len(tbl), 5)
+
+    def test_reindex_matches_create_index(self):
+        tbl = lt.Table("t", columnar=True)
+        tbl.insert_many(lt.DataObject(id=i + 1, a=i % 3) for i in range(9))
+        tbl.create_index("a")
+        tbl.delete_where(lambda r: r.id > 6)
+        self.assertEqual(sorted(r.id for r in tbl.where(a=0)), [1, 4])
+
+class ColumnarWhereTest(unittest.TestCase):
+    def setUp(self):
+        rows = [dict(id=i, x=i * 7 % 10, q=[0, 1, 2, None][i % 4], s="ab"[i % 2]) for i in range(40)]
+        self.col = make_table("c", rows, columnar=True)
+        self.row = make_table("r", rows)
+
+    def check(self, *args, **kwargs):
+        ids = lambda tbl: sorted(r.id for r in tbl)
+        expected = ids(self.row.where(*args, **kwargs))
+        self.assertEqual(ids(self.col.where(*args, **kwargs)), expected)
+        return expected
+
+    def test_expression_comparisons(self):
+        self.assertTrue(self.check(lt.col("x") > 5))
+        self.assertTrue(self.check((lt.col("x") > 5) & (lt.col("s") == "a")))
+        self.assertTrue(self.check(lt.col("q") == None))
+        self.assertTrue(self.check(lt.col("q") < 2))
+
+    def test_keyword_criteria(self):
+        self.assertTrue(self.check(x__in=[1, 2], s="b"))
+        self.assertTrue(self.check(q__isnull=False, x__ge=3))
+        self.assertEqual(self.check(nosuchattr=1), [])
+
+    def test_expression_failing_in_bulk(self):
+        # x / q fails for q == 0 when evaluated over the whole column
+        self.assertTrue(self.check((lt.col("q") != 0) & (lt.col("x") / lt.col("q") > 2)))
+
+    def test_indexed_criteria(self):
+        self.col.create_index("x")
+        self.assertTrue(self.check(x=3, s="b"))
+
+
+class PrefixIndexTest(unittest.TestCase):
+    def setUp(self):
+        vals = [100, 101, "10A", "105", u"10-b", None, 20, "ANV7-001", "ANV-001", ["10"]]
+        rows = [dict(id=i, n=v) for i, v in enumerate(vals)]
+        rows.append(dict(id=len(vals)))
+        self.plain = make_table("p", rows)
+        self.indexed = make_table("k", rows)
+        self.indexed.create_index("n", kind="prefix")
+
+    def check(self, **kwargs):
+        ids = lambda tbl: sorted(r.id for r in tbl)
+        expected = ids(self.plain.where(**kwargs))
+        self.assertEqual(ids(self.indexed.where(**kwargs)), expected)
+        return expected
+
+    def test_startswith_matches_strings_only(self):
+        self.assertEqual(self.check(n__startswith="10"), [2, 3, 4])
+        self.assertEqual(self.check(n__startswith=""), [2, 3, 4, 7, 8])
+        self.assertEqual(self.check(n__startswith="2"), [])
+
+    def test_like(self):
+        self.assertEqual(self.check(n__like="ANV%-001"), [7, 8])
+        self.assertEqual(self.check(n__like="10_"), [2, 3])
+        self.assertEqual(self.check(n__like="1%"), [2, 3, 4])
+
+    def test_insert_and_remove(self):
+        for tbl in (self.plain, self.indexed):
+            tbl.insert(lt.DataObject(id=20, n="1000"))
+            tbl.insert(lt.DataObject(id=21, n=1000))
+            tbl.remove(tbl.where(id=3)[0])
+        self.assertEqual(self.check(n__startswith="10"), [2, 4, 20])
+
+
+class IndexReportTest(unittest.TestCase):
+    def setUp(self):
+        self.tbl = make_table("t", [dict(id=i, a=i % 5, b=i % 3) for i in range(30)])
+
+    def report(self):
+        return dict((r.attr, r) for r in self.tbl.index_report())
+
+    def test_deleted_auto_index_not_reported(self):
+        self.tbl.auto_index(threshold=2)
+        self.tbl.where(a=1)
+        self.tbl.where(a=2)
+        self.assertEqual(self.report()["a"].origin, "auto")
+        self.tbl.delete_index("a")
+        self.assertEqual(self.report()["a"].index, None)
+        self.assertEqual(self.report()["a"].origin, None)
+        self.tbl.create_index("a")
+        self.assertEqual(self.report()["a"].origin, "user")
+
+    def test_range_scans_advice(self):
+        self.tbl.where(b__gt=1)
+        self.tbl.where(a__gt=1)
+        self.tbl.create_index("a")
+        self.assertEqual(self.report()["b"].advice, "create sorted")
+        self.assertEqual(self.report()["a"].advice, "replace with sorted")
+        self.tbl.delete_index("a")
+        self.tbl.create_index("a", kind="sorted")
+        self.assertEqual(self.report()["a"].advice, "unused")
+        self.tbl.where(a__gt=3)
+        self.assertEqual(self.report()["a"].advice, "ok")
+
+
+class JoinTest(unittest.TestCase):
+    def setUp(self):
+        self.orders = make_table("orders", [dict(id=1, cust=10, qty=2, note="rush"),
+                                            dict(id=2, cust=20, qty=1),
+                                            dict(id=3, cust=30, qty=5, note="gift")])
+        self.custs = make_table("custs", [dict(cust=10, name="Ann"), dict(cust=20),
+                                          dict(cust=40, name="Dee")])
+
+    def rows(self, tbl, names):
+        return sorted(tuple(getattr(r, n, None) for n in names) for r in tbl)
+
+    def test_records_missing_columns(self):
+        # the columns are taken from each table's first record; later records without
+        # them join with None values
+        joined = self.orders.join(self.custs, cust="cust")
+        self.assertEqual(self.rows(joined, "id qty note name".split()),
+                         [(1, 2, "rush", "Ann"), (2, 1, None, None)])
+        joined = self.orders.join(self.custs, "id note name", cust="cust")
+        self.assertEqual(self.rows(joined, "id note name".split()),
+                         [(1, "rush", "Ann"), (2, None, None)])
+
+    def test_records_missing_columns_in_sorted_join(self):
+        self.orders.create_index("cust", kind="sorted")
+        self.custs.create_index("cust", kind="sorted")
+        joined = self.orders.join(self.custs, cust="cust")
+        self.assertEqual(self.rows(joined, "id note name".split()),
+                         [(1, "rush", "Ann"), (2, None, None)])
+
+
+class JoinKeyTest(unittest.TestCase):
+    """joins match keys by equality, whatever indexes the tables have"""
+    akeys = [0, None, "", 1, 2, 0, None, False, "x"]
+    bkeys = [0, None, "", 1, 3, None, "x"]
+
+    def make(self, name, keys, index_first=False, **index_args):
+        tbl = lt.Table(name)
+        if index_first:
+            tbl.create_index("k", **index_args)
+        tbl.insert_many(lt.DataObject(k=k, i=i) for i, k in enumerate(keys))
+        if not index_first:
+            # a record without the join attribute
+            tbl.insert(lt.DataObject(i=len(keys)))
+            tbl.create_index("k", **index_args)
+        return tbl
+
+    def expected(self, a, b, how):
+        a = [(r.i, getattr(r, "k", lt._MISSING)) for r in a]
+        b = [(r.i, getattr(r, "k", lt._MISSING)) for r in b]
+        match = lambda x, y: x is not lt._MISSING and y is not lt._MISSING and x == y
+        ret = [(i, j) for i, x in a for j, y in b if match(x, y)]
+        if how in ("left", "full"):
+            ret += [(i, None) for i, x in a if not any(match(x, y) for j, y in b)]
+        if how in ("right", "full"):
+            ret += [(None, j) for j, y in b if not any(match(x, y) for i, x in a)]
+        return sorted(ret)
+
+    def check(self, a, b):
+        for how in ("inner", "left", "right", "full"):
+            joined = a.join(b, [(a, "i", "ai"), (b, "i", "bi")], how=how, k="k")
+            self.assertEqual(sorted((r.ai, r.bi) for r in joined), self.expected(a, b, how), how)
+        semi = sorted(r.i for r in a.join(b, how="semi", k="k"))
+        anti = sorted(r.i for r in a.join(b, how="anti", k="k"))
+        self.assertEqual(semi, sorted(set(i for i, j in self.expected(a, b, "inner"))))
+        self.assertEqual(sorted(semi + anti), sorted(r.i for r in a))
+
+    def test_hash_indexes(self):
+        self.check(self.make("a", self.akeys), self.make("b", self.bkeys))
+        self.check(self.make("a", self.akeys, True), self.make("b", self.bkeys, True))
+        self.check(self.make("a", self.akeys, True), self.make("b", self.bkeys))
+
+    def test_sorted_indexes(self):
+        self.check(self.make("a", self.akeys, kind="sorted"),
+                   self.make("b", self.bkeys, kind="sorted"))
+
+    def test_unique_index(self):
+        bkeys, self.bkeys = self.bkeys, [0, None, 1, 3, "x"]
+        try:
+            self.check(self.make("a", self.akeys),
+                       self.make("b", self.bkeys, unique=True, accept_none=True))
+        finally:
+            self.bkeys = bkeys
+
+    def test_parallel_join_matches_serial(self):
+        a, b = self.make("a", self.akeys), self.make("b", self.bkeys)
+        cols = [(a, "i", "ai"), (b, "i", "bi")]
+        for how in ("inner", "left"):
+            serial = sorted((r.ai, r.bi) for r in a.join(b, cols, how=how, k="k"))
+            parallel = sorted((r.ai, r.bi) for r in a.join(b, cols, how=how, k="k", workers=2))
+            self.assertEqual(parallel, serial, how)
+            self.assertEqual(serial, self.expected(a, b, how), how)
+
+    def test_empty_table_columns(self):
+        a = make_table("a", [dict(k=1, x="a"), dict(k=2, x="b")])
+        b = lt.Table("b")
+        b.set_known_fields("k y")
+        left = a.join(b, how="left", k="k")
+        self.assertEqual(sorted((r.x, r.y) for r in left), [("a", None), ("b", None)])
+        c = lt.Table("c").create_index("k").create_index("z")
+        left = a.join(c, "x z", how="left", k="k")
+        self.assertEqual(sorted((r.x, r.z) for r in left), [("a", None), ("b", None)])
+
+
+class PrefixBoundTest(unittest.TestCase):
+    def test_prefix_ending_in_highest_character(self):
+        top = unichr(sys.maxunicode)
+        vals = [u"a", u"a" + top, u"a" + top + u"x", u"a" + top + top, u"b", top + top]
+        tbl = make_table("t", [dict(id=i, s=v) for i, v in enumerate(vals)])
+        tbl.create_index("s", kind="sorted")
+        ids = lambda prefix: sorted(r.id for r in tbl.where(s__startswith=prefix))
+        self.assertEqual(ids(u"a" + top), [1, 2, 3])
+        self.assertEqual(ids(u"a" + top + top), [3])
+        self.assertEqual(ids(top), [5])
+        self.assertEqual(ids(u"a"), [0, 1, 2, 3])
+
+    def test_upper_bound(self):
+        top = unichr(sys.maxunicode)
+        self.assertEqual(lt._prefix_upper_bound(u"ab"), u"ac")
+        self.assertEqual(lt._prefix_upper_bound(u"a" + top), u"b")
+        self.assertEqual(lt._prefix_upper_bound(top + top), None)
+        self.assertEqual(lt._prefix_upper_bound("a\xff"), "b")
+        self.assertEqual(lt._prefix_upper_bound("\xff"), None)
+
+
+class TokenIndexTest(unittest.TestCase):
+    def setUp(self):
+        vals = ["apple pie", "pineapple", "apple", "red apple tart", ["apple", "pear"], 42, None]
+        rows = [dict(id=i, s=v) for i, v in enumerate(vals)]
+        rows.append(dict(id=len(vals)))
+        self.plain = make_table("p", rows)
+        self.indexed = make_table("k", rows)
+        self.indexed.create_index("s", kind="tokens")
+
+    def check(self, **kwargs):
+        ids = lambda tbl: sorted(r.id for r in tbl)
+        expected = ids(self.plain.where(**kwargs))
+        self.assertEqual(ids(self.indexed.where(**kwargs)), expected)
+        self.assertEqual(ids(self.indexed.where(id__lt=6).where(**kwargs)),
+                         ids(self.plain.where(id__lt=6).where(**kwargs)))
+        return expected
+
+    def test_contains_is_substring_test(self):
+        self.assertEqual(self.check(s__contains="apple"), [0, 1, 2, 3, 4])
+        self.assertEqual(self.check(s__contains="ppl"), [0, 1, 2, 3])
+        self.assertEqual(self.check(s__contains="pie"), [0])
+        self.assertEqual(self.check(s__contains="apple tart"), [3])
+
+    def test_hastoken_matches_whole_words(self):
+        self.assertEqual(self.check(s__hastoken="apple"), [0, 2, 3, 4])
+        self.assertEqual(self.check(s__hastoken="tart apple"), [3])
+        self.assertEqual(self.check(s__hastoken="ppl"), [])
+
+
+LIMIT = 1
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tbl = make_table("t", [dict(id=i, a=i % 2) for i in range(4)])
+        self.tbl.cache_results(lt.ResultCache())
+
+    def tearDown(self):
+        global LIMIT
+        LIMIT = 1
+
+    def test_repeated_query_uses_cache(self):
+        first = self.tbl.where(a=1)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(self.tbl._result_cache.stats()["hits"], 0)
+        self.assertEqual(len(self.tbl.where(a=1)), 2)
+        self.assertEqual(self.tbl._result_cache.stats()["hits"], 1)
+
+    def test_change_invalidates(self):
+        self.assertEqual(len(self.tbl.where(a=1)), 2)
+        self.tbl.insert(lt.DataObject(id=5, a=1))
+        self.assertEqual(len(self.tbl.where(a=1)), 3)
+
+    def test_function_reading_global(self):
+        global LIMIT
+        fn = lambda r: r.id > LIMIT
+        self.assertEqual(len(self.tbl.where(fn)), 2)
+        LIMIT = 2
+        self.assertEqual(len(self.tbl.where(fn)), 1)
+
+    def test_function_reading_mutable_value(self):
+        ids = [1]
+        fn = lambda r: r.id in ids
+        self.assertEqual(len(self.tbl.where(fn)), 1)
+        ids.append(2)
+        self.assertEqual(len(self.tbl.where(fn)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()